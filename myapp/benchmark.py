@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+"""
+Offline end-to-end benchmark of the views.
+
+Runs the Django app in-process against the fake Livy/Graph server and the fake
+token provider (myapp/fakes), with concurrent users, and reports for each view
+the p50/p99 latency and the requests per second.
+
+Usage (from the folder of manage.py):
+    python benchmark.py --users 10 --iterations 20 --latency 0.02
+    python benchmark.py --backend fabric --views me,memberOf,getLivyStatement --json
+    python benchmark.py --startup 10    # cold start of the worker processes only
+
+Each view is benchmarked in its own phase: all the users call it `--iterations`
+times concurrently (once for createLivySession and stopLivySession, and their /async
+versions). The async views (/async/...) run through the test client, outside of an
+ASGI server. The server-sent events views (streamLivyStatements, tailLivyLog) are
+timed until their end event, or until `--stream-events` events were received. The users log
+in with fake ID token claims, the sessions are kept in memory and the database is a
+temporary SQLite file, so nothing outside of the process is used.
+"""
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+VIEWS = [
+    "index", "requestLivyFabricToken", "me", "memberOf", "createLivySession", "checkLivySession",
+    "submitLivyStatement", "getLivyStatement", "getLivyStatements", "streamLivyStatements", "tailLivyLog",
+    "async/checkLivySession", "async/submitLivyStatement", "async/getLivyStatement", "async/streamLivyStatements",
+    "stopLivySession", "async/createLivySession", "async/stopLivySession",
+]
+ONCE_PER_USER = ("createLivySession", "stopLivySession", "async/createLivySession", "async/stopLivySession")
+# Server-sent events views: read until their end event, or `--stream-events` events
+STREAMS = ("streamLivyStatements", "async/streamLivyStatements", "tailLivyLog")
+
+
+def percentile(values, p):
+    # Nearest-rank percentile of a non-empty list
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def environment(args, url):
+    # Environment of the app, pointing to the fake servers (set before Django loads the settings and views)
+    os.environ.update({
+        "LIVY_BACKEND": args.backend,
+        "LIVY_STATE_STORE": args.state_store,
+        "LIVY_STATE_CACHE_URL": args.state_cache_url or "",
+        "LIVY_SESSION_REGISTRY_PATH": os.path.join(tempfile.mkdtemp(prefix="benchmark-"), "livy_sessions.sqlite3"),
+        "LIVY_BASE_ENDPOINT": url + ("/livyApi/versions/2023-12-01" if args.backend == "fabric" else ""),
+        "GRAPH_USER_ENDPOINT": url + "/v1.0/me",
+        "GRAPH_MEMBER_ENDPOINT": url + "/v1.0/me/memberOf",
+    })
+    for name, value in {
+        "DJANGO_SECRET": "benchmark", "TENANT_ID": "fake-tid", "CLIENT_ID": "fake-client", "CLIENT_SECRET": "fake-secret",
+        "REDIRECT_URI": "http://localhost:5000/azure_auth/callback", "LOGOUT_URI": "http://localhost:5000/logout",
+        "ROLES": "{}", "LIVY_REQUESTS_TIMEOUT": "30", "LIVY_SESSION_NAME_PREFIX": "Benchmark-",
+    }.items():
+        os.environ.setdefault(name, value)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "myapp.settings")
+
+
+def configure(args, server):
+    environment(args, server.url)
+
+    import django
+    from django.conf import settings
+    django.setup()
+    settings.ALLOWED_HOSTS = ["*"]
+    settings.SESSION_ENGINE = "django.contrib.sessions.backends.cache"
+    settings.DATABASES["default"]["NAME"] = os.path.join(tempfile.mkdtemp(prefix="benchmark-"), "db.sqlite3")
+    from django.core.management import call_command
+    call_command("migrate", verbosity=0)
+
+
+# Run in a new interpreter: time until the WSGI application of the workers (myapp.wsgi) is ready, then
+# time left to the first request to import the URLconf and the views, then time to build the services
+# of the views (on their first use)
+STARTUP_SCRIPT = """
+import importlib, time
+start = time.perf_counter()
+import myapp.wsgi
+ready = time.perf_counter()
+from django.conf import settings
+importlib.import_module(settings.ROOT_URLCONF)
+imported = time.perf_counter()
+from myapp import views
+for service in SERVICES:
+    getattr(views, service)()
+print(ready - start, imported - ready, time.perf_counter() - imported)
+"""
+SERVICES = ("graphClient", "livyScheduler", "livyHedger", "livyBreaker", "livyCallMetrics", "livyTokens", "livySessionReaper",
+            "livySessionRegistry", "livyBatchQueue", "livyOutputStore", "livyResultCache", "livyStatementPoller", "livyState",
+            "livyClients")
+
+
+def startup(args):
+    # Cold start of `args.startup` new processes (nothing is reused between them)
+    environment(args, "http://127.0.0.1:9")
+    ready, first_request, services = [], [], []
+    script = "SERVICES = " + repr(SERVICES) + STARTUP_SCRIPT
+    for _ in range(args.startup):
+        output = subprocess.run([sys.executable, "-c", script], check=True, capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split()
+        ready.append(float(output[0]))
+        first_request.append(float(output[1]))
+        services.append(float(output[2]))
+    return [
+        {"phase": phase, "runs": len(values), "p50_ms": round(percentile(values, 50) * 1000, 2),
+         "max_ms": round(max(values) * 1000, 2)}
+        for phase, values in (("worker ready", ready), ("first request imports", first_request),
+                               ("services first use", services))
+    ]
+
+
+def login(index):
+    from django.contrib.auth import get_user_model
+    from django.test import Client
+    from myapp.fakes.fake_msal import fake_id_token_claims
+    user, _ = get_user_model().objects.get_or_create(username="benchmark" + str(index))
+    client = Client()
+    client.force_login(user)
+    session = client.session
+    session["id_token_claims"] = fake_id_token_claims(user.username)
+    session.save()
+    return client
+
+
+def read_stream(response, max_events):
+    # Events of a server-sent events response, until its end event or `max_events` events
+    if response.is_async:
+        from asgiref.sync import async_to_sync
+        return async_to_sync(read_async_stream)(response, max_events)
+    content, events = b"", 0
+    try:
+        for chunk in response.streaming_content:
+            content += chunk
+            events += chunk.count(b"\n\n")
+            if b"event: end" in chunk or events >= max_events:
+                break
+    finally:
+        response.close()
+    return content
+
+
+async def read_async_stream(response, max_events):
+    content, events = b"", 0
+    chunks = response.streaming_content
+    try:
+        async for chunk in chunks:
+            content += chunk
+            events += chunk.count(b"\n\n")
+            if b"event: end" in chunk or events >= max_events:
+                break
+    finally:
+        await chunks.aclose()
+        response.close()
+    return content
+
+
+def call(client, view, state, stream_events=10):
+    # One request to `view`, returning whether it succeeded
+    if view.endswith("submitLivyStatement"):
+        response = client.post("/" + view, {"livy_code": "spark.range(10).count()"})
+    elif view.endswith("getLivyStatement"):
+        response = client.get("/" + view, {"id": state.get("statement_id", 0), "wait": 5})
+    elif view.endswith("checkLivySession"):
+        response = client.get("/" + view, {"wait": 10})
+    else:
+        response = client.get("/" + ("" if view == "index" else view))
+    if view in STREAMS:
+        content = read_stream(response, stream_events) if response.status_code < 400 else response.content
+        return response.status_code < 400 and b"event: error" not in content
+    content = getattr(response, "content", b"")
+    if view.endswith("submitLivyStatement"):
+        from myapp.views import livyState
+        ids = livyState().get_list(client.session.session_key, "livy_statement_ids")
+        if ids:
+            state["statement_id"] = ids[-1]
+    return response.status_code < 400 and b"&quot;status&quot;: &quot;error&quot;" not in content and b'"status": "error"' not in content
+
+
+def run_phase(clients, view, iterations, states, stream_events):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def user(client, state):
+        for _ in range(1 if view in ONCE_PER_USER else iterations):
+            start = time.perf_counter()
+            try:
+                ok = call(client, view, state, stream_events)
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += 0 if ok else 1
+
+    threads = [threading.Thread(target=user, args=(client, state)) for client, state in zip(clients, states)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    return {
+        "view": view,
+        "requests": len(latencies),
+        "errors": errors[0],
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "requests_per_second": round(len(latencies) / wall, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the views against the fake Livy/Graph server")
+    parser.add_argument("--users", type=int, default=10, help="concurrent users")
+    parser.add_argument("--iterations", type=int, default=20, help="requests per user and view")
+    parser.add_argument("--views", default=",".join(VIEWS), help="comma separated views, in order")
+    parser.add_argument("--backend", choices=("apache", "fabric"), default="apache")
+    parser.add_argument("--latency", type=float, default=0.01, help="fake Livy/Graph latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.005)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--token-latency", type=float, default=0.05, help="fake token provider latency in seconds")
+    parser.add_argument("--session-start-time", type=float, default=0.5)
+    parser.add_argument("--statement-time", type=float, default=0.1)
+    parser.add_argument("--output-size", type=int, default=1000)
+    parser.add_argument("--stream-events", type=int, default=10, help="events read from the server-sent events views")
+    parser.add_argument("--state-store", choices=("session", "cache", "memory"), default="session", help="store of the Livy state of the users")
+    parser.add_argument("--state-cache-url", help="Redis URL of the Livy state cache (default with --state-store cache: "
+                                                  "locmem://, a cache of the process)")
+    parser.add_argument("--startup", type=int, default=0, metavar="RUNS",
+                        help="only measure the cold start (imports and configuration) over RUNS new processes")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+    if args.state_store == "cache" and not args.state_cache_url:
+        # The benchmark runs in one process: a local memory cache is enough
+        args.state_cache_url = "locmem://"
+
+    if args.startup:
+        results = startup(args)
+        if args.json:
+            json.dump({"backend": args.backend, "results": results}, sys.stdout, indent=4)
+            print()
+            return
+        print("%-24s %6s %10s %10s" % ("phase", "runs", "p50 (ms)", "max (ms)"))
+        for result in results:
+            print("%-24s %6d %10.2f %10.2f" % (result["phase"], result["runs"], result["p50_ms"], result["max_ms"]))
+        return
+
+    from myapp.fakes.fake_livy_server import FakeLivyServer
+    server = FakeLivyServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, error_status=args.error_status,
+                            session_start_time=args.session_start_time, statement_time=args.statement_time,
+                            output_size=args.output_size, seed=0).start()
+    configure(args, server)
+    from myapp.fakes.fake_msal import FakeMsalApp, install
+    install(FakeMsalApp(latency=args.token_latency, seed=0))
+
+    clients = [login(index) for index in range(args.users)]
+    states = [{} for _ in clients]
+    results = [run_phase(clients, view.strip(), args.iterations, states, args.stream_events) for view in args.views.split(",") if view.strip()]
+    server.stop()
+
+    if args.json:
+        json.dump({"users": args.users, "iterations": args.iterations, "backend": args.backend, "state_store": args.state_store, "results": results}, sys.stdout, indent=4)
+        print()
+        return
+    print("%-28s %9s %7s %10s %10s %10s" % ("view", "requests", "errors", "p50 (ms)", "p99 (ms)", "req/s"))
+    for result in results:
+        print("%-28s %9d %7d %10.2f %10.2f %10.1f" % (result["view"], result["requests"], result["errors"],
+                                                      result["p50_ms"], result["p99_ms"], result["requests_per_second"]))
+    print("Fake Livy/Graph server requests:", server.requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,53 @@ Each method returns a `requests.Response` object.
 All methods accept optional `headers`, `params`, and `timeout` arguments to allow
 customization of the HTTP request.
 
+Transport:
+    Every call goes through a single `requests.Session` owned by the client, so
+    TCP/TLS connections are kept alive and reused across calls instead of paying
+    a new handshake per request. The pool is configurable:
+    - pool_connections: number of per-host connection pools to cache
+    - pool_maxsize: maximum number of connections kept alive per host
+    - pool_block: block when the per-host pool is exhausted instead of opening
+      throwaway connections
+    - max_retries / retry_backoff_factor: retries for idempotent GET calls on
+      connection errors and 502/503/504 responses (POST/DELETE are never retried)
+
+    Throttling (Fabric 429/503): pass a LivyRequestScheduler (`scheduler=`, see
+    livy_scheduler.py), shared by the clients, to rate-limit the calls per workspace
+    and endpoint, honour Retry-After and serve the interactive calls before the
+    background ones (the wait helpers and log followers poll in the background).
+
+    Compression: every call asks for a compressed response (Accept-Encoding: gzip,
+    deflate, set on the session), decoded transparently, also by the streamed reads.
+    With `compress_min_bytes`, JSON request bodies of at least that size (e.g. large
+    statement code) are sent gzip-compressed (Content-Encoding: gzip). A backend
+    answering 415 (Unsupported Media Type) gets the call again uncompressed, and the
+    client stops compressing.
+
+    Tail latency and incidents: pass a LivyHedger (`hedger=`, see livy_hedging.py) to
+    send a GET again when it is slower than the p95 latency of its endpoint, and a
+    LivyCircuitBreaker (`breaker=`, see livy_circuit_breaker.py) to fail fast with
+    LivyCircuitOpenError while a GET endpoint keeps failing, instead of waiting for the
+    timeout of each call.
+
+    Metrics: pass a LivyMetrics (`metrics=`, see livy_metrics.py) to record each call
+    (method, route template, status, latency, retries, response size).
+
+    Models: with `typed=True`, the methods return typed models (Session, Statement,
+    Batch, LogPage..., see livy_models.py) instead of responses, decoded once and
+    raising requests.HTTPError on HTTP errors (streamed reads still return the
+    response). Without it, livy_models.model(response) does the same per response.
+
+    livy = ApacheLivy(base_url="...", access_token="...", typed=True)
+    statement = livy.get_statement(session_id, statement_id)
+    if statement.state == "available":
+        text = statement.output.text
+
+    Close the client (or use it as a context manager) to release the connections:
+
+    with ApacheLivy(base_url="...", access_token="...") as livy:
+        livy.get_session(session_id)
+
 Session API:
     - create_session
     - list_sessions
@@ -32,7 +79,7 @@ Session API:
 Statements API:
     - submit_statement
     - list_statements
-    - get_statement
+    - get_statement (stream=True to read large outputs in chunks)
     - cancel_statement
 
 Batches API:
@@ -43,9 +90,120 @@ Batches API:
     - get_batch_state
     - get_batch_log
 
+Bulk reads:
+    - get_statements: status and output of many statements, using list_statements
+      pages where the IDs are dense, and a bounded concurrent fan-out otherwise
+
+Notebook-style cells:
+    - run_cells: run an ordered list of cells, each one submitted once the previous
+      one ended ok, so no cell runs after a failed one
+
+Log followers (iterators yielding only the new log lines, tracking a line cursor):
+    - follow_session_log
+    - follow_batch_log
+
+    for line in livy.follow_session_log(session_id, from_line=0, wait=600):
+        print(line)
+
+    The cursor of the next line to read is available as `follower.cursor` on the
+    LogFollower returned by these methods.
+
+Wait helpers (poll server-side until a state is reached):
+    - wait_for_statement
+    - wait_for_session
+    - wait_for_batch
+
+    They poll with an adaptive backoff (poll_interval, multiplied by backoff after
+    each poll, capped at max_poll_interval), exit early on terminal states, and
+    give up at the deadline (`wait` seconds). They return the last response (its
+    model when typed), so the caller can check whether the expected state was reached:
+
+    response = livy.wait_for_statement(session_id, statement_id, wait=60)
+    if response.json()["state"] == "available":
+        ...
+
 See each method's docstring for details.
 """
-import requests, json
+import requests, json, time, gzip, threading
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from myapp.api.livy_scheduler import background
+from myapp.api.livy_circuit_breaker import LivyCircuitOpenError
+from myapp.api.livy_models import body, model, Statement
+
+# Livy states, see: https://livy.apache.org/docs/latest/rest-api.html
+STATEMENT_TERMINAL_STATES = frozenset(["available", "error", "cancelled"])
+SESSION_TERMINAL_STATES = frozenset(["shutting_down", "error", "dead", "killed", "success"])
+BATCH_TERMINAL_STATES = frozenset(["error", "dead", "killed", "success"])
+
+def compressed_json(data, min_bytes):
+    """The gzip-compressed JSON encoding of `data`, or None when it is smaller than `min_bytes`."""
+    content = json.dumps(data).encode("utf-8")
+    if len(content) < min_bytes:
+        return None
+    return gzip.compress(content, compresslevel=6)
+
+def backoff_intervals(poll_interval, max_poll_interval, backoff):
+    """Yield the successive (growing, capped) sleep intervals between two polls."""
+    interval = poll_interval
+    while True:
+        yield interval
+        interval = min(interval * backoff, max_poll_interval)
+
+class LogFollower:
+    """
+    Iterator over the new lines of a Livy log. Each fetch asks for the lines from `cursor` on,
+    `size` at most; once caught up it polls with an adaptive backoff (reset when new lines
+    arrive). It stops when caught up with a terminal state, or after `wait` seconds.
+    """
+
+    def __init__(self, fetch_log, fetch_state, terminal_states, from_line=0, size=100, wait=600,
+                 poll_interval=1, max_poll_interval=10, backoff=1.5):
+        self.fetch_log = fetch_log
+        self.fetch_state = fetch_state
+        self.terminal_states = terminal_states
+        self.cursor = from_line
+        self.size = size
+        self.wait = wait
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff = backoff
+
+    def __iter__(self):
+        deadline = time.monotonic() + self.wait
+        intervals = backoff_intervals(self.poll_interval, self.max_poll_interval, self.backoff)
+        while True:
+            with background():
+                resp = self.fetch_log(self.cursor, self.size)
+            resp.raise_for_status()
+            page = resp.json()
+            lines = page.get("log") or []
+            start = self.cursor = page.get("from") if page.get("from") is not None else self.cursor
+            for i, line in enumerate(lines):
+                # The cursor is the line after the one yielded: resuming from it loses no line of the page
+                self.cursor = start + i + 1
+                yield line
+            if len(lines) >= self.size:
+                # Not caught up yet
+                continue
+            if lines:
+                intervals = backoff_intervals(self.poll_interval, self.max_poll_interval, self.backoff)
+            with background():
+                state_resp = self.fetch_state()
+            if state_resp.ok and state_resp.json().get("state") in self.terminal_states:
+                # Last lines written before the terminal state
+                with background():
+                    resp = self.fetch_log(self.cursor, self.size)
+                if resp.ok:
+                    for line in resp.json().get("log") or []:
+                        self.cursor += 1
+                        yield line
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(next(intervals), remaining))
 
 class ApacheLivy:
     """
@@ -53,10 +211,63 @@ class ApacheLivy:
     See: https://livy.apache.org/docs/latest/rest-api.html
     """
 
-    def __init__(self, base_url, access_token=None, timeout=30):
+    # Only idempotent calls are retried by the transport
+    RETRY_METHODS = frozenset(["GET"])
+    RETRY_STATUS_CODES = (502, 503, 504)
+
+    def __init__(self, base_url, access_token=None, timeout=30,
+                 pool_connections=10, pool_maxsize=10, pool_block=False,
+                 max_retries=3, retry_backoff_factor=0.5, scheduler=None, metrics=None, hedger=None, breaker=None,
+                 compress_min_bytes=0, typed=False):
         self.base_url = base_url.rstrip("/")
         self.access_token = access_token
         self.timeout = timeout
+        self.scheduler = scheduler
+        self.metrics = metrics
+        self.hedger = hedger
+        self.breaker = breaker
+        self.compress_min_bytes = compress_min_bytes
+        self.typed = typed
+        self._local = threading.local()  # .responses: responses asked for by a helper, even when typed
+        self.http_session = self._create_http_session(pool_connections, pool_maxsize, pool_block,
+                                                      max_retries, retry_backoff_factor)
+
+    def _create_http_session(self, pool_connections, pool_maxsize, pool_block, max_retries, retry_backoff_factor):
+        """Build the pooled, keep-alive transport shared by all the calls of this client."""
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=retry_backoff_factor,
+            status_forcelist=self.RETRY_STATUS_CODES,
+            allowed_methods=self.RETRY_METHODS,
+            raise_on_status=False,
+            # With a scheduler, Retry-After pauses its bucket instead of sleeping in the transport
+            respect_retry_after_header=self.scheduler is None,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        # Compressed responses (decoded by requests)
+        session.headers["Accept-Encoding"] = requests.utils.DEFAULT_ACCEPT_ENCODING
+        return session
+
+    def close(self):
+        """Close the pooled connections. The client must not be used afterwards."""
+        self.http_session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def _headers(self, headers=None):
         base_headers = {"Content-Type": "application/json"}
@@ -66,195 +277,289 @@ class ApacheLivy:
             base_headers.update(headers)
         return base_headers
 
-    # Sessions API
-    def create_session(self, data, headers=None, params=None, timeout=None):
-        """POST /sessions"""
-        url = f"{self.base_url}/sessions"
-        resp = requests.post(
+    def _request(self, method, route, ids=(), headers=None, params=None, timeout=None, **kwargs):
+        """
+        Send a request through the pooled session.
+        `route` is the endpoint template, e.g. "/sessions/{id}/statements/{id}",
+        and `ids` fills its "{id}" placeholders in order.
+        """
+        url = self.base_url + route.replace("{id}", "{}").format(*ids)
+        compressed = compressed_json(kwargs["json"], self.compress_min_bytes) if self.compress_min_bytes and "json" in kwargs else None
+        if compressed is not None:
+            # Sent as gzip: 415 when the backend does not accept it
+            request_kwargs = {name: value for name, value in kwargs.items() if name != "json"}
+            request_kwargs["data"] = compressed
+            request_headers = self._headers(dict(headers or {}, **{"Content-Encoding": "gzip"}))
+        else:
+            request_kwargs = kwargs
+            request_headers = self._headers(headers)
+        send = lambda: self.http_session.request(
+            method,
             url,
-            json=data,
-            headers=self._headers(headers),
+            headers=request_headers,
             params=params,
-            timeout=timeout or self.timeout
+            timeout=timeout or self.timeout,
+            **request_kwargs
         )
-        return resp
+        if self.metrics is not None:
+            send = self._measured(method, route, send, kwargs.get("stream", False))
+        # Workspace (base URL) and endpoint
+        key = (self.base_url, method + " " + route)
+        if self.hedger is not None and method == "GET":
+            on_hedge = (lambda: self.metrics.record_hedge(method, route)) if self.metrics is not None else None
+            send = lambda send=send: self.hedger.call(key, send, on_hedge)
+        if self.scheduler is not None:
+            # Rate-limited per workspace and endpoint
+            send = lambda send=send: self.scheduler.call(key, send)
+        if self.breaker is None or method != "GET":
+            resp = send()
+        else:
+            try:
+                resp = self.breaker.call(key, send)
+            except LivyCircuitOpenError:
+                if self.metrics is not None:
+                    self.metrics.record_rejection(method, route)
+                raise
+        if compressed is not None and resp.status_code == 415:
+            # Compressed request bodies not supported: sent again as plain JSON, and from now on
+            self.compress_min_bytes = 0
+            resp.close()
+            return self._request(method, route, ids, headers=headers, params=params, timeout=timeout, **kwargs)
+        # Endpoint of the response, for livy_models.model()
+        resp.livy_route = (method, route)
+        return resp if kwargs.get("stream") else self._result(resp)
+
+    def _result(self, resp):
+        """The response, or its model when the client is typed (raising on HTTP errors)."""
+        if not self.typed or getattr(self._local, "responses", False):
+            return resp
+        resp.raise_for_status()
+        return model(resp)
+
+    def _response(self, call, *args, **kwargs):
+        """Call the method `call` for its response (not its model), whether or not the client is typed."""
+        previous = getattr(self._local, "responses", False)
+        self._local.responses = True
+        try:
+            return call(*args, **kwargs)
+        finally:
+            self._local.responses = previous
+
+    def _measured(self, method, route, send, stream):
+        """Wrap `send` to record each call (each attempt, when the scheduler retries) in the metrics."""
+        def measured_send():
+            start = time.perf_counter()
+            try:
+                resp = send()
+            except requests.exceptions.RequestException as e:
+                self.metrics.record_error(method, route, e, time.perf_counter() - start)
+                raise
+            retries = getattr(getattr(resp.raw, "retries", None), "history", ())
+            length = resp.headers.get("Content-Length")
+            size = int(length) if length and length.isdigit() else (None if stream else len(resp.content))
+            self.metrics.record(method, route, resp.status_code, time.perf_counter() - start, len(retries), size)
+            return resp
+        return measured_send
+
+    # Sessions API
+    def create_session(self, data, headers=None, params=None, timeout=None):
+        """POST /sessions"""
+        return self._request("POST", "/sessions", headers=headers, params=params, timeout=timeout, json=data)
 
     def list_sessions(self, headers=None, params=None, timeout=None):
         """GET /sessions"""
-        url = f"{self.base_url}/sessions"
-        resp = requests.get(
-            url,
-            headers=self._headers(headers),
-            params=params,
-            timeout=timeout or self.timeout
-        )
-        return resp
+        return self._request("GET", "/sessions", headers=headers, params=params, timeout=timeout)
 
     def get_session(self, session_id, headers=None, params=None, timeout=None):
         """GET /sessions/{sessionId}"""
-        url = f"{self.base_url}/sessions/{session_id}"
-        resp = requests.get(
-            url,
-            headers=self._headers(headers),
-            params=params,
-            timeout=timeout or self.timeout
-        )
-        return resp
+        return self._request("GET", "/sessions/{id}", (session_id,), headers=headers, params=params, timeout=timeout)
 
     def delete_session(self, session_id, headers=None, params=None, timeout=None):
         """DELETE /sessions/{sessionId}"""
-        url = f"{self.base_url}/sessions/{session_id}"
-        resp = requests.delete(
-            url,
-            headers=self._headers(headers),
-            params=params,
-            timeout=timeout or self.timeout
-        )
-        return resp
+        return self._request("DELETE", "/sessions/{id}", (session_id,), headers=headers, params=params, timeout=timeout)
 
     def get_session_state(self, session_id, headers=None, params=None, timeout=None):
         """GET /sessions/{sessionId}/state"""
-        url = f"{self.base_url}/sessions/{session_id}/state"
-        resp = requests.get(
-            url,
-            headers=self._headers(headers),
-            params=params,
-            timeout=timeout or self.timeout
-        )
-        return resp
+        return self._request("GET", "/sessions/{id}/state", (session_id,), headers=headers, params=params, timeout=timeout)
 
     def get_session_log(self, session_id, from_line=None, size=None, headers=None, params=None, timeout=None):
         """GET /sessions/{sessionId}/log"""
-        url = f"{self.base_url}/sessions/{session_id}/log"
         query = params.copy() if params else {}
         if from_line is not None:
             query["from"] = from_line
         if size is not None:
             query["size"] = size
-        resp = requests.get(
-            url,
-            headers=self._headers(headers),
-            params=query,
-            timeout=timeout or self.timeout
-        )
-        return resp
+        return self._request("GET", "/sessions/{id}/log", (session_id,), headers=headers, params=query, timeout=timeout)
 
     # Statements API
     def submit_statement(self, session_id, code, kind="pyspark", headers=None, params=None, timeout=None):
         """POST /sessions/{sessionId}/statements"""
-        url = f"{self.base_url}/sessions/{session_id}/statements"
         data = {"code": code, "kind": kind}
-        resp = requests.post(
-            url,
-            json=data,
-            headers=self._headers(headers),
-            params=params,
-            timeout=timeout or self.timeout
-        )
-        return resp
+        return self._request("POST", "/sessions/{id}/statements", (session_id,), headers=headers, params=params, timeout=timeout, json=data)
 
-    def list_statements(self, session_id, headers=None, params=None, timeout=None):
+    def list_statements(self, session_id, from_index=None, size=None, headers=None, params=None, timeout=None):
         """GET /sessions/{sessionId}/statements"""
-        url = f"{self.base_url}/sessions/{session_id}/statements"
-        resp = requests.get(
-            url,
-            headers=self._headers(headers),
-            params=params,
-            timeout=timeout or self.timeout
-        )
-        return resp
+        query = params.copy() if params else {}
+        if from_index is not None:
+            query["from"] = from_index
+        if size is not None:
+            query["size"] = size
+        return self._request("GET", "/sessions/{id}/statements", (session_id,), headers=headers, params=query, timeout=timeout)
 
-    def get_statement(self, session_id, statement_id, headers=None, params=None, timeout=None):
-        """GET /sessions/{sessionId}/statements/{statementId}"""
-        url = f"{self.base_url}/sessions/{session_id}/statements/{statement_id}"
-        resp = requests.get(
-            url,
-            headers=self._headers(headers),
-            params=params,
-            timeout=timeout or self.timeout
-        )
-        return resp
+    def get_statement(self, session_id, statement_id, headers=None, params=None, timeout=None, stream=False):
+        """
+        GET /sessions/{sessionId}/statements/{statementId}
+        `stream` leaves the body unread, to be consumed in chunks (see livy_output_store.read_json).
+        """
+        return self._request("GET", "/sessions/{id}/statements/{id}", (session_id, statement_id), headers=headers, params=params, timeout=timeout, stream=stream)
 
     def cancel_statement(self, session_id, statement_id, headers=None, params=None, timeout=None):
         """POST /sessions/{sessionId}/statements/{statementId}/cancel"""
-        url = f"{self.base_url}/sessions/{session_id}/statements/{statement_id}/cancel"
-        resp = requests.post(
-            url,
-            headers=self._headers(headers),
-            params=params,
-            timeout=timeout or self.timeout
-        )
-        return resp
+        return self._request("POST", "/sessions/{id}/statements/{id}/cancel", (session_id, statement_id), headers=headers, params=params, timeout=timeout)
+
+    def get_statements(self, session_id, statement_ids, page_size=100, max_workers=8, timeout=None):
+        """
+        Bulk GET of statements, returned as a {statementId: statement (Statement when typed)} dict.
+        When the IDs are dense, GET /sessions/{sessionId}/statements pages (from/size) cover them in
+        a few calls; the IDs not found that way are fetched with a bounded concurrent fan-out of
+        GET /sessions/{sessionId}/statements/{statementId}. Raises on HTTP errors.
+        """
+        wanted = set(int(statement_id) for statement_id in statement_ids)
+        statements = {}
+        if not wanted:
+            return statements
+        low, high = min(wanted), max(wanted)
+        if (high - low + 1) <= 2 * len(wanted):
+            for from_index in range(low, high + 1, page_size):
+                resp = self._response(self.list_statements, session_id, from_index=from_index,
+                                      size=min(page_size, high + 1 - from_index), timeout=timeout)
+                resp.raise_for_status()
+                for statement in resp.json().get("statements", []):
+                    if statement.get("id") in wanted:
+                        statements[statement["id"]] = statement
+        missing = sorted(wanted.difference(statements))
+        if missing:
+            def fetch(statement_id):
+                resp = self._response(self.get_statement, session_id, statement_id, timeout=timeout)
+                resp.raise_for_status()
+                return resp.json()
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as executor:
+                for statement_id, statement in zip(missing, executor.map(fetch, missing)):
+                    statements[statement_id] = statement
+        if self.typed:
+            return {statement_id: Statement(statement) for statement_id, statement in statements.items()}
+        return statements
+
+    def run_cells(self, session_id, codes, after=None, on_submit=None, kind="pyspark", wait=3600,
+                  poll_interval=0.5, max_poll_interval=5, backoff=1.5):
+        """
+        Run the cells `codes` in order: each cell is submitted (POST /sessions/{sessionId}/statements)
+        once the previous one, or the statement `after` when given, ended ok. A cell failing (error or
+        cancelled state, or an "error" output, e.g. a Python exception) or not finished within `wait`
+        seconds stops the run: the next cells are never submitted. `on_submit(statement_id)` is called
+        after each submission. Returns the ID of the statement the run stopped at, or None when all the
+        cells ended ok. Raises on a rejected submission.
+        """
+        deadline = time.monotonic() + wait
+
+        def ended_ok(statement_id):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            resp = self._response(self.wait_for_statement, session_id, statement_id, wait=remaining, poll_interval=poll_interval,
+                                  max_poll_interval=max_poll_interval, backoff=backoff)
+            statement = body(resp) if resp.ok else {}
+            return statement.get("state") == "available" and (statement.get("output") or {}).get("status") != "error"
+
+        previous = after
+        for code in codes:
+            if previous is not None and not ended_ok(previous):
+                return previous
+            resp = self._response(self.submit_statement, session_id, code, kind=kind)
+            resp.raise_for_status()
+            previous = body(resp).get("id")
+            if on_submit is not None:
+                on_submit(previous)
+        return previous if previous is not None and not ended_ok(previous) else None
 
     # Batches API (optional, for batch jobs)
     def create_batch(self, data, headers=None, params=None, timeout=None):
         """POST /batches"""
-        url = f"{self.base_url}/batches"
-        resp = requests.post(
-            url,
-            json=data,
-            headers=self._headers(headers),
-            params=params,
-            timeout=timeout or self.timeout
-        )
-        return resp
+        return self._request("POST", "/batches", headers=headers, params=params, timeout=timeout, json=data)
 
     def list_batches(self, headers=None, params=None, timeout=None):
         """GET /batches"""
-        url = f"{self.base_url}/batches"
-        resp = requests.get(
-            url,
-            headers=self._headers(headers),
-            params=params,
-            timeout=timeout or self.timeout
-        )
-        return resp
+        return self._request("GET", "/batches", headers=headers, params=params, timeout=timeout)
 
     def get_batch(self, batch_id, headers=None, params=None, timeout=None):
         """GET /batches/{batchId}"""
-        url = f"{self.base_url}/batches/{batch_id}"
-        resp = requests.get(
-            url,
-            headers=self._headers(headers),
-            params=params,
-            timeout=timeout or self.timeout
-        )
-        return resp
+        return self._request("GET", "/batches/{id}", (batch_id,), headers=headers, params=params, timeout=timeout)
 
     def delete_batch(self, batch_id, headers=None, params=None, timeout=None):
         """DELETE /batches/{batchId}"""
-        url = f"{self.base_url}/batches/{batch_id}"
-        resp = requests.delete(
-            url,
-            headers=self._headers(headers),
-            params=params,
-            timeout=timeout or self.timeout
-        )
-        return resp
+        return self._request("DELETE", "/batches/{id}", (batch_id,), headers=headers, params=params, timeout=timeout)
 
     def get_batch_state(self, batch_id, headers=None, params=None, timeout=None):
         """GET /batches/{batchId}/state"""
-        url = f"{self.base_url}/batches/{batch_id}/state"
-        resp = requests.get(
-            url,
-            headers=self._headers(headers),
-            params=params,
-            timeout=timeout or self.timeout
-        )
-        return resp
+        return self._request("GET", "/batches/{id}/state", (batch_id,), headers=headers, params=params, timeout=timeout)
 
     def get_batch_log(self, batch_id, from_line=None, size=None, headers=None, params=None, timeout=None):
         """GET /batches/{batchId}/log"""
-        url = f"{self.base_url}/batches/{batch_id}/log"
         query = params.copy() if params else {}
         if from_line is not None:
             query["from"] = from_line
         if size is not None:
             query["size"] = size
-        resp = requests.get(
-            url,
-            headers=self._headers(headers),
-            params=query,
-            timeout=timeout or self.timeout
+        return self._request("GET", "/batches/{id}/log", (batch_id,), headers=headers, params=query, timeout=timeout)
+
+    # Wait helpers
+    def _wait(self, fetch, done_states, wait, poll_interval, max_poll_interval, backoff):
+        """Poll `fetch` until the returned state is in `done_states`, the call fails or `wait` seconds elapsed."""
+        deadline = time.monotonic() + wait
+        for interval in backoff_intervals(poll_interval, max_poll_interval, backoff):
+            with background():
+                resp = self._response(fetch)
+            if not resp.ok or body(resp).get("state") in done_states:
+                return self._result(resp)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return self._result(resp)
+            time.sleep(min(interval, remaining))
+
+    def wait_for_statement(self, session_id, statement_id, wait=60, poll_interval=0.5, max_poll_interval=5, backoff=1.5, timeout=None):
+        """Poll GET /sessions/{sessionId}/statements/{statementId} until the statement is available, in error or cancelled"""
+        return self._wait(
+            lambda: self.get_statement(session_id, statement_id, timeout=timeout),
+            STATEMENT_TERMINAL_STATES, wait, poll_interval, max_poll_interval, backoff
+        )
+
+    def wait_for_session(self, session_id, states=("idle",), wait=300, poll_interval=1, max_poll_interval=10, backoff=1.5, timeout=None):
+        """Poll GET /sessions/{sessionId}/state until the session reaches one of `states` or a terminal state"""
+        return self._wait(
+            lambda: self.get_session_state(session_id, timeout=timeout),
+            SESSION_TERMINAL_STATES.union(states), wait, poll_interval, max_poll_interval, backoff
+        )
+
+    def wait_for_batch(self, batch_id, states=(), wait=300, poll_interval=1, max_poll_interval=10, backoff=1.5, timeout=None):
+        """Poll GET /batches/{batchId}/state until the batch reaches one of `states` or a terminal state"""
+        return self._wait(
+            lambda: self.get_batch_state(batch_id, timeout=timeout),
+            BATCH_TERMINAL_STATES.union(states), wait, poll_interval, max_poll_interval, backoff
+        )
+
+    # Log followers
+    def follow_session_log(self, session_id, from_line=0, size=100, wait=600, poll_interval=1, max_poll_interval=10, backoff=1.5):
+        """Follow GET /sessions/{sessionId}/log from `from_line`, yielding only the new lines"""
+        return LogFollower(
+            lambda from_line, size: self._response(self.get_session_log, session_id, from_line=from_line, size=size),
+            lambda: self._response(self.get_session_state, session_id),
+            SESSION_TERMINAL_STATES, from_line, size, wait, poll_interval, max_poll_interval, backoff
+        )
+
+    def follow_batch_log(self, batch_id, from_line=0, size=100, wait=600, poll_interval=1, max_poll_interval=10, backoff=1.5):
+        """Follow GET /batches/{batchId}/log from `from_line`, yielding only the new lines"""
+        return LogFollower(
+            lambda from_line, size: self._response(self.get_batch_log, batch_id, from_line=from_line, size=size),
+            lambda: self._response(self.get_batch_state, batch_id),
+            BATCH_TERMINAL_STATES, from_line, size, wait, poll_interval, max_poll_interval, backoff
         )
-        return resp
@@ -0,0 +1,246 @@
+"""
+Asynchronous Apache Livy REST API client.
+
+This module provides the AsyncApacheLivy class, the asyncio counterpart of
+ApacheLivy (see apache_livy.py). It exposes the same method surface, but every
+method is a coroutine returning an `httpx.Response` object.
+
+Usage:
+    from myapp.api.async_apache_livy import AsyncApacheLivy
+
+    async with AsyncApacheLivy(base_url="https://livy-server-url", access_token="...", timeout=30) as livy:
+        # Create a session
+        response = await livy.create_session(data={...})
+        # Submit a statement
+        response = await livy.submit_statement(session_id, code="print(1+1)")
+        # And so on...
+
+All methods accept optional `headers`, `params`, and `timeout` arguments to allow
+customization of the HTTP request.
+
+Transport:
+    Calls share one `httpx.AsyncClient`, so connections are kept alive and reused,
+    and a single event loop can hold many in-flight Livy calls:
+    - max_connections: maximum number of concurrent connections
+    - max_keepalive_connections: maximum number of idle connections kept alive
+    - keepalive_expiry: seconds an idle connection is kept alive
+    - max_retries: retries on connection errors (httpx never retries on responses)
+
+    An httpx.AsyncClient is bound to the event loop it was first used on; create one
+    client per event loop and close it with `await livy.aclose()`.
+
+    Metrics: pass a LivyMetrics (`metrics=`, see livy_metrics.py) to record each call.
+
+    Compression: responses are asked compressed (httpx sends Accept-Encoding: gzip,
+    deflate and decodes them), and `compress_min_bytes` compresses the large JSON
+    request bodies, as ApacheLivy does (plain JSON again after a 415).
+
+Wait helpers (wait_for_statement, wait_for_session, wait_for_batch) behave like the
+ApacheLivy ones, but sleep with asyncio so the event loop stays free while waiting.
+"""
+import asyncio
+import time
+import httpx
+from myapp.api.apache_livy import (
+    STATEMENT_TERMINAL_STATES, SESSION_TERMINAL_STATES, BATCH_TERMINAL_STATES, backoff_intervals, compressed_json,
+)
+from myapp.api.livy_models import body
+
+
+class AsyncApacheLivy:
+    """
+    Asynchronous Apache Livy REST API client.
+    See: https://livy.apache.org/docs/latest/rest-api.html
+    """
+
+    def __init__(self, base_url, access_token=None, timeout=30,
+                 max_connections=100, max_keepalive_connections=20, keepalive_expiry=30,
+                 max_retries=3, metrics=None, compress_min_bytes=0):
+        self.base_url = base_url.rstrip("/")
+        self.access_token = access_token
+        self.timeout = timeout
+        self.metrics = metrics
+        self.compress_min_bytes = compress_min_bytes
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            transport=httpx.AsyncHTTPTransport(retries=max_retries),
+        )
+
+    async def aclose(self):
+        """Close the pooled connections. The client must not be used afterwards."""
+        await self.http_client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    def _headers(self, headers=None):
+        base_headers = {"Content-Type": "application/json"}
+        if self.access_token:
+            base_headers["Authorization"] = f"Bearer {self.access_token}"
+        if headers:
+            base_headers.update(headers)
+        return base_headers
+
+    async def _request(self, method, route, ids=(), headers=None, params=None, timeout=None, **kwargs):
+        """
+        Send a request through the pooled client.
+        `route` is the endpoint template, e.g. "/sessions/{id}/statements/{id}",
+        and `ids` fills its "{id}" placeholders in order.
+        """
+        url = self.base_url + route.replace("{id}", "{}").format(*ids)
+        compressed = compressed_json(kwargs["json"], self.compress_min_bytes) if self.compress_min_bytes and "json" in kwargs else None
+        if compressed is not None:
+            request_kwargs = {name: value for name, value in kwargs.items() if name != "json"}
+            request_kwargs["content"] = compressed
+            request_headers = self._headers(dict(headers or {}, **{"Content-Encoding": "gzip"}))
+        else:
+            request_kwargs = kwargs
+            request_headers = self._headers(headers)
+        start = time.perf_counter()
+        try:
+            resp = await self.http_client.request(
+                method,
+                url,
+                headers=request_headers,
+                params=params,
+                timeout=timeout or self.timeout,
+                **request_kwargs
+            )
+        except httpx.HTTPError as e:
+            if self.metrics is not None:
+                self.metrics.record_error(method, route, e, time.perf_counter() - start)
+            raise
+        if self.metrics is not None:
+            # Connection retries of the transport are not exposed by httpx
+            self.metrics.record(method, route, resp.status_code, time.perf_counter() - start, 0, len(resp.content))
+        if compressed is not None and resp.status_code == 415:
+            # Compressed request bodies not supported: sent again as plain JSON, and from now on
+            self.compress_min_bytes = 0
+            return await self._request(method, route, ids, headers=headers, params=params, timeout=timeout, **kwargs)
+        # Endpoint of the response, for livy_models.model()
+        resp.livy_route = (method, route)
+        return resp
+
+    # Sessions API
+    async def create_session(self, data, headers=None, params=None, timeout=None):
+        """POST /sessions"""
+        return await self._request("POST", "/sessions", headers=headers, params=params, timeout=timeout, json=data)
+
+    async def list_sessions(self, headers=None, params=None, timeout=None):
+        """GET /sessions"""
+        return await self._request("GET", "/sessions", headers=headers, params=params, timeout=timeout)
+
+    async def get_session(self, session_id, headers=None, params=None, timeout=None):
+        """GET /sessions/{sessionId}"""
+        return await self._request("GET", "/sessions/{id}", (session_id,), headers=headers, params=params, timeout=timeout)
+
+    async def delete_session(self, session_id, headers=None, params=None, timeout=None):
+        """DELETE /sessions/{sessionId}"""
+        return await self._request("DELETE", "/sessions/{id}", (session_id,), headers=headers, params=params, timeout=timeout)
+
+    async def get_session_state(self, session_id, headers=None, params=None, timeout=None):
+        """GET /sessions/{sessionId}/state"""
+        return await self._request("GET", "/sessions/{id}/state", (session_id,), headers=headers, params=params, timeout=timeout)
+
+    async def get_session_log(self, session_id, from_line=None, size=None, headers=None, params=None, timeout=None):
+        """GET /sessions/{sessionId}/log"""
+        query = params.copy() if params else {}
+        if from_line is not None:
+            query["from"] = from_line
+        if size is not None:
+            query["size"] = size
+        return await self._request("GET", "/sessions/{id}/log", (session_id,), headers=headers, params=query, timeout=timeout)
+
+    # Statements API
+    async def submit_statement(self, session_id, code, kind="pyspark", headers=None, params=None, timeout=None):
+        """POST /sessions/{sessionId}/statements"""
+        data = {"code": code, "kind": kind}
+        return await self._request("POST", "/sessions/{id}/statements", (session_id,), headers=headers, params=params, timeout=timeout, json=data)
+
+    async def list_statements(self, session_id, from_index=None, size=None, headers=None, params=None, timeout=None):
+        """GET /sessions/{sessionId}/statements"""
+        query = params.copy() if params else {}
+        if from_index is not None:
+            query["from"] = from_index
+        if size is not None:
+            query["size"] = size
+        return await self._request("GET", "/sessions/{id}/statements", (session_id,), headers=headers, params=query, timeout=timeout)
+
+    async def get_statement(self, session_id, statement_id, headers=None, params=None, timeout=None):
+        """GET /sessions/{sessionId}/statements/{statementId}"""
+        return await self._request("GET", "/sessions/{id}/statements/{id}", (session_id, statement_id), headers=headers, params=params, timeout=timeout)
+
+    async def cancel_statement(self, session_id, statement_id, headers=None, params=None, timeout=None):
+        """POST /sessions/{sessionId}/statements/{statementId}/cancel"""
+        return await self._request("POST", "/sessions/{id}/statements/{id}/cancel", (session_id, statement_id), headers=headers, params=params, timeout=timeout)
+
+    # Batches API (optional, for batch jobs)
+    async def create_batch(self, data, headers=None, params=None, timeout=None):
+        """POST /batches"""
+        return await self._request("POST", "/batches", headers=headers, params=params, timeout=timeout, json=data)
+
+    async def list_batches(self, headers=None, params=None, timeout=None):
+        """GET /batches"""
+        return await self._request("GET", "/batches", headers=headers, params=params, timeout=timeout)
+
+    async def get_batch(self, batch_id, headers=None, params=None, timeout=None):
+        """GET /batches/{batchId}"""
+        return await self._request("GET", "/batches/{id}", (batch_id,), headers=headers, params=params, timeout=timeout)
+
+    async def delete_batch(self, batch_id, headers=None, params=None, timeout=None):
+        """DELETE /batches/{batchId}"""
+        return await self._request("DELETE", "/batches/{id}", (batch_id,), headers=headers, params=params, timeout=timeout)
+
+    async def get_batch_state(self, batch_id, headers=None, params=None, timeout=None):
+        """GET /batches/{batchId}/state"""
+        return await self._request("GET", "/batches/{id}/state", (batch_id,), headers=headers, params=params, timeout=timeout)
+
+    async def get_batch_log(self, batch_id, from_line=None, size=None, headers=None, params=None, timeout=None):
+        """GET /batches/{batchId}/log"""
+        query = params.copy() if params else {}
+        if from_line is not None:
+            query["from"] = from_line
+        if size is not None:
+            query["size"] = size
+        return await self._request("GET", "/batches/{id}/log", (batch_id,), headers=headers, params=query, timeout=timeout)
+
+    # Wait helpers
+    async def _wait(self, fetch, done_states, wait, poll_interval, max_poll_interval, backoff):
+        """Poll `fetch` until the returned state is in `done_states`, the call fails or `wait` seconds elapsed."""
+        deadline = time.monotonic() + wait
+        for interval in backoff_intervals(poll_interval, max_poll_interval, backoff):
+            resp = await fetch()
+            if not resp.is_success or body(resp).get("state") in done_states:
+                return resp
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return resp
+            await asyncio.sleep(min(interval, remaining))
+
+    async def wait_for_statement(self, session_id, statement_id, wait=60, poll_interval=0.5, max_poll_interval=5, backoff=1.5, timeout=None):
+        """Poll GET /sessions/{sessionId}/statements/{statementId} until the statement is available, in error or cancelled"""
+        return await self._wait(
+            lambda: self.get_statement(session_id, statement_id, timeout=timeout),
+            STATEMENT_TERMINAL_STATES, wait, poll_interval, max_poll_interval, backoff
+        )
+
+    async def wait_for_session(self, session_id, states=("idle",), wait=300, poll_interval=1, max_poll_interval=10, backoff=1.5, timeout=None):
+        """Poll GET /sessions/{sessionId}/state until the session reaches one of `states` or a terminal state"""
+        return await self._wait(
+            lambda: self.get_session_state(session_id, timeout=timeout),
+            SESSION_TERMINAL_STATES.union(states), wait, poll_interval, max_poll_interval, backoff
+        )
+
+    async def wait_for_batch(self, batch_id, states=(), wait=300, poll_interval=1, max_poll_interval=10, backoff=1.5, timeout=None):
+        """Poll GET /batches/{batchId}/state until the batch reaches one of `states` or a terminal state"""
+        return await self._wait(
+            lambda: self.get_batch_state(batch_id, timeout=timeout),
+            BATCH_TERMINAL_STATES.union(states), wait, poll_interval, max_poll_interval, backoff
+        )
@@ -0,0 +1,113 @@
+"""
+Microsoft Graph client with a per-user cache.
+
+Usage:
+    from myapp.api.graph_client import GraphClient
+
+    graph = GraphClient(ttl=300)
+    me = graph.get("https://graph.microsoft.com/v1.0/me", access_token, user_key)
+    groups = graph.get_all_pages("https://graph.microsoft.com/v1.0/me/memberOf", access_token, user_key)
+
+- Results are cached per (user_key, url) for `ttl` seconds (LRU bounded by `max_entries`).
+- When a cached result expired and had an ETag, the request is conditional
+  (If-None-Match): a 304 response reuses the cached result.
+- get_all_pages() follows `@odata.nextLink` and returns {"value": [...all pages...]}.
+  Pages are requested with `page_size` ($top, at most 999 for memberOf) so most users
+  get a single page. Graph pages directory objects with opaque cursors ($skiptoken),
+  so the pages are followed one by one.
+- Error responses are returned as-is and never cached.
+
+The endpoints are plain URLs, so the client can be pointed to a local stand-in Graph server.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class GraphClient:
+    """
+    Microsoft Graph client with a per-user TTL cache, conditional requests and paging.
+    """
+
+    def __init__(self, ttl=300, max_entries=1000, timeout=30, page_size=999, pool_maxsize=10):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.page_size = page_size
+        self.http_session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=pool_maxsize)
+        self.http_session.mount("https://", adapter)
+        self.http_session.mount("http://", adapter)
+        self._cache = OrderedDict()  # (user_key, url) -> (expires_at, etag, result)
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.http_session.close()
+
+    def get(self, url, access_token, user_key):
+        """GET `url` as the user, served from the cache while fresh."""
+        key = (user_key, url)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached:
+                self._cache.move_to_end(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[2]
+
+        headers = {"Authorization": "Bearer " + access_token}
+        if cached and cached[1]:
+            headers["If-None-Match"] = cached[1]
+        resp = self.http_session.get(url, headers=headers, timeout=self.timeout)
+        if resp.status_code == 304 and cached:
+            result, etag = cached[2], cached[1]
+        else:
+            result, etag = resp.json(), resp.headers.get("ETag")
+            if not resp.ok:
+                return result
+        self._store(key, etag, result)
+        return result
+
+    def get_all_pages(self, url, access_token, user_key):
+        """GET all the pages of a collection, returned as {"value": [...]} (or the error result)."""
+        key = (user_key, url)
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[2]
+
+        headers = {"Authorization": "Bearer " + access_token}
+        resp = self.http_session.get(url, headers=headers, timeout=self.timeout, params={"$top": self.page_size})
+        page = resp.json()
+        if not resp.ok:
+            return page
+        values = list(page.get("value", []))
+        next_link = page.get("@odata.nextLink")
+        while next_link:
+            page = self._get_page(next_link, headers)
+            if "value" not in page:
+                return page
+            values.extend(page["value"])
+            next_link = page.get("@odata.nextLink")
+
+        result = {"value": values}
+        self._store(key, None, result)
+        return result
+
+    def invalidate(self, user_key):
+        """Drop the cached results of a user."""
+        with self._lock:
+            for key in [key for key in self._cache if key[0] == user_key]:
+                del self._cache[key]
+
+    def _get_page(self, url, headers):
+        return self.http_session.get(url, headers=headers, timeout=self.timeout).json()
+
+    def _store(self, key, etag, result):
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl, etag, result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
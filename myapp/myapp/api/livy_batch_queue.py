@@ -0,0 +1,275 @@
+"""
+Local queue of Livy batch jobs, with bounded concurrency.
+
+Fire-and-forget jobs (ETL...) are better run as Livy batches than as statements
+holding an interactive session. The LivyBatchQueue accepts jobs at once, submits
+them to Livy (POST /batches) while the concurrency caps allow it, and tracks their
+state in the background until they end.
+
+Usage:
+    from myapp.api.livy_batch_queue import LivyBatchQueue
+
+    batches = LivyBatchQueue(max_running=4, max_running_per_owner=2)
+    job = batches.submit(owner, {"file": "abfss://.../job.py", "args": [...]}, client)
+    batches.list(owner)             # [{"id": ..., "state": "queued"|"starting"|...|"success", ...}]
+    batches.cancel(job.id, owner)
+
+- `client` is a callable returning the ApacheLivy client to use (with a valid token),
+  called at submission and at each state check, as jobs can run longer than a token.
+- At most `max_running` jobs are submitted and not ended at any time, and at most
+  `max_running_per_owner` per owner. The other jobs wait in the queue, in order, a
+  capped owner not blocking the jobs of the others.
+- The running jobs are polled (GET /batches/{batchId}/state) with an adaptive backoff,
+  from `poll_interval` up to `max_poll_interval` seconds.
+- A job whose state cannot be checked `max_poll_failures` times in a row, or for
+  `lost_after` seconds (errors, Livy down...), is failed (lost): its slot is freed
+  and its batch deleted if Livy answers again.
+- Ended jobs are kept (the last `history` of them) to be listed.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from myapp.api.apache_livy import BATCH_TERMINAL_STATES
+from myapp.api.livy_scheduler import in_background
+
+# Local states, on top of the Livy batch states
+QUEUED = "queued"
+CANCELLED = "cancelled"
+FAILED = "failed"  # Rejected by Livy, or lost
+JOB_TERMINAL_STATES = BATCH_TERMINAL_STATES.union({CANCELLED, FAILED})
+
+
+class LivyBatchJob:
+    """
+    A batch job of the queue.
+    """
+
+    def __init__(self, owner, data, client):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.data = data
+        self.client = client
+        self.state = QUEUED
+        self.batch_id = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.ended_at = None
+        self.next_poll = 0
+        self.poll_interval = 0
+        self.poll_failures = 0  # Consecutive failed state checks
+        self.polled_at = None   # Last successful state check (monotonic)
+
+    @property
+    def ended(self):
+        return self.state in JOB_TERMINAL_STATES
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.data.get("name"),
+            "state": self.state,
+            "batch_id": self.batch_id,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "ended_at": self.ended_at,
+        }
+
+
+class LivyBatchQueue:
+    """
+    Queue of batch jobs, submitted to Livy within global and per-owner concurrency caps.
+    """
+
+    def __init__(self, max_running=4, max_running_per_owner=2, poll_interval=5, max_poll_interval=60, backoff=1.5,
+                 max_poll_failures=10, lost_after=1800, history=500):
+        self.max_running = max_running
+        self.max_running_per_owner = max_running_per_owner
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff = backoff
+        self.max_poll_failures = max_poll_failures
+        self.lost_after = lost_after
+        self.history = history
+        self._jobs = OrderedDict()  # job ID -> job, in submission order
+        self._queued = deque()
+        self._running = {}          # job ID -> job submitted to Livy, not ended
+        self._ended = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._worker = None
+
+    def submit(self, owner, data, client):
+        """Queue a batch job (`data` being the POST /batches payload) and return it."""
+        job = LivyBatchJob(owner, data, client)
+        with self._condition:
+            self._jobs[job.id] = job
+            self._queued.append(job)
+            self._start_worker()
+            self._condition.notify()
+        return job
+
+    def get(self, job_id, owner):
+        """Return the job `job_id` of `owner`, or None."""
+        with self._condition:
+            job = self._jobs.get(job_id)
+        return job if job is not None and job.owner == owner else None
+
+    def list(self, owner):
+        """State of the jobs of `owner`, the latest first."""
+        with self._condition:
+            return [job.to_dict() for job in reversed(self._jobs.values()) if job.owner == owner]
+
+    def cancel(self, job_id, owner):
+        """
+        Cancel a job: remove it from the queue, or delete its Livy batch if it runs.
+        Return the job, or None if it is not a job of `owner`.
+        """
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or job.owner != owner or job.ended:
+                return job if job is not None and job.owner == owner else None
+            running = job.id in self._running
+            if not running:
+                self._queued.remove(job)
+            self._end(job, CANCELLED)
+            # Without a batch ID yet, the job is being submitted: _submit deletes the batch
+            batch_id = job.batch_id
+        if running and batch_id is not None:
+            self._delete(job)
+        return job
+
+    def close(self):
+        """Stop the background worker (the Livy batches already submitted keep running)."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._queued) + len(self._running)
+
+    def _start_worker(self):
+        # Called with the lock held
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name="livy-batch-queue", daemon=True)
+            self._worker.start()
+
+    @in_background
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._closed:
+                    return
+                to_submit = self._next_jobs()
+                now = time.monotonic()
+                to_poll = [job for job in self._running.values() if job.next_poll <= now and job not in to_submit]
+                if not to_submit and not to_poll:
+                    next_poll = min((job.next_poll for job in self._running.values()), default=None)
+                    self._condition.wait(None if next_poll is None else max(0, next_poll - now))
+                    continue
+            for job in to_submit:
+                self._submit(job)
+            for job in to_poll:
+                self._poll(job)
+
+    def _next_jobs(self):
+        # Called with the lock held: take the queued jobs allowed to run, in order
+        running_per_owner = {}
+        for job in self._running.values():
+            running_per_owner[job.owner] = running_per_owner.get(job.owner, 0) + 1
+        taken = []
+        for job in list(self._queued):
+            if len(self._running) >= self.max_running:
+                break
+            if running_per_owner.get(job.owner, 0) >= self.max_running_per_owner:
+                continue
+            self._queued.remove(job)
+            self._running[job.id] = job
+            running_per_owner[job.owner] = running_per_owner.get(job.owner, 0) + 1
+            taken.append(job)
+        return taken
+
+    def _submit(self, job):
+        try:
+            resp = job.client().create_batch(job.data)
+            batch = resp.json()
+            resp.raise_for_status()
+        except Exception as e:
+            # Any error (HTTP, token, payload) fails the job, never the worker
+            with self._condition:
+                job.error = str(e)
+                self._end(job, FAILED)
+            return
+        with self._condition:
+            job.batch_id = batch.get("id")
+            job.started_at = time.time()
+            job.poll_interval = self.poll_interval
+            job.polled_at = time.monotonic()
+            job.next_poll = job.polled_at + job.poll_interval
+            if job.ended:
+                # Cancelled while being submitted
+                cancelled = True
+            else:
+                cancelled = False
+                job.state = batch.get("state") or "starting"
+        if cancelled:
+            self._delete(job)
+
+    def _poll(self, job):
+        error = None
+        try:
+            resp = job.client().get_batch_state(job.batch_id)
+            if resp.ok:
+                state = resp.json().get("state")
+            elif resp.status_code == 404:
+                state = FAILED
+            else:
+                state, error = None, "HTTP " + str(resp.status_code)
+        except Exception as e:
+            state, error = None, str(e)  # Transient error (HTTP, token): check again later
+        with self._condition:
+            if job.ended:
+                return
+            now = time.monotonic()
+            if state is None:
+                job.poll_failures += 1
+                lost = ((self.max_poll_failures and job.poll_failures >= self.max_poll_failures)
+                        or (self.lost_after and now - job.polled_at >= self.lost_after))
+            else:
+                job.poll_failures, job.polled_at, lost = 0, now, False
+            if state is not None and state != job.state:
+                job.poll_interval = self.poll_interval  # Reset the backoff on changes
+            else:
+                job.poll_interval = min(job.poll_interval * self.backoff, self.max_poll_interval)
+            job.next_poll = now + job.poll_interval
+            if lost:
+                job.error = "Lost, state unknown after " + str(job.poll_failures) + " failed checks: " + error
+                self._end(job, FAILED)
+            elif state in JOB_TERMINAL_STATES:
+                self._end(job, state)
+            elif state is not None:
+                job.state = state
+        if lost:
+            self._delete(job)  # Do not leave the batch running out of the caps, if Livy answers again
+
+    def _delete(self, job):
+        try:
+            resp = job.client().delete_batch(job.batch_id)
+            if not resp.ok and resp.status_code != 404:
+                resp.raise_for_status()
+        except Exception as e:
+            job.error = (job.error + "; delete failed: " if job.error else "") + str(e)
+
+    def _end(self, job, state):
+        # Called with the lock held: free the job's slot and keep it in the history
+        job.state = state
+        job.ended_at = time.time()
+        self._running.pop(job.id, None)
+        self._ended.append(job)
+        while len(self._ended) > self.history:
+            self._jobs.pop(self._ended.popleft().id, None)
+        self._condition.notify()
@@ -0,0 +1,125 @@
+"""
+Per-endpoint circuit breaker of the Livy calls.
+
+When Fabric is degraded, every call waits for the full timeout and the worker
+threads pile up behind it. The LivyCircuitBreaker, shared by the ApacheLivy clients
+(`breaker=`, which only pass it their GET calls: a failing write must not block the
+next ones), counts the consecutive failures of each workspace (the client base URL)
+and endpoint (method and route template, e.g. "GET /sessions/{id}/statements/{id}"):
+
+- closed: the calls go through. After `failure_threshold` consecutive failures
+  (connection error, or a 5xx response), the circuit opens.
+- open: the calls fail at once with LivyCircuitOpenError, a requests
+  RequestException like the other transport errors, for `reset_timeout` seconds.
+- half-open: then a single trial call goes through (the others still fail fast).
+  Its success closes the circuit, its failure opens it again.
+
+Throttled responses (429), local scheduler timeouts (LivyThrottledError) and the other
+errors (e.g. read timeouts) are not counted: they leave the circuit as it is.
+
+Usage:
+    from myapp.api.livy_circuit_breaker import LivyCircuitBreaker, LivyCircuitOpenError
+
+    breaker = LivyCircuitBreaker(failure_threshold=5, reset_timeout=30)
+    livy = ApacheLivy(base_url, access_token, breaker=breaker)
+    try:
+        livy.get_session(session_id)
+    except LivyCircuitOpenError:
+        ...                          # Livy is unhealthy, not called
+    breaker.states()                 # {(base_url, "GET /sessions/{id}"): "open", ...}
+"""
+import threading
+import time
+
+import requests
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class LivyCircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of calling an endpoint whose circuit is open."""
+
+
+class _Circuit:
+    __slots__ = ("state", "failures", "opened_at", "trial")
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.trial = False
+
+
+class LivyCircuitBreaker:
+    """
+    Consecutive failures counters and circuits, by workspace and endpoint.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._circuits = {}  # key -> _Circuit
+        self._lock = threading.Lock()
+
+    def call(self, key, send):
+        """Call `send` unless the circuit of `key` is open, and record its outcome."""
+        self.before(key)
+        try:
+            resp = send()
+        except requests.exceptions.ConnectionError:
+            self.record(key, False)
+            raise
+        except BaseException:
+            self.release(key)
+            raise
+        if resp.status_code == 429:
+            self.release(key)
+        else:
+            self.record(key, resp.status_code < 500)
+        return resp
+
+    def before(self, key):
+        """Raise LivyCircuitOpenError when `key` must not be called now."""
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None or circuit.state == CLOSED:
+                return
+            retry_in = circuit.opened_at + self.reset_timeout - time.monotonic()
+            if circuit.state == OPEN and retry_in <= 0:
+                circuit.state = HALF_OPEN
+            if circuit.state == HALF_OPEN and not circuit.trial:
+                circuit.trial = True
+                return
+        raise LivyCircuitOpenError("Livy endpoint " + key[-1] + " is failing, not called (circuit open"
+                                   + (", retried in " + str(round(retry_in)) + "s)" if retry_in > 0 else ", trial call in progress)"))
+
+    def record(self, key, success):
+        """Record the outcome of a call let through by before()."""
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if success:
+                if circuit is not None:
+                    # Closed again: nothing to keep
+                    del self._circuits[key]
+                return
+            if circuit is None:
+                circuit = self._circuits[key] = _Circuit()
+            circuit.failures += 1
+            circuit.trial = False
+            if circuit.state == HALF_OPEN or circuit.failures >= self.failure_threshold:
+                circuit.state = OPEN
+                circuit.opened_at = time.monotonic()
+
+    def release(self, key):
+        """Forget a call let through by before() whose outcome says nothing of the backend."""
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is not None:
+                circuit.trial = False
+
+    def states(self):
+        """State of the circuits which are not closed (or counting failures), by key."""
+        with self._lock:
+            return {key: circuit.state for key, circuit in self._circuits.items()}
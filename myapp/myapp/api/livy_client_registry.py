@@ -0,0 +1,80 @@
+"""
+Thread-safe registry of Livy clients.
+
+Clients (and their connection pools) are kept per key, typically (backend, identity),
+so they survive across requests and are never shared between identities.
+
+Usage:
+    from myapp.api.livy_client_registry import LivyClientRegistry
+
+    registry = LivyClientRegistry(lambda access_token: ApacheLivy(base_url, access_token), max_size=100)
+    livy = registry.get(("fabric", home_account_id), access_token)
+
+- get() returns the client registered for the key, creating it with `factory` if needed.
+  When the client exists, its token is rotated in place, keeping its connection pool.
+- The least recently used clients are evicted above `max_size`, and closed with
+  `on_evict` (ApacheLivy.close by default).
+- aclose() removes and awaits the aclose() of all the clients of a registry of async
+  clients (AsyncApacheLivy), e.g. before the event loop they are bound to ends.
+"""
+import threading
+from collections import OrderedDict
+
+
+class LivyClientRegistry:
+    """
+    LRU registry of Livy clients created by `factory(access_token)`.
+    """
+
+    def __init__(self, factory, max_size=100, on_evict=None):
+        self.factory = factory
+        self.max_size = max_size
+        self.on_evict = on_evict or (lambda client: client.close())
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, access_token):
+        """Return the client for `key`, using `access_token` from now on."""
+        evicted = []
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self.factory(access_token)
+                self._clients[key] = client
+                while len(self._clients) > self.max_size:
+                    evicted.append(self._clients.popitem(last=False)[1])
+            else:
+                self._clients.move_to_end(key)
+                client.access_token = access_token
+        for old_client in evicted:
+            self.on_evict(old_client)
+        return client
+
+    def peek(self, key):
+        """Return the client for `key` (or None), without creating it nor changing the LRU order."""
+        with self._lock:
+            return self._clients.get(key)
+
+    def discard(self, key):
+        """Remove and close the client for `key`, if any."""
+        with self._lock:
+            client = self._clients.pop(key, None)
+        if client is not None:
+            self.on_evict(client)
+
+    def clear(self):
+        """Remove and close all the clients."""
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), OrderedDict()
+        for client in clients:
+            self.on_evict(client)
+
+    async def aclose(self):
+        """Remove all the clients and await their aclose() (registry of async clients)."""
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), OrderedDict()
+        for client in clients:
+            await client.aclose()
+
+    def __len__(self):
+        return len(self._clients)
@@ -0,0 +1,127 @@
+"""
+Hedged Livy reads: a second identical GET when the first one is slower than usual.
+
+Fabric sometimes answers get_session or get_statement after several seconds while
+most calls take milliseconds. The LivyHedger, shared by the ApacheLivy clients
+(`hedger=`), keeps the recent latencies of each workspace and endpoint (method and
+route template). When a GET has not answered after the `percentile` latency of its
+endpoint (p95 by default), the same request is sent again, and the first response
+received is returned; the other one is closed when it arrives.
+
+- GET calls only: they are idempotent.
+- Hedging starts once `min_samples` latencies of the endpoint were recorded. The
+  delay is kept between `min_delay` and `max_delay` seconds.
+- The calls run on a pool of `max_workers` threads; when it is busy, the calls are
+  made directly, without hedging, so a degraded backend is not sent twice the load
+  (see also LivyCircuitBreaker).
+- The priority of the caller (interactive or background, see livy_scheduler.py) is
+  kept by the hedged calls.
+
+Usage:
+    from myapp.api.livy_hedging import LivyHedger
+
+    hedger = LivyHedger(percentile=95, min_delay=0.05, max_workers=16)
+    livy = ApacheLivy(base_url, access_token, hedger=hedger)
+    livy.get_statement(session_id, statement_id)     # hedged after the p95 latency
+    hedger.delay((base_url, "GET /sessions/{id}"))   # current hedging delay, None before min_samples
+"""
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
+
+
+class LivyHedger:
+    """
+    Latencies of the recent calls, by workspace and endpoint, and the threads of the hedged calls.
+    """
+
+    def __init__(self, percentile=95, min_delay=0.05, max_delay=None, min_samples=20, window=200, max_workers=16):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.window = window
+        self.max_workers = max_workers
+        self._latencies = {}  # key -> deque of the last `window` latencies
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="livy-hedge")
+
+    def call(self, key, send, on_hedge=None):
+        """
+        Call `send`, and call it again when it takes longer than the hedging delay of `key`.
+        Return the first response; `on_hedge()` is called when the second call is sent.
+        """
+        delay = self.delay(key)
+        if delay is None or not self._reserve(2):
+            return self._timed(key, send)
+        first = self._submit(key, send)
+        try:
+            resp = first.result(timeout=delay)
+        except FutureTimeoutError:
+            resp = None
+        except BaseException:
+            self._release(1)
+            raise
+        if resp is not None:
+            # The thread reserved for the second call was not used
+            self._release(1)
+            return resp
+        if on_hedge is not None:
+            on_hedge()
+        pending = {first, self._submit(key, send)}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.add_done_callback(_close_response)
+                    return future.result()
+            if not pending:
+                # Both failed: the error of the last one
+                return done.pop().result()
+
+    def delay(self, key):
+        """Hedging delay of `key` in seconds, None while too few latencies were recorded."""
+        with self._lock:
+            latencies = self._latencies.get(key)
+            if latencies is None or len(latencies) < self.min_samples:
+                return None
+            ordered = sorted(latencies)
+        delay = max(ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))], self.min_delay)
+        return delay if self.max_delay is None else min(delay, self.max_delay)
+
+    def _timed(self, key, send):
+        start = time.perf_counter()
+        resp = send()
+        with self._lock:
+            latencies = self._latencies.get(key)
+            if latencies is None:
+                latencies = self._latencies[key] = deque(maxlen=self.window)
+            latencies.append(time.perf_counter() - start)
+        return resp
+
+    def _submit(self, key, send):
+        context = contextvars.copy_context()
+        future = self._executor.submit(context.run, self._timed, key, send)
+        future.add_done_callback(lambda future: self._release(1))
+        return future
+
+    def _reserve(self, threads):
+        with self._lock:
+            if self._in_flight + threads > self.max_workers:
+                return False
+            self._in_flight += threads
+            return True
+
+    def _release(self, threads):
+        with self._lock:
+            self._in_flight -= threads
+
+
+def _close_response(future):
+    # The slower of two hedged calls: its connection is released
+    if future.exception() is None:
+        future.result().close()
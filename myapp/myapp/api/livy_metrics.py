@@ -0,0 +1,155 @@
+"""
+Per-endpoint metrics of the Livy calls, exported in the Prometheus text format.
+
+The Livy clients (ApacheLivy and AsyncApacheLivy, `metrics=`) record every call with
+its method and route template (e.g. "GET /sessions/{id}/statements/{id}"), so the
+metrics do not grow with the session and statement IDs.
+
+Usage:
+    from myapp.api.livy_metrics import LivyMetrics
+
+    metrics = LivyMetrics()
+    livy = ApacheLivy(base_url, access_token, metrics=metrics)
+    ...
+    text = metrics.render()    # Prometheus text exposition format
+
+Metrics:
+    - livy_requests_total{method, route, status}: calls by status code ("error"
+      when no response was received)
+    - livy_request_duration_seconds{method, route}: latency histogram
+    - livy_request_retries_total{method, route}: transport retries
+    - livy_response_size_bytes{method, route}: response size histogram
+    - livy_request_errors_total{method, route, error}: calls failed without response, by exception
+    - livy_hedged_requests_total{method, route}: second requests sent by the hedged reads
+    - livy_circuit_rejections_total{method, route}: calls not sent, their circuit being open
+
+Recording is a few dict updates and a bisect under one lock.
+"""
+import threading
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+
+class LivyMetrics:
+    """
+    Counters and histograms of the Livy calls, by method and route template.
+    """
+
+    def __init__(self, latency_buckets=LATENCY_BUCKETS, size_buckets=SIZE_BUCKETS):
+        self.latency_buckets = tuple(latency_buckets)
+        self.size_buckets = tuple(size_buckets)
+        self._requests = {}   # (method, route, status) -> count
+        self._latency = {}    # (method, route) -> _Histogram
+        self._size = {}       # (method, route) -> _Histogram
+        self._retries = {}    # (method, route) -> count
+        self._errors = {}     # (method, route, error) -> count
+        self._hedges = {}     # (method, route) -> count
+        self._rejections = {}  # (method, route) -> count
+        self._lock = threading.Lock()
+
+    def record(self, method, route, status, latency, retries=0, size=None):
+        """Record a call which got a response."""
+        key = (method, route)
+        with self._lock:
+            counter = (method, route, str(status))
+            self._requests[counter] = self._requests.get(counter, 0) + 1
+            self._observe(self._latency, key, self.latency_buckets, latency)
+            if size is not None:
+                self._observe(self._size, key, self.size_buckets, size)
+            if retries:
+                self._retries[key] = self._retries.get(key, 0) + retries
+
+    def record_error(self, method, route, error, latency):
+        """Record a call which failed without response (connection error, timeout...)."""
+        key = (method, route)
+        with self._lock:
+            counter = (method, route, "error")
+            self._requests[counter] = self._requests.get(counter, 0) + 1
+            self._observe(self._latency, key, self.latency_buckets, latency)
+            error_key = (method, route, type(error).__name__)
+            self._errors[error_key] = self._errors.get(error_key, 0) + 1
+
+    def record_hedge(self, method, route):
+        """Record a second request sent by a hedged read."""
+        with self._lock:
+            self._hedges[(method, route)] = self._hedges.get((method, route), 0) + 1
+
+    def record_rejection(self, method, route):
+        """Record a call rejected by an open circuit."""
+        with self._lock:
+            self._rejections[(method, route)] = self._rejections.get((method, route), 0) + 1
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            requests = dict(self._requests)
+            latency = {key: (list(h.counts), h.sum, h.count) for key, h in self._latency.items()}
+            size = {key: (list(h.counts), h.sum, h.count) for key, h in self._size.items()}
+            retries = dict(self._retries)
+            errors = dict(self._errors)
+            hedges = dict(self._hedges)
+            rejections = dict(self._rejections)
+        lines = []
+        self._render_counter(lines, "livy_requests_total", "Livy calls by method, route and status code.",
+                             ("method", "route", "status"), requests)
+        self._render_histogram(lines, "livy_request_duration_seconds", "Latency of the Livy calls.",
+                               self.latency_buckets, latency)
+        self._render_counter(lines, "livy_request_retries_total", "Transport retries of the Livy calls.",
+                             ("method", "route"), retries)
+        self._render_histogram(lines, "livy_response_size_bytes", "Size of the Livy responses.",
+                               self.size_buckets, size)
+        self._render_counter(lines, "livy_request_errors_total", "Livy calls failed without response, by exception.",
+                             ("method", "route", "error"), errors)
+        self._render_counter(lines, "livy_hedged_requests_total", "Second requests sent by the hedged Livy reads.",
+                             ("method", "route"), hedges)
+        self._render_counter(lines, "livy_circuit_rejections_total", "Livy calls not sent, their circuit being open.",
+                             ("method", "route"), rejections)
+        return "\n".join(lines) + "\n"
+
+    def _observe(self, histograms, key, buckets, value):
+        # Called with the lock held
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = _Histogram(buckets)
+        histogram.counts[bisect_left(buckets, value)] += 1
+        histogram.sum += value
+        histogram.count += 1
+
+    def _render_counter(self, lines, name, help, label_names, values):
+        lines.append("# HELP " + name + " " + help)
+        lines.append("# TYPE " + name + " counter")
+        for key, value in sorted(values.items()):
+            lines.append(name + _labels(zip(label_names, key)) + " " + str(value))
+
+    def _render_histogram(self, lines, name, help, buckets, values):
+        lines.append("# HELP " + name + " " + help)
+        lines.append("# TYPE " + name + " histogram")
+        for (method, route), (counts, total, count) in sorted(values.items()):
+            labels = [("method", method), ("route", route)]
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(name + "_bucket" + _labels(labels + [("le", _number(bound))]) + " " + str(cumulative))
+            lines.append(name + "_bucket" + _labels(labels + [("le", "+Inf")]) + " " + str(count))
+            lines.append(name + "_sum" + _labels(labels) + " " + _number(total))
+            lines.append(name + "_count" + _labels(labels) + " " + str(count))
+
+
+def _labels(pairs):
+    return "{" + ",".join(name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+                          for name, value in pairs) + "}"
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
@@ -0,0 +1,147 @@
+"""
+Typed models of the Livy responses, decoded once.
+
+`resp.json()` decodes the body again at each call. body(resp) decodes it once and
+keeps the result on the response, and model(resp) returns it as a compact model
+(classes with __slots__) chosen from the endpoint the response comes from:
+
+    - Session: POST /sessions, GET /sessions/{id}, GET /sessions/{id}/state
+    - Statement: POST /sessions/{id}/statements, GET /sessions/{id}/statements/{id}
+    - Batch: POST /batches, GET /batches/{id}, GET /batches/{id}/state
+    - LogPage: GET /sessions/{id}/log, GET /batches/{id}/log
+    - a list of Session, Statement or Batch for GET /sessions, /sessions/{id}/statements, /batches
+    - the decoded body for the other endpoints (delete, cancel)
+
+The clients return these models directly when created with `typed=True`
+(ApacheLivy(..., typed=True)); model() is for the responses of untyped clients.
+
+Usage:
+    from myapp.api.livy_models import model, body
+
+    api_result = livy.get_statement(session_id, statement_id)
+    api_result.raise_for_status()
+    statement = model(api_result)
+    if statement.state == "available" and not statement.output.is_error:
+        text = statement.output.text
+
+The body is decoded in full, once (the json module has no lazy decoding); the output
+of a statement (StatementOutput) and its data are only wrapped when read, so polling
+a statement does not allocate them. Models do not check the
+status code: call raise_for_status() (or check resp.ok) first.
+"""
+
+_MISSING = object()
+
+
+def body(resp):
+    """The decoded JSON body of `resp`, decoded on the first call only."""
+    decoded = getattr(resp, "_livy_body", _MISSING)
+    if decoded is _MISSING:
+        decoded = resp.json()
+        resp._livy_body = decoded
+    return decoded
+
+
+class Session:
+    __slots__ = ("id", "name", "kind", "state", "app_id", "app_info")
+
+    def __init__(self, data):
+        self.id = data.get("id")
+        self.name = data.get("name")
+        self.kind = data.get("kind")
+        self.state = data.get("state")
+        self.app_id = data.get("appId")
+        self.app_info = data.get("appInfo")
+
+
+class Batch:
+    __slots__ = ("id", "name", "state", "app_id", "app_info")
+
+    def __init__(self, data):
+        self.id = data.get("id")
+        self.name = data.get("name")
+        self.state = data.get("state")
+        self.app_id = data.get("appId")
+        self.app_info = data.get("appInfo")
+
+
+class StatementOutput:
+    __slots__ = ("status", "execution_count", "ename", "evalue", "traceback", "data")
+
+    def __init__(self, data):
+        self.status = data.get("status")
+        self.execution_count = data.get("execution_count")
+        self.ename = data.get("ename")
+        self.evalue = data.get("evalue")
+        self.traceback = data.get("traceback")
+        self.data = data.get("data") or {}
+
+    @property
+    def is_error(self):
+        return self.status == "error"
+
+    @property
+    def text(self):
+        """The text/plain output (None if there is none)."""
+        return self.data.get("text/plain")
+
+
+class Statement:
+    __slots__ = ("id", "code", "state", "progress", "started", "completed", "_output", "_raw_output")
+
+    def __init__(self, data):
+        self.id = data.get("id")
+        self.code = data.get("code")
+        self.state = data.get("state")
+        self.progress = data.get("progress")
+        self.started = data.get("started")
+        self.completed = data.get("completed")
+        self._raw_output = data.get("output")
+        self._output = None
+
+    @property
+    def output(self):
+        """The StatementOutput (None until the statement ran), built on first access."""
+        if self._output is None and self._raw_output is not None:
+            self._output = StatementOutput(self._raw_output)
+        return self._output
+
+
+class LogPage:
+    __slots__ = ("id", "from_line", "total", "lines")
+
+    def __init__(self, data):
+        self.id = data.get("id")
+        self.from_line = data.get("from")
+        self.total = data.get("total")
+        self.lines = data.get("log") or []
+
+
+# (method, route template) -> model, or (model, key of the list)
+MODELS = {
+    ("POST", "/sessions"): Session,
+    ("GET", "/sessions"): (Session, "sessions"),
+    ("GET", "/sessions/{id}"): Session,
+    ("GET", "/sessions/{id}/state"): Session,
+    ("GET", "/sessions/{id}/log"): LogPage,
+    ("POST", "/sessions/{id}/statements"): Statement,
+    ("GET", "/sessions/{id}/statements"): (Statement, "statements"),
+    ("GET", "/sessions/{id}/statements/{id}"): Statement,
+    ("POST", "/batches"): Batch,
+    ("GET", "/batches"): (Batch, "sessions"),
+    ("GET", "/batches/{id}"): Batch,
+    ("GET", "/batches/{id}/state"): Batch,
+    ("GET", "/batches/{id}/log"): LogPage,
+}
+
+
+def model(resp):
+    """The model of a Livy client response (see the module docstring)."""
+    decoded = body(resp)
+    model_class = MODELS.get(getattr(resp, "livy_route", None))
+    if model_class is None:
+        return decoded
+    if isinstance(model_class, tuple):
+        model_class, key = model_class
+        return [model_class(item) for item in decoded.get(key) or []]
+    return model_class(decoded)
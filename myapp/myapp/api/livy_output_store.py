@@ -0,0 +1,337 @@
+"""
+Spill store for large Livy statement outputs.
+
+A statement output of several MB (df.show(), collect()...) should not be kept in
+memory and pasted whole into a page. The LivyOutputStore writes outputs larger than
+`threshold` bytes to temporary files, converted once from their MIME type, and serves
+them back by byte ranges (pages) or as a stream.
+
+Usage:
+    from myapp.api.livy_output_store import LivyOutputStore, read_json
+
+    store = LivyOutputStore(threshold=256 * 1024, max_bytes=512 * 1024 * 1024)
+    statement = read_json(livy.get_statement(session_id, statement_id, stream=True))   # parsed as it arrives when large
+    entries = store.put_output(key, statement["output"]["data"])   # {mime: (content_type, size) or inline value}
+    page = store.read(key, "text/plain", offset=0, length=65536)
+    f = store.open(key, "text/plain")   # None when not stored
+
+MIME types:
+    - text/plain: stored as UTF-8 text
+    - application/json: stored as JSON, without going through the text rendering
+    - application/vnd.livy.table.v1+json (Livy tables): stored as CSV, row by row
+    - image/png: stored decoded (the Livy payload is base64)
+Other types are stored as JSON.
+
+Only the values whose estimated size reaches `threshold` are converted and written:
+smaller ones are returned inline as they are.
+
+The store is bounded to `max_bytes` on disk, the least recently used outputs being
+deleted first. Outputs are keyed by statement, e.g. (backend, owner, session start,
+session ID, statement ID), and dropped with discard_session() (the key prefix of a
+session) when the Livy session is deleted.
+"""
+import base64
+import codecs
+import csv
+import io
+import itertools
+import json
+import json.scanner
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+TABLE_MIME = "application/vnd.livy.table.v1+json"
+
+CONTENT_TYPES = {
+    "text/plain": "text/plain; charset=utf-8",
+    "application/json": "application/json",
+    TABLE_MIME: "text/csv; charset=utf-8",
+    "image/png": "image/png",
+}
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_LITERAL = re.compile(r"true|false|null|-?(?:0|[1-9][0-9]*)(\.[0-9]+)?([eE][-+]?[0-9]+)?")
+_CONSTANTS = {"true": True, "false": False, "null": None}
+_scan = json.scanner.make_scanner(json.JSONDecoder())
+
+
+def read_json(resp, chunk_size=64 * 1024, max_memory=1024 * 1024):
+    """
+    Decode the JSON body of a streamed response (stream=True). Bodies up to `max_memory`
+    bytes are decoded at once; larger ones are parsed as their chunks arrive, so that the
+    body is never held whole next to the decoded value.
+    """
+    chunks, size, content = [], 0, resp.iter_content(chunk_size)
+    for chunk in content:
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > max_memory:
+            break
+    else:
+        return json.loads(b"".join(chunks).decode(resp.encoding or "utf-8"))
+    decoder = codecs.getincrementaldecoder(resp.encoding or "utf-8")()
+    body = itertools.chain(chunks, content, [b""])
+    return _JsonStream(decoder.decode(chunk, final=not chunk) for chunk in body).parse()
+
+
+class LivyOutputStore:
+    """
+    Disk spill of large statement outputs, with byte-range reads.
+    """
+
+    def __init__(self, threshold=256 * 1024, max_bytes=512 * 1024 * 1024, directory=None):
+        self.threshold = threshold
+        self.max_bytes = max_bytes
+        self.directory = directory or tempfile.mkdtemp(prefix="livy-outputs-")
+        os.makedirs(self.directory, exist_ok=True)
+        self._entries = OrderedDict()  # (key, mime) -> (path, size)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def put_output(self, key, data):
+        """
+        Spill the large values of a statement output `data` ({mime: value}).
+        Returns {mime: value} where the spilled values are replaced by a (content_type, size) tuple.
+        """
+        result = {}
+        for mime, value in data.items():
+            if _estimated_size(value, self.threshold) < self.threshold:
+                # Small values are kept inline without being converted to a file and read back
+                result[mime] = value
+                continue
+            path, size = self._write(mime, value)
+            if size < self.threshold:
+                os.remove(path)
+                result[mime] = value
+            else:
+                self._add((key, mime), path, size)
+                result[mime] = (CONTENT_TYPES.get(mime, "application/json"), size)
+        return result
+
+    def has(self, key, mime):
+        with self._lock:
+            return (key, mime) in self._entries
+
+    def size(self, key, mime):
+        with self._lock:
+            entry = self._entries.get((key, mime))
+        return entry[1] if entry else None
+
+    def read(self, key, mime, offset=0, length=None):
+        """Bytes [offset, offset + length) of a spilled output, or None when not stored."""
+        f = self.open(key, mime)
+        if f is None:
+            return None
+        with f:
+            f.seek(offset)
+            return f.read(length if length is not None else -1)
+
+    def open(self, key, mime):
+        """Binary file of a spilled output (to stream it, the caller closes it), or None when not stored."""
+        with self._lock:
+            entry = self._entries.get((key, mime))
+            if entry:
+                self._entries.move_to_end((key, mime))
+        if entry is None:
+            return None
+        try:
+            return open(entry[0], "rb")
+        except FileNotFoundError:
+            return None
+
+    def discard_session(self, session_key):
+        """Delete the outputs of a session, `session_key` being the prefix of the keys of its statements."""
+        with self._lock:
+            keys = [entry_key for entry_key in self._entries if entry_key[0][:len(session_key)] == tuple(session_key)]
+            removed = [self._entries.pop(entry_key) for entry_key in keys]
+            self._size -= sum(size for _, size in removed)
+        for path, _ in removed:
+            _remove(path)
+
+    def _write(self, mime, value):
+        fd, path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            if mime == "text/plain":
+                f.write(value.encode("utf-8"))
+            elif mime == TABLE_MIME and isinstance(value, dict):
+                text = io.TextIOWrapper(f, encoding="utf-8", newline="")
+                writer = csv.writer(text)
+                writer.writerow([header.get("name") for header in value.get("headers", [])])
+                for row in value.get("data", []):
+                    writer.writerow(row)
+                text.flush()
+                text.detach()
+            elif mime == "image/png" and isinstance(value, str):
+                f.write(base64.b64decode(value))
+            else:
+                text = io.TextIOWrapper(f, encoding="utf-8")
+                json.dump(value, text)
+                text.flush()
+                text.detach()
+            size = f.tell()
+        return path, size
+
+    def _add(self, entry_key, path, size):
+        with self._lock:
+            previous = self._entries.pop(entry_key, None)
+            if previous:
+                self._size -= previous[1]
+            self._entries[entry_key] = (path, size)
+            self._size += size
+            evicted = []
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, (old_path, old_size) = self._entries.popitem(last=False)
+                self._size -= old_size
+                evicted.append(old_path)
+        for old_path in evicted + ([previous[0]] if previous else []):
+            _remove(old_path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _estimated_size(value, limit):
+    # Approximate size of `value` once stored, counted only up to `limit` (cheap for large values)
+    size, stack = 0, [value]
+    while stack and size < limit:
+        item = stack.pop()
+        if isinstance(item, str):
+            size += len(item)
+        elif isinstance(item, dict):
+            size += 2 + len(item)
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            size += 2 + len(item)
+            stack.extend(item)
+        else:
+            size += 4
+    return size
+
+
+class _JsonStream:
+    """
+    Incremental JSON parser over an iterable of text chunks, holding only the unparsed
+    part of the body (at most a chunk, or the token being read) next to the value.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ""
+        self.pos = 0
+
+    def parse(self):
+        value = self._value()
+        if self._peek():
+            raise ValueError("Extra data after the JSON value at " + str(self.pos))
+        return value
+
+    def _value(self):
+        char = self._peek()
+        try:
+            # Values complete in the buffer are decoded at once by the json module
+            value, end = _scan(self.buffer, self.pos)
+            if end + 3 <= len(self.buffer):
+                self.pos = end
+                return value
+        except (StopIteration, ValueError):
+            pass
+        if char == '"':
+            return self._string()
+        if char == "{":
+            self.pos += 1
+            value = {}
+            if self._peek() == "}":
+                self.pos += 1
+                return value
+            while True:
+                if self._peek() != '"':
+                    raise ValueError("Expecting a property name at " + str(self.pos))
+                key = self._string()
+                self._expect(":")
+                value[key] = self._value()
+                if self._expect(",}") == "}":
+                    return value
+        if char == "[":
+            self.pos += 1
+            value = []
+            if self._peek() == "]":
+                self.pos += 1
+                return value
+            while True:
+                value.append(self._value())
+                if self._expect(",]") == "]":
+                    return value
+        return self._literal()
+
+    def _string(self):
+        # Read on until the closing quote is in the buffer, then let the json module decode the string
+        end = self.pos + 1
+        while True:
+            end = self.buffer.find('"', end)
+            if end < 0:
+                end = len(self.buffer) - self.pos
+                if not self._more():
+                    raise ValueError("Unterminated string at " + str(self.pos))
+                continue
+            escapes = end
+            while self.buffer[escapes - 1] == "\\":
+                escapes -= 1
+            if (end - escapes) % 2 == 0:
+                break
+            end += 1
+        value, self.pos = json.decoder.scanstring(self.buffer, self.pos + 1)
+        return value
+
+    def _literal(self):
+        while True:
+            match = _LITERAL.match(self.buffer, self.pos)
+            # A few characters past the match, so that e.g. "1" is not read from "1.5" split after "1."
+            incomplete = (match.end() if match else self.pos + 3) + 3 > len(self.buffer)
+            if not (incomplete and self._more()):
+                break
+        if match is None:
+            raise ValueError("Expecting a value at " + str(self.pos))
+        self.pos = match.end()
+        text = match.group()
+        if text in _CONSTANTS:
+            return _CONSTANTS[text]
+        return float(text) if match.group(1) or match.group(2) else int(text)
+
+    def _expect(self, chars):
+        char = self._peek()
+        if not char or char not in chars:
+            raise ValueError("Expecting one of " + repr(chars) + " at " + str(self.pos))
+        self.pos += 1
+        return char
+
+    def _peek(self):
+        # Next non-whitespace character ("" at the end of the body)
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._more():
+                return ""
+
+    def _more(self):
+        # Append at least as much text as is left unparsed, so that long tokens are rescanned a few times only
+        parts, size = [self.buffer[self.pos:]], 0
+        for chunk in self.chunks:
+            if not chunk:
+                continue  # e.g. the first bytes of a multi-byte character
+            parts.append(chunk)
+            size += len(chunk)
+            if size >= len(parts[0]):
+                break
+        if not size:
+            return False
+        self.buffer, self.pos = "".join(parts), 0
+        return True
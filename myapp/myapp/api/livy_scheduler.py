@@ -0,0 +1,174 @@
+"""
+Throttling-aware scheduler of Livy calls.
+
+Fabric throttles the Livy API (429, or 503 with a Retry-After header). The
+LivyRequestScheduler, shared by the ApacheLivy clients (`scheduler=`), smooths the
+calls so that bursts are queued locally instead of being rejected by the server:
+
+- Token bucket per workspace (the client base URL) and endpoint (method and route
+  template, e.g. "GET /sessions/{id}/statements/{id}"): `rate` calls per second,
+  bursts of up to `burst` calls.
+- A throttled response (429, or 503 with Retry-After) pauses the bucket for the
+  Retry-After delay (seconds or HTTP date), then the call is retried, up to
+  `max_retries` times. The last response is returned as-is when the retries are
+  exhausted or would end after the deadline.
+- Waiting calls are served by priority: interactive calls (the default, e.g.
+  submit_statement) go before background calls (polling, log tails, pools...),
+  marked with `with background():`. Calls of the same priority are served in order.
+- A call waiting more than `max_wait` seconds for its turn raises LivyThrottledError,
+  a requests RequestException like the other transport errors.
+
+Usage:
+    from myapp.api.livy_scheduler import LivyRequestScheduler, background
+
+    scheduler = LivyRequestScheduler(rate=10, burst=20, max_wait=60)
+    livy = ApacheLivy(base_url, access_token, scheduler=scheduler)
+    livy.submit_statement(session_id, code)        # interactive
+    with background():
+        livy.get_session_state(session_id)         # served after the interactive calls
+    # or, for a function (e.g. the target of a background thread): @in_background
+
+`rate=0` disables the token buckets, keeping the Retry-After handling and the priorities.
+"""
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from email.utils import parsedate_to_datetime
+
+import requests
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_priority = ContextVar("livy_request_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def background():
+    """Mark the Livy calls made in this block as background calls."""
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def in_background(function):
+    """Decorator marking the Livy calls made by `function` as background calls (e.g. a thread's target)."""
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        with background():
+            return function(*args, **kwargs)
+    return wrapper
+
+
+class LivyThrottledError(requests.exceptions.RequestException):
+    """Raised when a call could not get its turn within the scheduler's `max_wait`."""
+
+
+class _Bucket:
+    def __init__(self, burst):
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.waiters = []  # heap of (priority, sequence)
+
+
+class LivyRequestScheduler:
+    """
+    Token buckets per (workspace, endpoint), honouring Retry-After, serving the waiting calls by priority.
+    """
+
+    THROTTLED_STATUS_CODES = (429, 503)
+
+    def __init__(self, rate=10, burst=20, max_wait=60, max_retries=3, default_retry_after=1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.default_retry_after = default_retry_after
+        self._buckets = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def call(self, key, send, priority=None):
+        """Run `send()` (returning a response) in the turn of `key`, retrying the throttled responses."""
+        priority = _priority.get() if priority is None else priority
+        deadline = time.monotonic() + self.max_wait
+        for attempt in range(self.max_retries + 1):
+            self.acquire(key, priority, deadline)
+            resp = send()
+            retry_after = self.retry_after(resp)
+            if retry_after is None or attempt == self.max_retries or time.monotonic() + retry_after > deadline:
+                return resp
+            self.pause(key, retry_after)
+            resp.close()
+        return resp
+
+    def acquire(self, key, priority=INTERACTIVE, deadline=None):
+        """Wait for the turn of a call to `key`: its priority first in line, a token available and the bucket not paused."""
+        deadline = deadline if deadline is not None else time.monotonic() + self.max_wait
+        with self._condition:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = _Bucket(self.burst)
+            entry = (priority, next(self._sequence))
+            heapq.heappush(bucket.waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(bucket, now)
+                    if bucket.paused_until > now:
+                        delay = bucket.paused_until - now
+                    elif bucket.waiters[0] != entry:
+                        delay = None  # Woken up when the calls in front of it are served
+                    elif not self.rate or bucket.tokens >= 1:
+                        if self.rate:
+                            bucket.tokens -= 1
+                        return
+                    else:
+                        delay = (1 - bucket.tokens) / self.rate
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise LivyThrottledError("Livy call to " + " ".join(str(part) for part in key) + " throttled for more than " + str(self.max_wait) + "s")
+                    self._condition.wait(remaining if delay is None else min(delay, remaining))
+            finally:
+                bucket.waiters.remove(entry)
+                heapq.heapify(bucket.waiters)
+                self._condition.notify_all()
+
+    def pause(self, key, seconds):
+        """Hold the calls to `key` for `seconds` (Retry-After)."""
+        with self._condition:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = _Bucket(self.burst)
+            bucket.paused_until = max(bucket.paused_until, time.monotonic() + seconds)
+            bucket.tokens = min(bucket.tokens, 0)
+            self._condition.notify_all()
+
+    def retry_after(self, resp):
+        """Seconds to wait before retrying a throttled response, or None when the response is not throttled."""
+        if resp.status_code not in self.THROTTLED_STATUS_CODES:
+            return None
+        value = resp.headers.get("Retry-After")
+        if value is None:
+            # A 503 without Retry-After is an outage rather than throttling
+            return self.default_retry_after if resp.status_code == 429 else None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return self.default_retry_after
+
+    def _refill(self, bucket, now):
+        if self.rate:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+        bucket.updated = now
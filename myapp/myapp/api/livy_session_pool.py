@@ -0,0 +1,160 @@
+"""
+Pool of pre-started ("warm") Livy sessions.
+
+Starting a Spark session takes from seconds (Fabric Starter Pool) to minutes (custom
+environment, pyFiles). The LivySessionPool keeps up to `size` sessions started in
+advance, so a user asking for a session gets one that is already idle.
+
+Usage:
+    from myapp.api.livy_session_pool import LivySessionPool
+
+    pool = LivySessionPool(client, session_data=lambda: {...}, size=2, idle_ttl=900)
+    pool.replenish()                # start sessions in the background
+    session_id = pool.acquire()     # an idle session ID, or None if the pool is empty
+
+- `client` is a callable returning the ApacheLivy client to use, with a valid token:
+  the pool works in the background, after the request that created it, and its
+  sessions are expired long after that request's token was issued.
+- acquire() hands out the oldest ready session (checking it is still idle) and
+  replenishes the pool in the background.
+- The pool never holds more than `size` sessions (ready + starting).
+- Ready sessions not handed out within `idle_ttl` seconds are deleted, so an unused
+  pool does not hold Spark capacity. The pool is refilled on the next acquire().
+  A session whose deletion fails is kept in the pool and deleted again at the next
+  expiry check, rather than left running unknown to the app.
+- close() deletes the sessions still in the pool.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from myapp.api.livy_scheduler import in_background
+
+logger = logging.getLogger(__name__)
+
+
+class LivySessionPool:
+    """
+    Pool of pre-started Livy sessions, created with `client()` (an ApacheLivy client)
+    and the payload returned by `session_data()`.
+    """
+
+    def __init__(self, client, session_data, size=1, idle_ttl=900, start_wait=600):
+        self.client = client
+        self.session_data = session_data
+        self.size = size
+        self.idle_ttl = idle_ttl
+        self.start_wait = start_wait
+        self._ready = deque()  # (session_id, ready_since)
+        self._starting = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._reaper = None
+
+    def acquire(self):
+        """Return the ID of a ready (idle) session, or None if there is none, and replenish the pool."""
+        session_id, undeleted = None, []
+        while session_id is None:
+            with self._lock:
+                if not self._ready:
+                    break
+                candidate, _ = self._ready.popleft()
+            if self._is_idle(candidate):
+                session_id = candidate
+            elif not self._delete(candidate):
+                # Expired at once by the next check
+                undeleted.append((candidate, float("-inf")))
+        self._requeue(undeleted)
+        self.replenish()
+        return session_id
+
+    def replenish(self):
+        """Start, in the background, the sessions missing to reach `size`."""
+        if self._closed.is_set():
+            return
+        with self._lock:
+            missing = self.size - len(self._ready) - self._starting
+            self._starting += max(missing, 0)
+            if self._reaper is None and missing > 0:
+                self._reaper = threading.Thread(target=self._expire_loop, name="livy-session-pool-expire", daemon=True)
+                self._reaper.start()
+        for _ in range(missing):
+            threading.Thread(target=self._start_session, name="livy-session-pool-start", daemon=True).start()
+
+    def expire(self):
+        """Delete the ready sessions which were not handed out within `idle_ttl` seconds."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [item for item in self._ready if now - item[1] >= self.idle_ttl]
+            self._ready = deque(item for item in self._ready if now - item[1] < self.idle_ttl)
+        # Not deleted (token, Livy unavailable...): deleted again at the next check
+        self._requeue([item for item in expired if not self._delete(item[0])])
+
+    def close(self):
+        """Stop replenishing the pool and delete the sessions it holds."""
+        self._closed.set()
+        with self._lock:
+            ready, self._ready = self._ready, deque()
+        for session_id, _ in ready:
+            self._delete(session_id)
+
+    def _requeue(self, items):
+        if items:
+            with self._lock:
+                self._ready.extend(items)
+
+    def __len__(self):
+        return len(self._ready)
+
+    def __contains__(self, session_id):
+        with self._lock:
+            return any(ready_id == session_id for ready_id, _ in self._ready)
+
+    @in_background
+    def _start_session(self):
+        session_id = None
+        try:
+            livy = self.client()
+            api_result = livy.create_session(data=self.session_data())
+            api_result.raise_for_status()
+            session_id = api_result.json()["id"]
+            api_result = livy.wait_for_session(session_id, wait=self.start_wait)
+            state = api_result.json().get("state") if api_result.ok else None
+        except Exception as e:
+            logger.warning("Error starting a pooled Livy session: %s", e)
+            state = None
+        with self._lock:
+            self._starting -= 1
+            if state == "idle" and not self._closed.is_set():
+                self._ready.append((session_id, time.monotonic()))
+                session_id = None
+        if session_id is not None:
+            # Failed to become idle in time, or pool closed meanwhile
+            self._delete(session_id)
+
+    def _is_idle(self, session_id):
+        try:
+            api_result = self.client().get_session_state(session_id)
+            return api_result.ok and api_result.json().get("state") == "idle"
+        except Exception:
+            return False
+
+    def _delete(self, session_id):
+        # The client (and its token) is taken at each deletion: the pool may have been idle for hours
+        try:
+            api_result = self.client().delete_session(session_id)
+        except Exception as e:
+            logger.warning("Error deleting the pooled Livy session %s: %s", session_id, e)
+            return False
+        if not api_result.ok and api_result.status_code != 404:
+            logger.warning("Error deleting the pooled Livy session %s: HTTP %s", session_id, api_result.status_code)
+            return False
+        return True
+
+    @in_background
+    def _expire_loop(self):
+        interval = max(min(self.idle_ttl / 2, 60), 1)
+        while not self._closed.wait(interval):
+            self.expire()
+
@@ -0,0 +1,162 @@
+"""
+Reaper of the idle Livy sessions created by the app.
+
+Sessions are deleted when the user stops them or logs out; abandoned browser sessions
+leave Spark sessions running and holding capacity. The LivySessionReaper tracks the
+last activity of the sessions and, every `interval` seconds, lists the sessions of
+the app (named with `name_prefix`) and deletes those idle for more than `idle_ttl`
+seconds.
+
+Usage:
+    from myapp.api.livy_session_reaper import LivySessionReaper
+
+    reaper = LivySessionReaper(name_prefix="MyApp-", idle_ttl=1800, interval=60,
+                               last_activity=lambda session_id: registry.last_activity(backend, session_id),
+                               on_reap=lambda session_id: registry.release(backend, session_id=session_id))
+    reaper.touch(owner, session_id, client, on_reap=lambda session_id: ...)  # on each use of the session
+    reaper.forget(session_id)                                                # session deleted by the user
+
+- `owner` identifies whose client lists and deletes the sessions (e.g. (backend,
+  identity)), `client` is a callable returning that ApacheLivy client with a valid token.
+- Only the sessions in the "idle" state are reaped: a busy session (statement
+  running) counts as active.
+- Sessions of the app found by list_sessions but never touched in this process
+  (e.g. after a restart) are idle since their `last_activity`, else since they were found.
+- `last_activity(session_id)` (optional) is the UNIX time of the last activity on the
+  session seen by all the processes (e.g. the heartbeat of the LivySessionRegistry), or
+  None: a session used through another worker process is not idle.
+- `on_reap(session_id)` of touch() runs after the deletion, to clear the references
+  to the session, and so does the `on_reap` of the reaper for every reaped session
+  (e.g. to release it in the registry).
+- `ignore(session_id)` (optional) protects sessions from the reaper, e.g. those of a session pool.
+"""
+import logging
+import threading
+import time
+
+from myapp.api.livy_scheduler import in_background
+
+logger = logging.getLogger(__name__)
+
+
+class LivySessionReaper:
+    """
+    Background deletion of the app's Livy sessions idle for more than `idle_ttl` seconds.
+    """
+
+    def __init__(self, name_prefix="", idle_ttl=1800, interval=60, page_size=100, ignore=None, last_activity=None, on_reap=None):
+        self.name_prefix = name_prefix
+        self.idle_ttl = idle_ttl
+        self.interval = interval
+        self.page_size = page_size
+        self.ignore = ignore or (lambda session_id: False)
+        self.last_activity = last_activity or (lambda session_id: None)
+        self.on_reap = on_reap
+        self._owners = {}    # owner -> client callable
+        self._sessions = {}  # str(session ID) -> [owner, last activity, on_reap]
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._worker = None
+
+    def touch(self, owner, session_id, client, on_reap=None):
+        """Record an activity on `session_id`, and start the reaper if needed."""
+        with self._lock:
+            self._owners[owner] = client
+            entry = self._sessions.get(str(session_id))
+            if entry is None or entry[0] != owner:
+                self._sessions[str(session_id)] = [owner, time.monotonic(), on_reap]
+            else:
+                entry[1] = time.monotonic()
+                entry[2] = on_reap or entry[2]
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="livy-session-reaper", daemon=True)
+                self._worker.start()
+
+    def forget(self, session_id):
+        """Stop tracking `session_id` (deleted by the user)."""
+        with self._lock:
+            self._sessions.pop(str(session_id), None)
+
+    def stop(self):
+        self._stopped.set()
+
+    def reap(self):
+        """Delete the idle sessions of all the owners. Return the IDs of the deleted sessions."""
+        with self._lock:
+            owners = list(self._owners.items())
+        reaped = []
+        for owner, client in owners:
+            try:
+                reaped.extend(self._reap_owner(owner, client()))
+            except Exception:
+                # Tried again on the next round
+                logger.warning("Error reaping the idle Livy sessions of %s", owner, exc_info=True)
+        return reaped
+
+    def _reap_owner(self, owner, livy):
+        now = time.monotonic()
+        to_delete, listed = [], set()
+        for session in self._list_sessions(livy):
+            if not str(session.get("name") or "").startswith(self.name_prefix):
+                continue
+            session_id = str(session.get("id"))
+            listed.add(session_id)
+            with self._lock:
+                entry = self._sessions.get(session_id)
+                found = entry is None
+                if found:
+                    entry = self._sessions[session_id] = [owner, now, None]
+                elif entry[0] != owner:
+                    continue
+                if session.get("state") != "idle":
+                    entry[1] = now  # Starting or running a statement
+                    continue
+                idle = None if found else now - entry[1]
+            if (idle is not None and idle < self.idle_ttl) or self.ignore(session.get("id")):
+                continue
+            # Idle in this process (or found without being touched in it): and in the others?
+            last_activity = self.last_activity(session.get("id"))
+            if last_activity is not None:
+                idle = time.time() - last_activity if idle is None else min(idle, time.time() - last_activity)
+            with self._lock:
+                entry = self._sessions.get(session_id)
+                if entry is None or entry[0] != owner or idle is None:
+                    # Untouched and unknown elsewhere: its idle time starts now
+                    continue
+                if idle >= self.idle_ttl:
+                    to_delete.append((session.get("id"), self._sessions.pop(session_id)[2]))
+                else:
+                    entry[1] = max(entry[1], now - idle)
+        with self._lock:
+            # Sessions gone (deleted elsewhere, dead and cleaned up by Livy)
+            for session_id in [session_id for session_id, entry in self._sessions.items() if entry[0] == owner and session_id not in listed]:
+                del self._sessions[session_id]
+
+        reaped = []
+        for session_id, on_reap in to_delete:
+            api_result = livy.delete_session(session_id)
+            if not api_result.ok and api_result.status_code != 404:
+                continue
+            reaped.append(session_id)
+            for callback in (on_reap, self.on_reap):
+                if callback:
+                    callback(session_id)
+        return reaped
+
+    def _list_sessions(self, livy):
+        # All the sessions, page by page (Livy returns {"from", "total", "sessions"})
+        start = 0
+        while True:
+            api_result = livy.list_sessions(params={"from": start, "size": self.page_size})
+            api_result.raise_for_status()
+            page = api_result.json()
+            sessions = page.get("sessions") or []
+            yield from sessions
+            start += len(sessions)
+            if not sessions or start >= page.get("total", 0):
+                return
+
+    @in_background
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.reap()
@@ -0,0 +1,205 @@
+"""
+Registry of the live Livy sessions of the app and of their owners, shared by the processes.
+
+Each worker process has its own Livy state (with LIVY_STATE_STORE=memory), clients and
+pools: a createLivySession served by another worker than the previous one would start a
+second session for the same browser session. The LivySessionRegistry keeps one row per
+scope (the Django session key) in a sqlite database file, seen by all the workers
+using the same file:
+
+- claim(): atomically (one write transaction) returns the Livy session already
+  registered for the scope, or reserves the scope for the caller, which then creates
+  the session and activate()s it. A scope reserved by a concurrent request is not
+  reserved twice.
+- A user (owner) holds at most `max_per_owner` sessions (registered or being
+  created) across all the workers: claim() raises LivySessionLimitError beyond.
+- heartbeat() records an activity on a session (written at most every
+  `heartbeat_interval` seconds per process). Sessions without heartbeat for
+  `stale_after` seconds, and reservations not activated within `claim_timeout`
+  seconds (e.g. a worker killed while creating), are dropped.
+- release() forgets the session of a scope (stopped, reaped...).
+- session() is the registered session of a scope (e.g. started through another
+  worker), last_activity() the time of the last heartbeat of a session (e.g. for the
+  idle session reaper of each worker).
+
+Usage:
+    from myapp.api.livy_session_registry import LivySessionRegistry, LivySessionLimitError
+
+    registry = LivySessionRegistry("livy_sessions.sqlite3", max_per_owner=3)
+    claim = registry.claim(backend, scope, owner)     # may raise LivySessionLimitError
+    if claim.session_id is not None:
+        ...                                           # adopt the registered session
+    elif claim.reserved:
+        registry.activate(backend, scope, create_the_session())   # or release() on failure
+    else:
+        ...                                           # being created by another request
+    registry.heartbeat(backend, session_id)
+    registry.session(backend, scope)                  # session ID, or None
+    registry.last_activity(backend, session_id)       # UNIX time of the last heartbeat, or None
+    registry.release(backend, scope)
+    registry.sessions(owner)                          # [(scope, session ID), ...]
+
+The database is created if needed (WAL journal, so reads do not wait for writes). Put
+it on a local disk: sqlite locking is not reliable on network file systems.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+LivySessionClaim = namedtuple("LivySessionClaim", ["session_id", "reserved"])
+
+
+class LivySessionLimitError(Exception):
+    """Raised when the owner already holds `max_per_owner` Livy sessions."""
+
+
+class LivySessionRegistry:
+    """
+    Livy sessions by scope, with their owner and last heartbeat, in a sqlite file.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS livy_sessions (
+            backend TEXT NOT NULL,
+            scope TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            session_id TEXT,
+            claimed_at REAL NOT NULL,
+            heartbeat_at REAL NOT NULL,
+            PRIMARY KEY (backend, scope)
+        );
+        CREATE INDEX IF NOT EXISTS livy_sessions_owner ON livy_sessions (owner);
+        CREATE INDEX IF NOT EXISTS livy_sessions_session ON livy_sessions (backend, session_id);
+    """
+
+    def __init__(self, path, max_per_owner=0, stale_after=3600, claim_timeout=300, heartbeat_interval=30, timeout=10):
+        self.path = path
+        self.max_per_owner = max_per_owner
+        self.stale_after = stale_after
+        self.claim_timeout = claim_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.timeout = timeout
+        self._local = threading.local()
+        self._beats = {}  # (backend, session ID) -> last heartbeat written by this process
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(self.SCHEMA)
+
+    def claim(self, backend, scope, owner):
+        """The registered session of `scope`, or a reservation of `scope` for `owner`. See LivySessionClaim."""
+        now = time.time()
+        with self._transaction(immediate=True) as db:
+            self._expire(db, now)
+            row = db.execute("SELECT session_id FROM livy_sessions WHERE backend = ? AND scope = ?", (backend, scope)).fetchone()
+            if row is not None:
+                return LivySessionClaim(row[0] and _session_id(row[0]), False)
+            if self.max_per_owner:
+                count = db.execute("SELECT COUNT(*) FROM livy_sessions WHERE owner = ?", (owner,)).fetchone()[0]
+                if count >= self.max_per_owner:
+                    raise LivySessionLimitError("At most " + str(self.max_per_owner) + " Livy sessions per user, "
+                                                + str(count) + " already running. Please stop one of them first")
+            db.execute("INSERT INTO livy_sessions (backend, scope, owner, session_id, claimed_at, heartbeat_at) "
+                       "VALUES (?, ?, ?, NULL, ?, ?)", (backend, scope, owner, now, now))
+        return LivySessionClaim(None, True)
+
+    def activate(self, backend, scope, session_id):
+        """Register the session created for the reserved `scope`."""
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("UPDATE livy_sessions SET session_id = ?, heartbeat_at = ? WHERE backend = ? AND scope = ?",
+                       (str(session_id), now, backend, scope))
+        with self._lock:
+            self._beats[(backend, str(session_id))] = now
+
+    def heartbeat(self, backend, session_id):
+        """Record an activity on `session_id` (written at most every `heartbeat_interval` seconds)."""
+        now = time.time()
+        key = (backend, str(session_id))
+        with self._lock:
+            if now - self._beats.get(key, 0) < self.heartbeat_interval:
+                return
+            self._beats[key] = now
+        with self._transaction() as db:
+            db.execute("UPDATE livy_sessions SET heartbeat_at = ? WHERE backend = ? AND session_id = ?", (now, backend, str(session_id)))
+
+    def release(self, backend, scope=None, session_id=None):
+        """Forget the session of `scope` (or the session `session_id`, whatever its scope)."""
+        with self._transaction() as db:
+            if scope is not None:
+                db.execute("DELETE FROM livy_sessions WHERE backend = ? AND scope = ?", (backend, scope))
+            if session_id is not None:
+                db.execute("DELETE FROM livy_sessions WHERE backend = ? AND session_id = ?", (backend, str(session_id)))
+        if session_id is not None:
+            with self._lock:
+                self._beats.pop((backend, str(session_id)), None)
+
+    def session(self, backend, scope):
+        """Registered session ID of `scope`, or None (none, or being created)."""
+        with self._transaction() as db:
+            row = db.execute("SELECT session_id FROM livy_sessions WHERE backend = ? AND scope = ? AND heartbeat_at >= ?",
+                             (backend, scope, time.time() - self.stale_after)).fetchone()
+        return row and row[0] and _session_id(row[0])
+
+    def last_activity(self, backend, session_id):
+        """UNIX time of the last heartbeat of `session_id` (written by any process), or None when not registered."""
+        with self._transaction() as db:
+            row = db.execute("SELECT MAX(heartbeat_at) FROM livy_sessions WHERE backend = ? AND session_id = ?",
+                             (backend, str(session_id))).fetchone()
+        with self._lock:
+            beat = self._beats.get((backend, str(session_id)))
+        if row[0] is None:
+            return None
+        return max(row[0], beat or 0)
+
+    def owner(self, backend, session_id):
+        """Owner of the registered session `session_id`, or None."""
+        with self._transaction() as db:
+            row = db.execute("SELECT owner FROM livy_sessions WHERE backend = ? AND session_id = ?", (backend, str(session_id))).fetchone()
+        return row and row[0]
+
+    def sessions(self, owner=None):
+        """[(scope, session ID or None while being created), ...] of `owner` (of all the owners when None)."""
+        with self._transaction() as db:
+            self._expire(db, time.time())
+            if owner is None:
+                rows = db.execute("SELECT scope, session_id FROM livy_sessions ORDER BY claimed_at").fetchall()
+            else:
+                rows = db.execute("SELECT scope, session_id FROM livy_sessions WHERE owner = ? ORDER BY claimed_at", (owner,)).fetchall()
+        return [(scope, session_id and _session_id(session_id)) for scope, session_id in rows]
+
+    def _expire(self, db, now):
+        db.execute("DELETE FROM livy_sessions WHERE (session_id IS NULL AND claimed_at < ?) OR heartbeat_at < ?",
+                   (now - self.claim_timeout, now - self.stale_after))
+
+    def _connection(self):
+        # One connection per thread, in autocommit mode: the transactions are explicit
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def _transaction(self, immediate=False):
+        # BEGIN IMMEDIATE takes the write lock up front (claim reads, then writes)
+        return _Transaction(self._connection(), "BEGIN IMMEDIATE" if immediate else "BEGIN")
+
+
+class _Transaction:
+    def __init__(self, db, begin):
+        self.db = db
+        self.begin = begin
+
+    def __enter__(self):
+        self.db.execute(self.begin)
+        return self.db
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.db.execute("ROLLBACK" if exc_type is not None else "COMMIT")
+
+
+def _session_id(value):
+    # Livy session IDs are integers, stored as text (like the other keys of the app)
+    return int(value) if value.isdigit() else value
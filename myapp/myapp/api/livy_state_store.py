@@ -0,0 +1,246 @@
+"""
+Store of the Livy bookkeeping of the users (Livy token copy, Livy session ID, statement IDs).
+
+The values of a user are scoped by their Django session, and kept:
+
+    - SessionLivyStateStore (default): in the Django session itself, shared by the
+      workers like the session. From a view, the scope is `request.session` (saved
+      with the response by the SessionMiddleware); from background work outliving the
+      request, the scope is the session key (the stored session is loaded and saved).
+    - CacheLivyStateStore: in a shared Django cache (Redis, see CACHES["livy_state"]
+      in settings.py), each value under its own key, so that statement submissions and
+      token refreshes do not rewrite the whole Django session. The scope is the session key.
+    - MemoryLivyStateStore: in-process dictionaries, scoped by the session key. Only for
+      a single worker process: another worker does not see the values (explicit opt-in).
+
+Usage:
+    from myapp.api.livy_state_store import SessionLivyStateStore, MemoryLivyStateStore, CacheLivyStateStore
+
+    store = SessionLivyStateStore(import_module(settings.SESSION_ENGINE).SessionStore)
+    store.set(request.session, "livy_session_id", 12)
+    store.append(request.session, "livy_statement_ids", 0, 1)
+    store.get_list(request.session.session_key, "livy_statement_ids")    # [0, 1], e.g. from a thread
+    await store.aget(request.session, "livy_session_id")                 # 12
+
+    store = CacheLivyStateStore(caches["livy_state"], ttl=3600)
+    store.set(request.session.session_key, "livy_session_id", 12)
+
+Lists are append-only. In the cache and memory stores, append() is atomic (one incr()
+of the list length, then the items are written under their own keys), so concurrent
+requests never lose IDs; in the session store, concurrent requests of one browser
+session overwrite each other's changes like any session value (the last save wins).
+The values of a scope expire `ttl` seconds after their last write (with the Django
+session in the session store).
+"""
+import threading
+import time
+from asgiref.sync import sync_to_async
+
+
+class _LivyStateStore:
+    # Async variants of the methods, like request.session.aget/aset
+
+    async def aget(self, scope, name, default=None):
+        return await self._call(self.get, scope, name, default)
+
+    async def aget_many(self, scope, names):
+        return await self._call(self.get_many, scope, names)
+
+    async def aset(self, scope, name, value):
+        return await self._call(self.set, scope, name, value)
+
+    async def aset_many(self, scope, values):
+        return await self._call(self.set_many, scope, values)
+
+    async def adelete(self, scope, *names):
+        return await self._call(self.delete, scope, *names)
+
+    async def aappend(self, scope, name, *values):
+        return await self._call(self.append, scope, name, *values)
+
+    async def aget_list(self, scope, name):
+        return await self._call(self.get_list, scope, name)
+
+
+class SessionLivyStateStore(_LivyStateStore):
+    """
+    State of the scopes in their Django session (`request.session`, or a session key).
+    """
+
+    def __init__(self, session_store):
+        self.session_store = session_store  # SessionStore class of settings.SESSION_ENGINE
+
+    def get(self, scope, name, default=None):
+        return self._session(scope).get(name, default)
+
+    def get_many(self, scope, names):
+        session = self._session(scope)
+        return {name: session[name] for name in names if name in session}
+
+    def set(self, scope, name, value):
+        self.set_many(scope, {name: value})
+
+    def set_many(self, scope, values):
+        session = self._session(scope)
+        session.update(values)
+        self._save(scope, session)
+
+    def delete(self, scope, *names):
+        session = self._session(scope)
+        for name in names:
+            session.pop(name, None)
+        self._save(scope, session)
+
+    def append(self, scope, name, *values):
+        """
+        Append `values` to the list `name`. Return its new length.
+        Not atomic: the list is read and saved with the session, so of two concurrent
+        requests of one browser session, the last one saved wins (use the cache store).
+        """
+        session = self._session(scope)
+        items = list(session.get(name) or []) + list(values)
+        session[name] = items
+        self._save(scope, session)
+        return len(items)
+
+    def get_list(self, scope, name):
+        return list(self._session(scope).get(name) or [])
+
+    def _session(self, scope):
+        return self.session_store(session_key=scope) if isinstance(scope, str) else scope
+
+    def _save(self, scope, session):
+        # request.session is saved with the response. A stored session is saved at once, unless
+        # it is gone (logged out, expired): loading it gave up its key
+        if isinstance(scope, str) and session.modified and session.session_key == scope:
+            session.save()
+
+    async def _call(self, method, *args):
+        return await sync_to_async(method)(*args)
+
+
+class MemoryLivyStateStore(_LivyStateStore):
+    """
+    State of the scopes in the memory of the process.
+    """
+
+    def __init__(self, ttl=1209600):
+        self.ttl = ttl
+        self._scopes = {}   # scope -> (expires_at, {name: value})
+        self._next_sweep = time.monotonic() + min(ttl, 600)
+        self._lock = threading.Lock()
+
+    def get(self, scope, name, default=None):
+        with self._lock:
+            return self._values(scope).get(name, default)
+
+    def get_many(self, scope, names):
+        with self._lock:
+            values = self._values(scope)
+            return {name: values[name] for name in names if name in values}
+
+    def set(self, scope, name, value):
+        self.set_many(scope, {name: value})
+
+    def set_many(self, scope, values):
+        with self._lock:
+            self._values(scope, write=True).update(values)
+
+    def delete(self, scope, *names):
+        with self._lock:
+            values = self._values(scope)
+            for name in names:
+                values.pop(name, None)
+
+    def append(self, scope, name, *values):
+        """Append `values` to the list `name`. Return its new length."""
+        with self._lock:
+            items = self._values(scope, write=True).setdefault(name, [])
+            items.extend(values)
+            return len(items)
+
+    def get_list(self, scope, name):
+        with self._lock:
+            return list(self._values(scope).get(name) or [])
+
+    def _values(self, scope, write=False):
+        # Called with the lock held
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._scopes = {key: entry for key, entry in self._scopes.items() if entry[0] > now}
+            self._next_sweep = now + min(self.ttl, 600)
+        entry = self._scopes.get(scope)
+        if entry is None or entry[0] <= now:
+            if not write:
+                return {}
+            entry = (now + self.ttl, {})
+        elif write:
+            entry = (now + self.ttl, entry[1])
+        if write:
+            self._scopes[scope] = entry
+        return entry[1]
+
+    async def _call(self, method, *args):
+        # In-process: no I/O to move out of the event loop
+        return method(*args)
+
+
+class CacheLivyStateStore(_LivyStateStore):
+    """
+    State of the scopes in a Django cache, one cache key per value (and per list item).
+    """
+
+    def __init__(self, cache, ttl=1209600, prefix="livy-state:"):
+        self.cache = cache
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, scope, name):
+        return self.prefix + str(scope) + ":" + name
+
+    def get(self, scope, name, default=None):
+        return self.cache.get(self._key(scope, name), default)
+
+    def get_many(self, scope, names):
+        keys = {self._key(scope, name): name for name in names}
+        return {keys[key]: value for key, value in self.cache.get_many(list(keys)).items()}
+
+    def set(self, scope, name, value):
+        self.cache.set(self._key(scope, name), value, self.ttl)
+
+    def set_many(self, scope, values):
+        self.cache.set_many({self._key(scope, name): value for name, value in values.items()}, self.ttl)
+
+    def delete(self, scope, *names):
+        # A list is deleted with its length: its items are not read any more, and expire
+        keys = [self._key(scope, name) for name in names]
+        self.cache.delete_many(keys + [key + ":len" for key in keys])
+
+    def append(self, scope, name, *values):
+        """
+        Append `values` to the list `name`. Return its new length.
+        Atomic when the cache incr() is (Redis, Memcached, local memory).
+        """
+        key = self._key(scope, name)
+        self.cache.add(key + ":len", 0, self.ttl)
+        try:
+            length = self.cache.incr(key + ":len", len(values))
+        except ValueError:
+            # Expired (or deleted) between add() and incr()
+            self.cache.add(key + ":len", 0, self.ttl)
+            length = self.cache.incr(key + ":len", len(values))
+        first = length - len(values)
+        self.cache.set_many({key + ":" + str(first + index): value for index, value in enumerate(values)}, self.ttl)
+        self.cache.touch(key + ":len", self.ttl)
+        return length
+
+    def get_list(self, scope, name):
+        # Items still being written by a concurrent append() are skipped
+        key = self._key(scope, name)
+        length = self.cache.get(key + ":len") or 0
+        keys = [key + ":" + str(index) for index in range(length)]
+        items = self.cache.get_many(keys) if keys else {}
+        return [items[item_key] for item_key in keys if item_key in items]
+
+    async def _call(self, method, *args):
+        return await sync_to_async(method)(*args)
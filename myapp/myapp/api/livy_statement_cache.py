@@ -0,0 +1,77 @@
+"""
+Bounded LRU cache of the results of finished Livy statements.
+
+A statement in a terminal state (available, error, cancelled) never changes, so its
+result is kept and the repeat views of it are served without calling Livy.
+
+Usage:
+    from myapp.api.livy_statement_cache import LivyStatementCache
+
+    cache = LivyStatementCache(max_bytes=64 * 1024 * 1024, max_entry_bytes=4 * 1024 * 1024)
+    result = cache.get(key)           # None when not cached
+    if result is None:
+        ...
+        cache.put(key, result)        # key: (backend, owner, session start, session ID, statement ID)
+    cache.discard_session(key[:-1])   # the Livy session was deleted
+
+Livy reuses the session and statement IDs after a restart (without session
+recovery): the keys also hold the owner and when the session was started for them,
+so that the results of a previous session are never served for a new one.
+
+The size of an entry is the size of its JSON encoding. Results larger than
+`max_entry_bytes` are not cached (large outputs are spilled to disk by the
+LivyOutputStore: cache the spill references instead), and the least recently used
+results are evicted beyond `max_bytes`.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+
+class LivyStatementCache:
+    """
+    Results of finished statements, bounded by their total size.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entry_bytes=4 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self._entries = OrderedDict()  # key -> (result, size)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, result):
+        """Cache `result` (JSON serialisable). Returns False when it is too large to be cached."""
+        if self.max_bytes <= 0:
+            return False
+        size = len(json.dumps(result))
+        if size > self.max_entry_bytes:
+            return False
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous:
+                self._size -= previous[1]
+            self._entries[key] = (result, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self._size -= old_size
+        return True
+
+    def discard_session(self, session_key):
+        """Forget the results of a session, `session_key` being the prefix of the keys of its statements."""
+        with self._lock:
+            keys = [key for key in self._entries if key[:len(session_key)] == tuple(session_key)]
+            for key in keys:
+                self._size -= self._entries.pop(key)[1]
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,279 @@
+"""
+Process-wide poller of the running Livy statements, pushing their changes to subscribers.
+
+When each browser tab polls its statement, the load on Livy/Fabric grows with the
+number of tabs. The LivyStatementPoller watches the statements of all the
+subscribers from one background thread and checks each Livy session with a single
+list_statements call (from the lowest to the highest watched statement ID),
+whatever the number of subscribers: the load grows with the number of active
+sessions.
+
+Usage:
+    from myapp.api.livy_statement_poller import LivyStatementPoller
+
+    poller = LivyStatementPoller(interval=1, max_interval=5)
+    subscription = poller.subscribe(session_key, session_id, statement_ids, client)
+    for event in subscription:          # or: event = await subscription.aget(timeout)
+        ...                             # {"id", "state", "progress"}, until all are finished
+    subscription.close()
+
+- `session_key` identifies the Livy session across the subscribers (e.g. (backend,
+  owner, session start, session ID)), `client` is a callable returning an ApacheLivy client with a valid token.
+- An event is pushed for each change of the state or the progress of a statement,
+  starting with its current state. The subscription ends once all its statements
+  reached a terminal state (available, error, cancelled).
+- Unknown statements (beyond the statements of the session) end with an `error` event.
+- A session is polled every `interval` seconds, slowed down by `backoff` up to
+  `max_interval` while nothing changes.
+- `on_finished(session_key, statement)` (optional) runs once per finished
+  statement with its full body, e.g. to cache its result.
+- Transient errors (timeouts, connection errors, HTTP 429/502/503/504, throttled
+  calls, open circuit) are retried `retries` times, slowed down by `backoff`; other
+  errors, or transient errors past the retries, end the pending statements of the
+  session with an `error` event. An unexpected error is logged and does not stop the
+  background thread, which is started again by the next subscription if it died.
+- `subscription.failed` holds the statements that ended in error or cancelled.
+- Subscriptions made with `loop=` (the running asyncio loop) are awaited with aget().
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+import requests
+
+from myapp.api.apache_livy import STATEMENT_TERMINAL_STATES
+from myapp.api.livy_circuit_breaker import LivyCircuitOpenError
+from myapp.api.livy_models import body
+from myapp.api.livy_scheduler import LivyThrottledError, in_background
+
+logger = logging.getLogger(__name__)
+
+TRANSIENT_STATUS_CODES = (429, 502, 503, 504)
+
+
+class LivyStatementSubscription:
+    """
+    Events of the statements of one subscriber.
+    """
+
+    def __init__(self, poller, session_key, statement_ids, loop=None):
+        self.poller = poller
+        self.session_key = session_key
+        self.pending = set(statement_ids)
+        self.failed = set()
+        self.loop = loop
+        self._queue = asyncio.Queue() if loop is not None else queue.Queue()
+        self.closed = False
+
+    def _publish(self, event):
+        # Called by the poller thread
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self._queue.put_nowait, event)
+            except RuntimeError:
+                # Event loop closed: the subscriber is gone
+                self.closed = True
+        else:
+            self._queue.put(event)
+
+    def get(self, timeout=None):
+        """Next event, None on timeout or when the subscription is over."""
+        if not self.pending and self._queue.empty():
+            return None
+        try:
+            event = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self._received(event)
+        return event
+
+    async def aget(self, timeout=None):
+        """Next event (subscriptions made with `loop=`), None on timeout or when the subscription is over."""
+        if not self.pending and self._queue.empty():
+            return None
+        try:
+            event = await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._received(event)
+        return event
+
+    def _received(self, event):
+        if event.get("state") in STATEMENT_TERMINAL_STATES or event.get("error"):
+            with self.poller._lock:
+                self.pending.discard(event.get("id"))
+                if event.get("state") != "available":
+                    self.failed.add(event.get("id"))
+
+    def __iter__(self):
+        while self.pending:
+            event = self.get(timeout=self.poller.max_interval + 1)
+            if event is not None:
+                yield event
+
+    def close(self):
+        self.closed = True
+        self.poller.unsubscribe(self)
+
+
+class _WatchedSession:
+    __slots__ = ("session_id", "client", "subscriptions", "statements", "interval", "next_poll", "failures")
+
+    def __init__(self, session_id, client, interval):
+        self.session_id = session_id
+        self.client = client
+        self.subscriptions = set()
+        self.statements = {}  # statement ID -> (state, progress) last seen
+        self.interval = interval
+        self.next_poll = 0
+        self.failures = 0  # transient errors in a row
+
+
+class LivyStatementPoller:
+    """
+    One background thread polling the watched statements of all the subscribers, by session.
+    """
+
+    def __init__(self, interval=1, max_interval=5, backoff=1.5, on_finished=None, retries=3):
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.on_finished = on_finished
+        self.retries = retries
+        self._sessions = {}  # session key -> _WatchedSession
+        self._lock = threading.Condition()
+        self._stopped = False
+        self._worker = None
+
+    def subscribe(self, session_key, session_id, statement_ids, client, loop=None):
+        """Watch `statement_ids` of the session. Returns a LivyStatementSubscription."""
+        subscription = LivyStatementSubscription(self, session_key, [int(statement_id) for statement_id in statement_ids], loop)
+        with self._lock:
+            watched = self._sessions.get(session_key)
+            if watched is None:
+                watched = self._sessions[session_key] = _WatchedSession(session_id, client, self.interval)
+            watched.client = client
+            watched.subscriptions.add(subscription)
+            # Known states are pushed now, the others at the next poll (made right away)
+            for statement_id in subscription.pending.copy():
+                if statement_id in watched.statements:
+                    state, progress = watched.statements[statement_id]
+                    subscription._publish({"id": statement_id, "state": state, "progress": progress})
+            watched.interval = self.interval
+            watched.next_poll = 0
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="livy-statement-poller", daemon=True)
+                self._worker.start()
+            self._lock.notify()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            watched = self._sessions.get(subscription.session_key)
+            if watched is not None:
+                watched.subscriptions.discard(subscription)
+                if not watched.subscriptions:
+                    del self._sessions[subscription.session_key]
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._lock.notify()
+
+    def watched(self):
+        """Number of sessions and of subscriptions being watched."""
+        with self._lock:
+            return len(self._sessions), sum(len(watched.subscriptions) for watched in self._sessions.values())
+
+    @in_background
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._stopped:
+                    return
+                now = time.monotonic()
+                due = [(key, watched) for key, watched in self._sessions.items() if watched.next_poll <= now]
+                if not due:
+                    next_poll = min((watched.next_poll for watched in self._sessions.values()), default=None)
+                    self._lock.wait(None if next_poll is None else next_poll - now)
+                    continue
+            for key, watched in due:
+                try:
+                    self._poll(key, watched)
+                except Exception:
+                    # Keep polling the other sessions, this one again later
+                    logger.exception("Error polling the statements of the Livy session %s", watched.session_id)
+                    with self._lock:
+                        watched.next_poll = time.monotonic() + self.max_interval
+
+    def _poll(self, key, watched):
+        with self._lock:
+            subscriptions = [subscription for subscription in watched.subscriptions if not subscription.closed]
+            wanted = set().union(*(subscription.pending for subscription in subscriptions)) if subscriptions else set()
+        if not wanted:
+            with self._lock:
+                if self._sessions.get(key) is watched:
+                    del self._sessions[key]
+            return
+        low, high = min(wanted), max(wanted)
+        try:
+            api_result = watched.client().list_statements(watched.session_id, from_index=low, size=high - low + 1)
+            api_result.raise_for_status()
+            listed = body(api_result)
+            statements = listed.get("statements") or []
+            total = listed.get("total_statements")
+        except Exception as e:
+            if _transient(e) and watched.failures < self.retries:
+                with self._lock:
+                    watched.failures += 1
+                    watched.interval = min(watched.interval * self.backoff ** watched.failures, self.max_interval)
+                    watched.next_poll = time.monotonic() + watched.interval
+                return
+            # The subscribers give up on their statements, they can subscribe again
+            for subscription in subscriptions:
+                for statement_id in list(subscription.pending):
+                    subscription._publish({"id": statement_id, "error": str(e)})
+            with self._lock:
+                if self._sessions.get(key) is watched:
+                    del self._sessions[key]
+            return
+
+        changed, finished = [], []
+        with self._lock:
+            watched.failures = 0
+            for statement in statements:
+                statement_id = statement.get("id")
+                if statement_id not in wanted:
+                    continue
+                seen = (statement.get("state"), statement.get("progress"))
+                if watched.statements.get(statement_id) != seen:
+                    watched.statements[statement_id] = seen
+                    changed.append({"id": statement_id, "state": seen[0], "progress": seen[1]})
+                    if seen[0] in STATEMENT_TERMINAL_STATES:
+                        finished.append(statement)
+            if total is not None:
+                changed.extend({"id": statement_id, "error": "Statement " + str(statement_id) + " not found"}
+                               for statement_id in wanted if statement_id >= total)
+            watched.interval = self.interval if changed else min(watched.interval * self.backoff, self.max_interval)
+            watched.next_poll = time.monotonic() + watched.interval
+        if self.on_finished is not None:
+            for statement in finished:
+                try:
+                    self.on_finished(key, statement)
+                except Exception:
+                    logger.exception("Error handling the finished statement %s of the Livy session %s",
+                                     statement.get("id"), watched.session_id)
+        for event in changed:
+            for subscription in subscriptions:
+                if event["id"] in subscription.pending:
+                    subscription._publish(event)
+
+
+def _transient(error):
+    # Errors worth polling again after a while
+    if isinstance(error, (LivyCircuitOpenError, LivyThrottledError, requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return True
+    response = getattr(error, "response", None)
+    return isinstance(error, requests.exceptions.HTTPError) and response is not None and response.status_code in TRANSIENT_STATUS_CODES
@@ -0,0 +1,124 @@
+"""
+In-process cache of Livy/Fabric tokens, refreshed ahead of expiry.
+
+Usage:
+    from myapp.api.livy_token_manager import LivyTokenManager
+
+    tokens = LivyTokenManager(refresh_margin=300)
+    token, expires_at = tokens.get_token(key, acquire)
+
+`acquire` is a callable returning `(access_token, expires_in_seconds)`. The manager:
+- returns the cached token of `key` while it is valid for more than `refresh_margin` seconds,
+- returns the cached token but refreshes it in the background once it is within
+  `refresh_margin` seconds of its expiry, so no request pays for the refresh,
+- refreshes it synchronously when it is (almost) expired,
+- collapses concurrent refreshes of the same key into a single `acquire` call,
+- schedules a background refresh before expiry when the token was used since it
+  was acquired, so active users always hold a fresh token.
+"""
+import threading
+import time
+from concurrent.futures import Future
+
+
+class LivyTokenError(Exception):
+    """Raised when a Livy/Fabric token cannot be acquired."""
+
+
+class LivyTokenManager:
+    """
+    Per-key (e.g. backend and account) cache of Livy/Fabric tokens.
+    """
+
+    def __init__(self, refresh_margin=300, min_validity=30):
+        self.refresh_margin = refresh_margin
+        self.min_validity = min_validity
+        self._tokens = {}       # key -> (access_token, expires_at, acquired_at)
+        self._acquirers = {}    # key -> last acquire callable
+        self._last_used = {}    # key -> last get_token() time
+        self._inflight = {}     # key -> Future of the running refresh
+        self._timers = {}       # key -> scheduled refresh
+        self._lock = threading.Lock()
+
+    def get_token(self, key, acquire):
+        """Return `(access_token, expires_at)` for `key`, `expires_at` being a UNIX timestamp."""
+        now = time.time()
+        with self._lock:
+            self._acquirers[key] = acquire
+            self._last_used[key] = now
+            cached = self._tokens.get(key)
+        if cached:
+            remaining = cached[1] - now
+            if remaining > self.refresh_margin:
+                return cached[:2]
+            if remaining > self.min_validity:
+                self._refresh(key, background=True)
+                return cached[:2]
+        return self._refresh(key).result()[:2]
+
+    def discard(self, key):
+        """Forget the token of `key` (e.g. on logout)."""
+        with self._lock:
+            self._tokens.pop(key, None)
+            self._acquirers.pop(key, None)
+            self._last_used.pop(key, None)
+            timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+
+    def _refresh(self, key, background=False):
+        # Single flight: the first caller runs acquire, the others wait on the same future
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+        if owner:
+            if background:
+                threading.Thread(target=self._acquire, args=(key, future), name="livy-token-refresh", daemon=True).start()
+            else:
+                self._acquire(key, future)
+        return future
+
+    def _acquire(self, key, future):
+        try:
+            with self._lock:
+                acquire = self._acquirers.get(key)
+            if acquire is None:
+                raise LivyTokenError("No way to acquire a token for this account")
+            access_token, expires_in = acquire()
+            now = time.time()
+            entry = (access_token, now + int(expires_in), now)
+            with self._lock:
+                if key in self._acquirers:
+                    self._tokens[key] = entry
+                    self._schedule(key, int(expires_in))
+            future.set_result(entry)
+        except Exception as e:
+            future.set_exception(e if isinstance(e, LivyTokenError) else LivyTokenError(str(e)))
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _schedule(self, key, expires_in):
+        # Called with the lock held
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        delay = expires_in - self.refresh_margin
+        if delay > 0:
+            timer = threading.Timer(delay, self._scheduled_refresh, args=(key,))
+            timer.daemon = True
+            self._timers[key] = timer
+            timer.start()
+
+    def _scheduled_refresh(self, key):
+        with self._lock:
+            cached = self._tokens.get(key)
+            used = cached is not None and self._last_used.get(key, 0) > cached[2]
+            if not used:
+                # Not used since acquired: let it expire instead of refreshing forever
+                self._timers.pop(key, None)
+        if used:
+            self._refresh(key, background=True)
@@ -5,12 +5,21 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+The async Livy views (/async/...) only free the worker while waiting on Livy when
+served through this module, e.g. with: uvicorn myapp.asgi:application --port 5000
 """
 
 import os
+from importlib import import_module
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myapp.settings')
 
 application = get_asgi_application()
+
+# Import the URLconf and the views while the worker starts rather than on its first request
+# (their services are built on first use)
+import_module(settings.ROOT_URLCONF)
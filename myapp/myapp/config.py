@@ -0,0 +1,167 @@
+"""
+Configuration of the app, read from the environment (and the .env file) once, on
+first use, and validated.
+
+Usage:
+    from myapp.config import get_config
+
+    config = get_config()
+    config.livy_backend          # "apache" or "fabric"
+    config.livy_requests_timeout
+
+get_config() reads the variables the first time it is called (settings.py calls it
+for ROLES, so every process checks them on start) and raises ImproperlyConfigured
+listing all the missing or invalid variables at once, instead of failing on the first
+int() or .strip() of a missing value. load_environment() loads the .env file once
+per process (settings.py and get_config() share it).
+
+Nothing heavy is imported here. The client libraries are not deferred: requests
+(with the Livy and Graph clients) comes in with the views and msal with the URLconf
+of azure_auth, both imported by myapp/wsgi.py and myapp/asgi.py when the worker
+starts, so their cost is paid before the first request rather than by it. Only httpx
+(async views) is imported on first use.
+"""
+import json
+import os
+from functools import lru_cache
+from django.core.exceptions import ImproperlyConfigured
+
+
+@lru_cache(maxsize=None)
+def load_environment():
+    """Load the .env file into os.environ (the variables already set win). Once per process."""
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+class Config:
+    """
+    Validated configuration of the app. See the README for the meaning of each variable.
+    """
+
+    def __init__(self, environ):
+        self._environ = environ
+        self._errors = []
+        self.roles = self._json("ROLES", {})
+        if not isinstance(self.roles, dict) or not all(isinstance(group, str) for group in self.roles.values()):
+            self._errors.append("ROLES must be a JSON object mapping EntraID group IDs to Django group names, got " + repr(self._environ.get("ROLES")))
+            self.roles = {}
+        self.graph_user_endpoint = self._str("GRAPH_USER_ENDPOINT")
+        self.graph_member_endpoint = self._str("GRAPH_MEMBER_ENDPOINT")
+        self.graph_cache_ttl = self._int("GRAPH_CACHE_TTL", 300)
+        self.livy_backend = self._choice("LIVY_BACKEND", ("apache", "fabric"))
+        self.livy_base_url = self._str("LIVY_BASE_ENDPOINT")
+        self.livy_requests_timeout = self._int("LIVY_REQUESTS_TIMEOUT", minimum=1)
+        self.livy_session_name_prefix = self._str("LIVY_SESSION_NAME_PREFIX")
+        self.livy_spark_conf = self._json("LIVY_SPARK_CONF", {})
+        self.livy_backend_spark_dependencies = self._str("LIVY_SPARK_DEPENDENCIES", "")
+        self.livy_pool_connections = self._int("LIVY_POOL_CONNECTIONS", 10, minimum=1)
+        self.livy_pool_maxsize = self._int("LIVY_POOL_MAXSIZE", 10, minimum=1)
+        self.livy_max_retries = self._int("LIVY_MAX_RETRIES", 3)
+        self.livy_compress_min_bytes = self._int("LIVY_COMPRESS_MIN_BYTES", 0)
+        self.livy_hedge_percentile = self._int("LIVY_HEDGE_PERCENTILE", 0, maximum=99)
+        self.livy_hedge_min_delay = self._float("LIVY_HEDGE_MIN_DELAY", 0.05)
+        self.livy_hedge_max_workers = self._int("LIVY_HEDGE_MAX_WORKERS", 16, minimum=2)
+        self.livy_circuit_failure_threshold = self._int("LIVY_CIRCUIT_FAILURE_THRESHOLD", 0)
+        self.livy_circuit_reset_timeout = self._int("LIVY_CIRCUIT_RESET_TIMEOUT", 30, minimum=1)
+        self.livy_rate_limit = self._float("LIVY_RATE_LIMIT", 10)
+        self.livy_rate_burst = self._int("LIVY_RATE_BURST", 20, minimum=1)
+        self.livy_throttle_max_wait = self._int("LIVY_THROTTLE_MAX_WAIT", 60)
+        self.livy_metrics_token = self._str("LIVY_METRICS_TOKEN", None)
+        self.livy_async_max_connections = self._int("LIVY_ASYNC_MAX_CONNECTIONS", 100, minimum=1)
+        self.livy_client_registry_size = self._int("LIVY_CLIENT_REGISTRY_SIZE", 100, minimum=1)
+        self.livy_token_refresh_margin = self._int("LIVY_TOKEN_REFRESH_MARGIN", 300)
+        self.livy_session_pool_size = self._int("LIVY_SESSION_POOL_SIZE", 0)
+        self.livy_session_pool_idle_ttl = self._int("LIVY_SESSION_POOL_IDLE_TTL", 900)
+        self.livy_session_pool_max_pools = self._int("LIVY_SESSION_POOL_MAX_POOLS", 10, minimum=1)
+        self.livy_session_idle_ttl = self._int("LIVY_SESSION_IDLE_TTL", 1800)
+        self.livy_max_sessions_per_user = self._int("LIVY_MAX_SESSIONS_PER_USER", 3)
+        self.livy_session_registry_path = self._str("LIVY_SESSION_REGISTRY_PATH", None)
+        self.livy_session_registry_stale_after = self._int("LIVY_SESSION_REGISTRY_STALE_AFTER", 3600, minimum=1)
+        self.livy_session_reaper_interval = self._int("LIVY_SESSION_REAPER_INTERVAL", 60, minimum=1)
+        self.livy_bulk_max_workers = self._int("LIVY_BULK_MAX_WORKERS", 8, minimum=1)
+        self.livy_bulk_output_max_chars = self._int("LIVY_BULK_OUTPUT_MAX_CHARS", 2000)
+        self.livy_log_tail_max_seconds = self._int("LIVY_LOG_TAIL_MAX_SECONDS", 600)
+        self.livy_wait_max_seconds = self._int("LIVY_WAIT_MAX_SECONDS", 60)
+        self.livy_statement_poll_interval = self._float("LIVY_STATEMENT_POLL_INTERVAL", 1)
+        self.livy_statement_poll_max_interval = self._float("LIVY_STATEMENT_POLL_MAX_INTERVAL", 5)
+        self.livy_statement_poll_retries = self._int("LIVY_STATEMENT_POLL_RETRIES", 3)
+        self.livy_statement_stream_max_seconds = self._int("LIVY_STATEMENT_STREAM_MAX_SECONDS", 600)
+        self.livy_batch_max_running = self._int("LIVY_BATCH_MAX_RUNNING", 4, minimum=1)
+        self.livy_batch_max_running_per_user = self._int("LIVY_BATCH_MAX_RUNNING_PER_USER", 2, minimum=1)
+        self.livy_batch_poll_interval = self._int("LIVY_BATCH_POLL_INTERVAL", 5, minimum=1)
+        self.livy_batch_max_poll_failures = self._int("LIVY_BATCH_MAX_POLL_FAILURES", 10)
+        self.livy_batch_lost_after = self._int("LIVY_BATCH_LOST_AFTER", 1800)
+        self.livy_output_spill_threshold = self._int("LIVY_OUTPUT_SPILL_THRESHOLD", 256 * 1024)
+        self.livy_output_page_size = self._int("LIVY_OUTPUT_PAGE_SIZE", 64 * 1024, minimum=1)
+        self.livy_output_store_max_bytes = self._int("LIVY_OUTPUT_STORE_MAX_BYTES", 512 * 1024 * 1024)
+        self.livy_output_store_dir = self._str("LIVY_OUTPUT_STORE_DIR", None)
+        self.livy_result_cache_max_bytes = self._int("LIVY_RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+        self.livy_result_cache_max_entry_bytes = self._int("LIVY_RESULT_CACHE_MAX_ENTRY_BYTES", 4 * 1024 * 1024)
+        self.livy_state_store = self._choice("LIVY_STATE_STORE", ("session", "cache", "memory"), "session")
+        self.livy_state_cache_url = self._str("LIVY_STATE_CACHE_URL", None)
+        if self.livy_state_store == "cache" and not self.livy_state_cache_url:
+            # Never a per-process cache by default: it would split the state across the workers (locmem:// is explicit)
+            self._errors.append("LIVY_STATE_CACHE_URL is required with LIVY_STATE_STORE=cache")
+        self.livy_state_ttl = self._int("LIVY_STATE_TTL", None, minimum=1)
+        if self._errors:
+            raise ImproperlyConfigured("Invalid environment (.env):\n- " + "\n- ".join(self._errors))
+        del self._environ, self._errors
+
+    def _str(self, name, default=...):
+        # Empty values count as missing
+        value = (self._environ.get(name) or "").strip()
+        if value:
+            return value
+        if default is ...:
+            self._errors.append(name + " is required")
+        return None if default is ... else default
+
+    def _int(self, name, default=..., minimum=0, maximum=None):
+        value = self._str(name, default)
+        if not isinstance(value, str):
+            return value
+        try:
+            number = int(value)
+        except ValueError:
+            self._errors.append(name + " must be an integer, got " + repr(value))
+            return None
+        if number < minimum:
+            self._errors.append(name + " must be at least " + str(minimum) + ", got " + value)
+        elif maximum is not None and number > maximum:
+            self._errors.append(name + " must be at most " + str(maximum) + ", got " + value)
+        return number
+
+    def _float(self, name, default=...):
+        value = self._str(name, default)
+        if not isinstance(value, str):
+            return value
+        try:
+            return float(value)
+        except ValueError:
+            self._errors.append(name + " must be a number, got " + repr(value))
+            return None
+
+    def _choice(self, name, choices, default=...):
+        value = self._str(name, default)
+        if value is None or value.lower() in choices:
+            return value.lower() if value else value
+        self._errors.append(name + " must be one of " + ", ".join(choices) + ", got " + repr(value))
+        return None
+
+    def _json(self, name, default):
+        value = self._str(name, None)
+        if value is None:
+            return default
+        try:
+            return json.loads(value)
+        except ValueError as e:
+            self._errors.append(name + " must be JSON: " + str(e))
+            return default
+
+
+@lru_cache(maxsize=None)
+def get_config():
+    """The Config of the process, built (and validated) on the first call."""
+    load_environment()
+    return Config(os.environ)
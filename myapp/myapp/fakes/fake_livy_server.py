@@ -0,0 +1,331 @@
+"""
+Local stand-in for a Livy REST server (Apache Livy or the Fabric Livy API), with a
+minimal Microsoft Graph, to run the app and its benchmarks offline.
+
+Usage:
+    from myapp.fakes.fake_livy_server import FakeLivyServer
+
+    with FakeLivyServer(latency=0.02, statement_time=0.2) as server:
+        livy = ApacheLivy(server.url)
+        ...
+
+    # or standalone, e.g. for `python manage.py runserver` with LIVY_BASE_ENDPOINT=http://localhost:8998
+    python -m myapp.fakes.fake_livy_server --port 8998 --latency 0.05
+
+Livy endpoints (under any path prefix, e.g. /livyApi/versions/2023-12-01):
+    - sessions: create, list (from/size), get, state, log (from/size), delete
+    - statements: submit, list (from/size), get, cancel
+    - batches: create, list (from/size), get, state, log (from/size), delete
+
+State transitions follow the time elapsed since creation: sessions are "starting"
+for `session_start_time` seconds then "idle" ("busy" while a statement runs),
+statements run one after the other for `statement_time` seconds each, batches run
+for `batch_time` seconds then succeed. A statement whose code contains "raise" ends
+with an error output, its text output is `output_size` characters long.
+
+Graph endpoints: GET /v1.0/me (with an ETag) and GET /v1.0/me/memberOf ($top, next
+pages by $skiptoken like Graph), for GRAPH_USER_ENDPOINT and GRAPH_MEMBER_ENDPOINT.
+
+Compression: responses of 1 KB or more are gzip-compressed when the request accepts
+it, and gzip request bodies (Content-Encoding: gzip) are decoded, or refused with 415
+when `gzip_requests` is False (like a backend without request decompression).
+
+Every response waits `latency` seconds (plus up to `jitter`), and `error_rate` of the
+requests fail with `error_status` (a Retry-After header is added to 429/503).
+"""
+import argparse
+import gzip
+import json
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+LIVY_ROUTE = re.compile(r"/(sessions|batches)(?:/(\d+))?(?:/(state|log|statements))?(?:/(\d+))?(?:/(cancel))?/?$")
+
+
+class FakeLivyServer:
+    """
+    In-memory Livy and Graph server, served from a background thread.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0, jitter=0, error_rate=0, error_status=503, retry_after=1,
+                 session_start_time=0.5, statement_time=0.2, batch_time=2, output_size=100, groups=10, seed=None,
+                 gzip_requests=True, gzip_responses=True):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.session_start_time = session_start_time
+        self.statement_time = statement_time
+        self.batch_time = batch_time
+        self.output_size = output_size
+        self.groups = groups
+        self.gzip_requests = gzip_requests
+        self.gzip_responses = gzip_responses
+        self.random = random.Random(seed)
+        self.sessions = {}
+        self.batches = {}
+        self.requests = 0
+        self._ids = {"sessions": 0, "batches": 0}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://" + host + ":" + str(port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-livy-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    # Livy resources (called with the lock held)
+    def create_session(self, data):
+        self._ids["sessions"] += 1
+        session = {"id": self._ids["sessions"], "name": data.get("name"), "kind": data.get("kind", "pyspark"),
+                   "created": time.monotonic(), "deleted": False, "statements": []}
+        self.sessions[session["id"]] = session
+        return self.session_view(session)
+
+    def session_state(self, session):
+        now = time.monotonic()
+        if now - session["created"] < self.session_start_time:
+            return "starting"
+        if any(self.statement_state(statement, now) in ("waiting", "running") for statement in session["statements"]):
+            return "busy"
+        return "idle"
+
+    def session_view(self, session):
+        return {"id": session["id"], "name": session["name"], "kind": session["kind"],
+                "state": self.session_state(session), "appId": None, "appInfo": {}, "log": []}
+
+    def submit_statement(self, session, data):
+        now = time.monotonic()
+        previous_end = max((statement["end"] for statement in session["statements"] if statement["state"] is None), default=now)
+        start = max(now, previous_end, session["created"] + self.session_start_time)
+        statement = {"id": len(session["statements"]), "code": data.get("code", ""), "submitted": now,
+                     "start": start, "end": start + self.statement_time, "state": None}
+        session["statements"].append(statement)
+        return self.statement_view(statement)
+
+    def statement_state(self, statement, now=None):
+        now = now if now is not None else time.monotonic()
+        if statement["state"]:
+            return statement["state"]
+        if now < statement["start"]:
+            return "waiting"
+        return "running" if now < statement["end"] else "available"
+
+    def statement_view(self, statement):
+        now = time.monotonic()
+        state = self.statement_state(statement, now)
+        view = {"id": statement["id"], "code": statement["code"], "state": state, "output": None,
+                "progress": min(1.0, max(0.0, (now - statement["start"]) / self.statement_time)) if self.statement_time else 1.0}
+        if state == "available":
+            if "raise" in statement["code"]:
+                view["output"] = {"status": "error", "execution_count": statement["id"], "ename": "Exception",
+                                  "evalue": "Raised by the statement", "traceback": []}
+            else:
+                view["output"] = {"status": "ok", "execution_count": statement["id"],
+                                  "data": {"text/plain": ("x" * 79 + "\n") * (self.output_size // 80) + "x" * (self.output_size % 80)}}
+        return view
+
+    def create_batch(self, data):
+        self._ids["batches"] += 1
+        batch = {"id": self._ids["batches"], "name": data.get("name"), "created": time.monotonic(), "killed": False}
+        self.batches[batch["id"]] = batch
+        return self.batch_view(batch)
+
+    def batch_state(self, batch):
+        if batch["killed"]:
+            return "killed"
+        elapsed = time.monotonic() - batch["created"]
+        if elapsed < min(1, self.batch_time / 4):
+            return "starting"
+        return "running" if elapsed < self.batch_time else "success"
+
+    def batch_view(self, batch):
+        return {"id": batch["id"], "name": batch["name"], "state": self.batch_state(batch), "appId": None, "appInfo": {}, "log": []}
+
+    def log_lines(self, resource):
+        # One line per 100ms of life, capped
+        return ["stdout: line " + str(i) for i in range(min(int((time.monotonic() - resource["created"]) * 10), 10000))]
+
+    # HTTP
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def do_DELETE(self):
+                self._handle("DELETE")
+
+            def log_message(self, format, *args):
+                pass
+
+            def _handle(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                with server._lock:
+                    server.requests += 1
+                    delay = server.latency + (server.random.uniform(0, server.jitter) if server.jitter else 0)
+                    fail = server.error_rate and server.random.random() < server.error_rate
+                if delay:
+                    time.sleep(delay)
+                if fail:
+                    headers = {"Retry-After": str(server.retry_after)} if server.error_status in (429, 503) else {}
+                    return self._send(server.error_status, {"msg": "Injected error"}, headers)
+                parts = urlsplit(self.path)
+                query = {name: values[-1] for name, values in parse_qs(parts.query).items()}
+                try:
+                    if self.headers.get("Content-Encoding") == "gzip":
+                        if not server.gzip_requests:
+                            return self._send(415, {"msg": "Unsupported Content-Encoding"})
+                        body = gzip.decompress(body)
+                    data = json.loads(body) if body else {}
+                except (ValueError, OSError):
+                    return self._send(400, {"msg": "Invalid JSON"})
+                if parts.path.rstrip("/").endswith("/v1.0/me"):
+                    return self._graph_me()
+                if parts.path.rstrip("/").endswith("/v1.0/me/memberOf"):
+                    return self._graph_member_of(parts.path, query)
+                match = LIVY_ROUTE.search(parts.path)
+                if not match:
+                    return self._send(404, {"msg": "Not found"})
+                with server._lock:
+                    status, payload = self._livy(method, match.groups(), query, data)
+                self._send(status, payload)
+
+            def _livy(self, method, route, query, data):
+                kind, resource_id, sub, statement_id, cancel = route
+                resources = server.sessions if kind == "sessions" else server.batches
+                if resource_id is None:
+                    if method == "POST":
+                        return 201, server.create_session(data) if kind == "sessions" else server.create_batch(data)
+                    if method != "GET":
+                        return 405, {"msg": "Method not allowed"}
+                    views = [server.session_view(r) if kind == "sessions" else server.batch_view(r)
+                             for r in resources.values() if not r.get("deleted")]
+                    start, size = int(query.get("from", 0)), int(query.get("size", 20))
+                    return 200, {"from": start, "total": len(views), kind: views[start:start + size]}
+                resource = resources.get(int(resource_id))
+                if resource is None or resource.get("deleted"):
+                    return 404, {"msg": kind[:-1].capitalize() + " '" + resource_id + "' not found."}
+                if sub is None:
+                    if method == "DELETE":
+                        resource["deleted"] = resource["killed"] = True
+                        return 200, {"msg": "deleted"}
+                    return 200, server.session_view(resource) if kind == "sessions" else server.batch_view(resource)
+                if sub == "state":
+                    return 200, {"id": resource["id"], "state": server.session_state(resource) if kind == "sessions" else server.batch_state(resource)}
+                if sub == "log":
+                    lines = server.log_lines(resource)
+                    start, size = int(query.get("from", 0)), int(query.get("size", 100))
+                    return 200, {"id": resource["id"], "from": start, "total": len(lines), "log": lines[start:start + size]}
+                # Statements
+                statements = resource["statements"]
+                if statement_id is None:
+                    if method == "POST":
+                        if server.session_state(resource) == "starting":
+                            return 400, {"msg": "Session is in state starting"}
+                        return 201, server.submit_statement(resource, data)
+                    start, size = int(query.get("from", 0)), int(query.get("size", 100))
+                    return 200, {"total_statements": len(statements),
+                                 "statements": [server.statement_view(s) for s in statements[start:start + size]]}
+                if int(statement_id) >= len(statements):
+                    return 404, {"msg": "Statement not found"}
+                statement = statements[int(statement_id)]
+                if cancel:
+                    if server.statement_state(statement) in ("waiting", "running"):
+                        statement["state"] = "cancelled"
+                    return 200, {"msg": "canceled"}
+                return 200, server.statement_view(statement)
+
+            def _graph_me(self):
+                me = {"id": "00000000-0000-0000-0000-000000000001", "displayName": "Fake User",
+                      "userPrincipalName": "fake.user@example.com"}
+                etag = '"fake-me-1"'
+                if self.headers.get("If-None-Match") == etag:
+                    return self._send(304, None, {"ETag": etag})
+                self._send(200, me, {"ETag": etag})
+
+            def _graph_member_of(self, path, query):
+                # The skip token is an offset here, opaque to the clients
+                top, skip = int(query.get("$top", 100)), int(query.get("$skiptoken", 0))
+                groups = [{"@odata.type": "#microsoft.graph.group", "id": str(i), "displayName": "Group " + str(i)}
+                          for i in range(skip, min(skip + top, server.groups))]
+                page = {"value": groups}
+                if skip + top < server.groups:
+                    page["@odata.nextLink"] = "http://" + self.headers.get("Host", "localhost") + path + "?$top=" + str(top) + "&$skiptoken=" + str(skip + top)
+                self._send(200, page)
+
+            def _send(self, status, payload, headers=None):
+                body = json.dumps(payload).encode() if payload is not None else b""
+                compress = server.gzip_responses and len(body) >= 1024 and "gzip" in self.headers.get("Accept-Encoding", "")
+                if compress:
+                    body = gzip.compress(body, compresslevel=6)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                if compress:
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Livy REST server (and Microsoft Graph), for offline runs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8998)
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to each response")
+    parser.add_argument("--jitter", type=float, default=0, help="random seconds added to the latency, at most")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of the requests failing with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--session-start-time", type=float, default=5)
+    parser.add_argument("--statement-time", type=float, default=1)
+    parser.add_argument("--batch-time", type=float, default=30)
+    parser.add_argument("--output-size", type=int, default=100, help="characters of the statement outputs")
+    parser.add_argument("--no-gzip-requests", action="store_true", help="refuse gzip request bodies with 415")
+    parser.add_argument("--no-gzip-responses", action="store_true", help="never compress the responses")
+    args = parser.parse_args()
+    server = FakeLivyServer(args.host, args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                            error_status=args.error_status, session_start_time=args.session_start_time,
+                            statement_time=args.statement_time, batch_time=args.batch_time, output_size=args.output_size,
+                            gzip_requests=not args.no_gzip_requests, gzip_responses=not args.no_gzip_responses)
+    print("Fake Livy server on " + server.url)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Fake token provider standing in for the MSAL application of django-azure-auth, to
+run the app and its benchmarks offline.
+
+MSAL only talks to https authorities, so instead of a fake login server, FakeMsalApp
+implements the part of the MSAL application API used by django-azure-auth and the
+views (get_accounts, acquire_token_silent) and install() makes AuthHandler use it.
+
+Like MSAL, acquire_token_silent returns the cached token of the scopes while it is
+valid for more than 5 minutes (at once), and otherwise "redeems the refresh token"
+(after `latency` seconds), which changes `token_cache` (has_state_changed).
+
+Usage:
+    from myapp.fakes.fake_msal import FakeMsalApp, fake_id_token_claims, install
+
+    uninstall = install(FakeMsalApp(latency=0.01))
+    session["id_token_claims"] = fake_id_token_claims("user@example.com")   # logged in user
+    ...
+    uninstall()
+"""
+import random
+import threading
+import time
+import uuid
+
+import msal
+from azure_auth.handlers import AuthHandler
+
+
+def fake_id_token_claims(username="fake.user@example.com", oid="00000000-0000-0000-0000-000000000001", lifetime=3600):
+    """ID token claims of a logged in user, valid for `lifetime` seconds."""
+    now = int(time.time())
+    return {"oid": oid, "preferred_username": username, "name": username, "iat": now, "exp": now + lifetime}
+
+
+class FakeMsalApp:
+    """
+    MSAL application returning fake tokens after `latency` seconds, `error_rate` of them failing.
+    """
+
+    def __init__(self, latency=0, expires_in=3600, error_rate=0, username="fake.user@example.com", seed=None):
+        self.latency = latency
+        self.expires_in = expires_in
+        self.error_rate = error_rate
+        self.username = username
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.token_cache = msal.SerializableTokenCache()
+        self._tokens = {}  # scopes -> cached token result
+        self._lock = threading.Lock()
+
+    def get_accounts(self, username=None):
+        return [{"home_account_id": "fake-uid.fake-tid", "environment": "login.microsoftonline.com",
+                 "username": self.username, "local_account_id": "fake-uid", "realm": "fake-tid"}]
+
+    def acquire_token_silent(self, scopes, account, authority=None, force_refresh=False, claims_challenge=None, **kwargs):
+        key = " ".join(scopes)
+        with self._lock:
+            cached = self._tokens.get(key)
+            if cached is not None and not force_refresh and cached["expires_at"] - time.time() > 300:
+                return dict(cached["result"], expires_in=int(cached["expires_at"] - time.time()))
+            self.calls += 1
+            fail = self.error_rate and self.random.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            return {"error": "temporarily_unavailable", "error_description": "Injected error"}
+        result = {
+            "access_token": "fake-" + uuid.uuid4().hex,
+            "token_type": "Bearer",
+            "expires_in": self.expires_in,
+            "scope": key,
+            "id_token_claims": fake_id_token_claims(self.username),
+        }
+        with self._lock:
+            self._tokens[key] = {"result": result, "expires_at": time.time() + self.expires_in}
+            self.token_cache.has_state_changed = True
+        return result
+
+    def acquire_token_silent_with_error(self, scopes, account, **kwargs):
+        return self.acquire_token_silent(scopes, account, **kwargs)
+
+
+def install(app):
+    """Make AuthHandler use `app` as its MSAL application. Return a callable restoring the real one."""
+    confidential, public = AuthHandler._get_confidential_client, AuthHandler._get_public_client
+    AuthHandler._get_confidential_client = lambda handler: app
+    AuthHandler._get_public_client = lambda handler: app
+
+    def uninstall():
+        AuthHandler._get_confidential_client, AuthHandler._get_public_client = confidential, public
+    return uninstall
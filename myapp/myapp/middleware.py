@@ -0,0 +1,115 @@
+"""
+Request-scoped auth context.
+
+AuthContextMiddleware attaches `request.auth_context`, an AuthContext resolving the
+claims, the access token and the MSAL account of the user lazily and at most once per
+request, so the login check of the views (azure_auth_required in views.py), the views
+themselves and getLivyToken do not go back to the MSAL cache for each lookup. Views can
+also use get_auth_context(request), which works without the middleware.
+
+Compressed responses.
+
+ResponseCompressionMiddleware gzips the responses for the browsers accepting it
+(result pages, JSON payloads, streamed downloads of large outputs), except:
+    - server-sent events (text/event-stream): gzip would hold the events back
+    - byte ranges (Range requests, 206 responses): their offsets are those of the
+      uncompressed output; whole downloads are compressed without Accept-Ranges
+    - already compressed formats (images, zip, gzip)
+"""
+import time
+from asgiref.sync import iscoroutinefunction
+from django.middleware.gzip import GZipMiddleware
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.functional import cached_property
+
+
+class AuthContext:
+    """
+    Auth data of the current request, each resolved on first access.
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    @cached_property
+    def handler(self):
+        # azure_auth.handlers imports msal: only when the auth data is first needed
+        from azure_auth.handlers import AuthHandler
+        return AuthHandler(self.request)
+
+    @property
+    def msal_app(self):
+        return self.handler.msal_app
+
+    @cached_property
+    def claims(self):
+        return self.handler.claims
+
+    @cached_property
+    def token(self):
+        """Result of get_token_from_cache (None when the user is not logged in)."""
+        return self.handler.get_token_from_cache()
+
+    @property
+    def access_token(self):
+        return self.token['access_token'] if self.token else None
+
+    @property
+    def expires_in(self):
+        return self.token['expires_in'] if self.token else None
+
+    @cached_property
+    def account(self):
+        """First MSAL account of the user, or None."""
+        accounts = self.msal_app.get_accounts()
+        return accounts[0] if accounts else None
+
+    @cached_property
+    def user_is_authenticated(self):
+        """
+        The login check of the views: the ID token claims are still valid, or a token can be
+        refreshed from the MSAL cache (the token resolved here is the one the views use).
+        """
+        if not self.request.user.is_authenticated:
+            return False
+        return time.time() < self.claims.get("exp", 0) or self.token is not None
+
+
+def get_auth_context(request):
+    """Return the auth context of `request`, creating it when the middleware is not installed."""
+    context = getattr(request, "auth_context", None)
+    if context is None:
+        context = request.auth_context = AuthContext(request)
+    return context
+
+
+@sync_and_async_middleware
+def AuthContextMiddleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            request.auth_context = AuthContext(request)
+            return await get_response(request)
+    else:
+        def middleware(request):
+            request.auth_context = AuthContext(request)
+            return get_response(request)
+    return middleware
+
+
+class ResponseCompressionMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware skipping the live streams, the byte ranges and the compressed formats.
+    """
+
+    UNCOMPRESSED_CONTENT_TYPES = ("text/event-stream", "image/", "application/zip", "application/gzip")
+
+    def process_response(self, request, response):
+        content_type = response.get("Content-Type", "")
+        if (content_type.startswith(self.UNCOMPRESSED_CONTENT_TYPES) or response.status_code == 206
+                or response.has_header("Content-Range") or "Range" in request.headers):
+            return response
+        response = super().process_response(request, response)
+        if response.get("Content-Encoding") == "gzip" and response.has_header("Accept-Ranges"):
+            # Ranges of the compressed body could not be served
+            del response.headers["Accept-Ranges"]
+        return response
@@ -13,16 +13,15 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 
 ############ START IMPORTANT ###################
-from dotenv import load_dotenv
-import os, json
-# Load environment variables from .env file
-load_dotenv()
+from myapp.config import get_config, load_environment
+import os
+# Load environment variables from .env file (once per process, shared with myapp.config)
+load_environment()
 TENANT_ID = os.getenv('TENANT_ID')
 CLIENT_ID = os.getenv('CLIENT_ID')
 CLIENT_SECRET = os.getenv('CLIENT_SECRET')
 REDIRECT_URI = os.getenv('REDIRECT_URI')
 LOGOUT_URI = os.getenv('LOGOUT_URI')
-ROLES = os.getenv('ROLES')
 GRAPH_USER_ENDPOINT = os.getenv('GRAPH_USER_ENDPOINT')
 LIVY_ENDPOINT = os.getenv('LIVY_ENDPOINT')
 ############ END IMPORTANT ###################
@@ -62,10 +61,18 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    ############ START IMPORTANT ###################
+    # Gzip for the browsers accepting it, except the live streams (server-sent events) and byte ranges
+    'myapp.middleware.ResponseCompressionMiddleware',
+    ############ END IMPORTANT ###################
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    ############ START IMPORTANT ###################
+    # Resolves the EntraID claims/token/account once per request (request.auth_context)
+    'myapp.middleware.AuthContextMiddleware',
+    ############ END IMPORTANT ###################
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -103,6 +110,30 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/5.2/ref/settings/#caches
+# "livy_state" holds the Livy state of the users when LIVY_STATE_STORE=cache: shared by the
+# workers on Redis when LIVY_STATE_CACHE_URL is set (e.g. redis://localhost:6379/0), else per process
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+if os.getenv('LIVY_STATE_CACHE_URL', '').startswith('locmem://'):
+    # Livy state of the users (LIVY_STATE_STORE=cache) in a cache of the process: local runs with a single worker only
+    CACHES['livy_state'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'livy_state',
+    }
+elif os.getenv('LIVY_STATE_CACHE_URL'):
+    # Livy state of the users shared by the workers (LIVY_STATE_STORE=cache)
+    CACHES['livy_state'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('LIVY_STATE_CACHE_URL'),
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -158,7 +189,7 @@ AZURE_AUTH = {
     "LOGOUT_URI": LOGOUT_URI,    # Optional
     "PUBLIC_URLS": ["<public:view_name>",],  # Optional, public views accessible by non-authenticated users
     "PUBLIC_PATHS": ['/go/',],  # Optional, public paths accessible by non-authenticated users
-    "ROLES": json.loads(ROLES),  # Optional, will add user to django group if user is in EntraID group
+    "ROLES": get_config().roles,  # Optional, will add user to django group if user is in EntraID group (validated by myapp.config)
     "USERNAME_ATTRIBUTE": "upn",   # The AAD attribute or ID token claim you want to use as the value for the user model `USERNAME_FIELD`
     "GROUP_ATTRIBUTE": "roles",   # The AAD attribute or ID token claim you want to use as the value for the user's group memberships
     "EXTRA_FIELDS": ["givenName", "surname", "upn"], # Optional, extra AAD user profile attributes you want to make available in the user mapping function
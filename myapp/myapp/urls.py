@@ -29,8 +29,26 @@ urlpatterns = [
     path("createLivySession", views.createLivySession),
     path("checkLivySession", views.checkLivySession),
     path("submitLivyStatement", views.submitLivyStatement),
+    path("submitLivyCells", views.submitLivyCells),
     path("getLivyStatement", views.getLivyStatement),
+    path("getLivyStatementOutput", views.getLivyStatementOutput),
+    path("getLivyStatements", views.getLivyStatements),
+    path("livyLog", views.livyLog),
+    path("tailLivyLog", views.tailLivyLog),
+    path("livyStatementsLive", views.livyStatementsLive),
+    path("streamLivyStatements", views.streamLivyStatements),
+    path("submitLivyBatch", views.submitLivyBatch),
+    path("getLivyBatches", views.getLivyBatches),
+    path("cancelLivyBatch", views.cancelLivyBatch),
     path("stopLivySession", views.stopLivySession),      
+    path("metrics", views.livyMetrics),
+    # Async views, to be served by an ASGI server (see asgi.py)
+    path("async/createLivySession", views.createLivySessionAsync),
+    path("async/checkLivySession", views.checkLivySessionAsync),
+    path("async/submitLivyStatement", views.submitLivyStatementAsync),
+    path("async/getLivyStatement", views.getLivyStatementAsync),
+    path("async/stopLivySession", views.stopLivySessionAsync),
+    path("async/streamLivyStatements", views.streamLivyStatementsAsync),
     path("logout", views.index),  
 ]
 ############ END IMPORTANT ###################
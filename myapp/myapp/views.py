@@ -1,29 +1,171 @@
+import os
 import time
-from azure_auth.decorators import azure_auth_required
-from django.shortcuts import HttpResponse, render
-from django.http import JsonResponse
+import re
+import tempfile
+import logging
+import mimetypes
+import asyncio
+import threading
+import weakref
+from collections import OrderedDict
+from functools import wraps
+from importlib import import_module
+from asgiref.sync import sync_to_async
+from django.shortcuts import HttpResponse, render, redirect
+from django.urls import reverse
+from django.http import JsonResponse, StreamingHttpResponse, FileResponse
+from django.conf import settings
+from django.core.cache import caches
+from django.core.handlers.asgi import ASGIRequest
 import requests
 import json
-from datetime import datetime, timedelta
-from azure_auth.handlers import AuthHandler
-import msal
-from myapp.api.apache_livy import ApacheLivy
+from datetime import datetime
+from urllib.parse import urlencode, urlparse
+from myapp.middleware import get_auth_context
+from myapp.config import get_config
+from myapp.api.apache_livy import ApacheLivy, STATEMENT_TERMINAL_STATES
+from myapp.api.graph_client import GraphClient
+from myapp.api.livy_session_pool import LivySessionPool
+from myapp.api.livy_client_registry import LivyClientRegistry
+from myapp.api.livy_token_manager import LivyTokenManager, LivyTokenError
+from myapp.api.livy_batch_queue import LivyBatchQueue
+from myapp.api.livy_scheduler import LivyRequestScheduler, in_background
+from myapp.api.livy_hedging import LivyHedger
+from myapp.api.livy_circuit_breaker import LivyCircuitBreaker
+from myapp.api.livy_metrics import LivyMetrics
+from myapp.api.livy_session_reaper import LivySessionReaper
+from myapp.api.livy_session_registry import LivySessionRegistry, LivySessionLimitError
+from myapp.api.livy_output_store import LivyOutputStore, CONTENT_TYPES, read_json
+from myapp.api.livy_models import model, body
+from myapp.api.livy_state_store import SessionLivyStateStore, MemoryLivyStateStore, CacheLivyStateStore
+from myapp.api.livy_statement_cache import LivyStatementCache
+from myapp.api.livy_statement_poller import LivyStatementPoller
 
-from dotenv import load_dotenv
-import os
-# Load environment variables from .env file
-load_dotenv()
-graph_user_endpoint = os.getenv('GRAPH_USER_ENDPOINT')
-graph_member_endpoint = os.getenv('GRAPH_MEMBER_ENDPOINT')
-livy_base_url = os.getenv("LIVY_BASE_ENDPOINT")
-livy_requests_timeout = int(os.getenv("LIVY_REQUESTS_TIMEOUT"))
-livy_session_name_prefix = os.getenv("LIVY_SESSION_NAME_PREFIX")
-livy_spark_conf = os.getenv('LIVY_SPARK_CONF') if os.getenv('LIVY_SPARK_CONF') else "{}"
-livy_backend = os.getenv("LIVY_BACKEND").strip().lower()
-livy_backend_spark_dependencies = os.getenv("LIVY_SPARK_DEPENDENCIES") if os.getenv("LIVY_SPARK_DEPENDENCIES") else ""
+logger = logging.getLogger(__name__)
+config = get_config()
+def service(factory):
+    # Shared service of the process, built by `factory` on its first use rather than when the views are imported:
+    # the first request does not pay for the services it does not use (sqlite file, temporary directory...)
+    lock = threading.Lock()
+    instances = []
+
+    @wraps(factory)
+    def get():
+        if not instances:
+            with lock:
+                if not instances:
+                    instances.append(factory())
+        return instances[0]
+    return get
+
+@service
+def graphClient():
+    # Graph results are cached per user for GRAPH_CACHE_TTL seconds
+    return GraphClient(ttl=config.graph_cache_ttl)
+
+@service
+def livyScheduler():
+    # Throttling: calls per second and burst per workspace and endpoint, Retry-After honoured (shared by all the sync clients)
+    return LivyRequestScheduler(rate=config.livy_rate_limit, burst=config.livy_rate_burst, max_wait=config.livy_throttle_max_wait)
+
+@service
+def livyHedger():
+    # Hedged reads: a GET slower than the LIVY_HEDGE_PERCENTILE latency of its endpoint is sent again (None when 0)
+    if not config.livy_hedge_percentile:
+        return None
+    return LivyHedger(percentile=config.livy_hedge_percentile, min_delay=config.livy_hedge_min_delay,
+                      max_workers=config.livy_hedge_max_workers)
+
+@service
+def livyBreaker():
+    # Endpoints failing LIVY_CIRCUIT_FAILURE_THRESHOLD times in a row fail fast for LIVY_CIRCUIT_RESET_TIMEOUT seconds (None when 0)
+    if not config.livy_circuit_failure_threshold:
+        return None
+    return LivyCircuitBreaker(failure_threshold=config.livy_circuit_failure_threshold, reset_timeout=config.livy_circuit_reset_timeout)
+
+@service
+def livyCallMetrics():
+    # Metrics of the Livy calls (all the clients), exposed by /metrics (Bearer LIVY_METRICS_TOKEN when set)
+    return LivyMetrics()
+
+@service
+def livyTokens():
+    # Livy/Fabric tokens cached per account, refreshed LIVY_TOKEN_REFRESH_MARGIN seconds ahead of expiry
+    return LivyTokenManager(refresh_margin=config.livy_token_refresh_margin)
+
+@service
+def livySessionReaper():
+    # Sessions of the app (LIVY_SESSION_NAME_PREFIX) idle for more than LIVY_SESSION_IDLE_TTL seconds are deleted (0 to disable),
+    # idle in all the worker processes (heartbeats of the session registry), and released from the registry
+    return LivySessionReaper(name_prefix=config.livy_session_name_prefix, idle_ttl=config.livy_session_idle_ttl,
+                             interval=config.livy_session_reaper_interval, ignore=lambda session_id: livySessionPooled(session_id),
+                             last_activity=lambda session_id: livySessionRegistry().last_activity(config.livy_backend, session_id),
+                             on_reap=lambda session_id: livySessionRegistry().release(config.livy_backend, session_id=session_id))
+
+@service
+def livySessionRegistry():
+    # Live Livy sessions and their owners, shared by the worker processes (sqlite file): one session per browser session,
+    # at most LIVY_MAX_SESSIONS_PER_USER per user (0 for no limit). Kept out of the source tree by default (temporary
+    # directory of the node, shared by its workers)
+    path = config.livy_session_registry_path or os.path.join(tempfile.gettempdir(), "myapp-livy-sessions.sqlite3")
+    return LivySessionRegistry(path,
+                               max_per_owner=config.livy_max_sessions_per_user, stale_after=config.livy_session_registry_stale_after)
+
+@service
+def livyBatchQueue():
+    # Batch jobs: local queue, at most LIVY_BATCH_MAX_RUNNING batches running at once (LIVY_BATCH_MAX_RUNNING_PER_USER per user)
+    return LivyBatchQueue(max_running=config.livy_batch_max_running, max_running_per_owner=config.livy_batch_max_running_per_user,
+                          poll_interval=config.livy_batch_poll_interval, max_poll_failures=config.livy_batch_max_poll_failures,
+                          lost_after=config.livy_batch_lost_after)
+
+@service
+def livyOutputStore():
+    # Statement outputs above the threshold are spilled to disk and shown by pages
+    return LivyOutputStore(threshold=config.livy_output_spill_threshold, max_bytes=config.livy_output_store_max_bytes,
+                           directory=config.livy_output_store_dir)
+
+@service
+def livyResultCache():
+    # Results of the finished statements, served again without calling Livy (0 to disable)
+    return LivyStatementCache(max_bytes=config.livy_result_cache_max_bytes, max_entry_bytes=config.livy_result_cache_max_entry_bytes)
+
+@service
+def livyStatementPoller():
+    # Statements followed live (/streamLivyStatements): one background check per Livy session, whatever the number of open pages.
+    # Their results are cached once finished, so opening a finished statement does not call Livy
+    return LivyStatementPoller(interval=config.livy_statement_poll_interval, max_interval=config.livy_statement_poll_max_interval,
+                               retries=config.livy_statement_poll_retries,
+                               on_finished=lambda results_key, statement: livyStatementResult(results_key, statement.get('id'), statement))
+
+@service
+def livyState():
+    # Livy state of the users (token copy, session ID, statement IDs): "session" (the Django session, default),
+    # "cache" (CACHES["livy_state"] on Redis, shared by the workers, or locmem://) or "memory" (a single worker process only)
+    if config.livy_state_store == "cache":
+        return CacheLivyStateStore(caches["livy_state"], ttl=config.livy_state_ttl or settings.SESSION_COOKIE_AGE)
+    if config.livy_state_store == "memory":
+        return MemoryLivyStateStore(ttl=config.livy_state_ttl or settings.SESSION_COOKIE_AGE)
+    return SessionLivyStateStore(import_module(settings.SESSION_ENGINE).SessionStore)
+
+# Livy clients kept per backend and identity (LRU, see livyClients), with one async registry per event loop
+livy_async_clients = weakref.WeakKeyDictionary()
+# Pools of warm Livy sessions (one per identity, at most LIVY_SESSION_POOL_MAX_POOLS, the least recently used closed first),
+# disabled when LIVY_SESSION_POOL_SIZE is 0
+livy_session_pools = OrderedDict()
+livy_session_pools_lock = threading.Lock()
 
 title = "Apache Livy/Microsoft Fabric - Spark remote execution. Authentication using Microsoft EntraID with django-azure-auth"
 
+def azure_auth_required(view):
+    # Like azure_auth.decorators.azure_auth_required, but checked through the auth context of the request:
+    # the token resolved by the check is the one the view uses, instead of a second AuthHandler and MSAL lookup
+    @wraps(view)
+    def _wrapper(request, *args, **kwargs):
+        if get_auth_context(request).user_is_authenticated:
+            return view(request, *args, **kwargs)
+        return redirect(reverse('azure_auth:login') + "?next=" + urlparse(request.path).path)
+    return _wrapper
+
 def user_mapping_fn(**attributes):
     #https://docs.djangoproject.com/en/5.2/ref/contrib/auth/#django.contrib.auth.models.User
     return {
@@ -34,15 +176,17 @@ def user_mapping_fn(**attributes):
     }
 
 def index(request):     
-    if(AuthHandler(request).get_token_from_cache()):      
-        access_token = AuthHandler(request).get_token_from_cache()['access_token']        
-        expires_in = AuthHandler(request).get_token_from_cache()['expires_in']     
-        user = AuthHandler(request).claims['name']
+    auth = get_auth_context(request)
+    if(auth.token):      
+        access_token = auth.access_token        
+        expires_in = auth.expires_in     
+        user = auth.claims['name']
         
-        livy_token = request.session.get('livy_token', None)
-        livy_token_expiration_time = request.session.get('livy_token_expiration_time', None)
-        livy_session_id = request.session.get('livy_session_id', None) 
-        livy_statement_ids = request.session.get('livy_statement_ids', None)  
+        livy_values = livyState().get_many(livyStateScope(request), ('livy_token', 'livy_token_expiration_time', 'livy_session_id'))
+        livy_token = livy_values.get('livy_token')
+        livy_token_expiration_time = livy_values.get('livy_token_expiration_time')
+        livy_session_id = livy_values.get('livy_session_id')
+        livy_statement_ids = livyState().get_list(livyStateScope(request), 'livy_statement_ids') if livy_session_id is not None else None
         
     else:       
         access_token = None 
@@ -58,10 +202,10 @@ def index(request):
         user = user,
         expires_in = expires_in,
         livy_token = livy_token,  
-        livy_expires_in = str(int((datetime.strptime(livy_token_expiration_time, "%Y-%m-%d %H:%M:%S") - datetime.now()).total_seconds())) if livy_token_expiration_time else None,
+        livy_expires_in = livyTokenExpiresIn(livy_token_expiration_time),
         livy_session_id = livy_session_id,
         livy_statement_ids = livy_statement_ids,
-        livy_backend = livy_backend.upper(),
+        livy_backend = config.livy_backend.upper(),
         title = title,
     ))    
 
@@ -69,19 +213,19 @@ def index(request):
 @azure_auth_required
 def login(request):
     return render(request, 'index.html', dict(
-        access_token = AuthHandler(request).get_token_from_cache()['access_token'],              
-        user = AuthHandler(request).claims['name'],    
+        access_token = get_auth_context(request).access_token,              
+        user = get_auth_context(request).claims['name'],    
         title = title,        
     ))
 
 
 @azure_auth_required
 def me(request):
-    api_result = requests.get(  # Use access token to call a web api
-        graph_user_endpoint,  
-        headers={'Authorization': 'Bearer ' + AuthHandler(request).get_token_from_cache()['access_token']},
-        timeout=30,
-    ).json() if AuthHandler(request).user_is_authenticated else "Not authenticated"
+    auth = get_auth_context(request)
+    # Use access token to call a web api, cached per user
+    api_result = graphClient().get(
+        config.graph_user_endpoint, auth.access_token, graphUserKey(request)
+    ) if auth.user_is_authenticated else "Not authenticated"
     return render(request, 'display.html', {
         "title": "Result of Me",
         "content": json.dumps(api_result, indent=4)
@@ -89,11 +233,11 @@ def me(request):
     
 @azure_auth_required
 def memberOf(request):
-    api_result = requests.get(  # Use access token to call a web api
-        graph_member_endpoint,
-        headers={'Authorization': 'Bearer ' + AuthHandler(request).get_token_from_cache()['access_token']},
-        timeout=30,
-    ).json() if AuthHandler(request).user_is_authenticated else "Not authenticated"
+    auth = get_auth_context(request)
+    # Use access token to call a web api, cached per user, all the pages (@odata.nextLink)
+    api_result = graphClient().get_all_pages(
+        config.graph_member_endpoint, auth.access_token, graphUserKey(request)
+    ) if auth.user_is_authenticated else "Not authenticated"
     
     # Get the memberOf groups
     memberOf = [group["displayName"] for group in api_result["value"] if "displayName" in group]
@@ -108,6 +252,8 @@ def memberOf(request):
 def requestLivyFabricToken(request):
 
     livy_token = getLivyToken(request)
+    # Start warming the session pool (if enabled), ahead of the session request
+    livySessionPoolGetOrCreate(request, livy_token)
     return render(request, 'display.html', {
             "title": "Result of Livy/Fabric request token",
             "content": "Livy/Fabric Token: " + livy_token     
@@ -117,54 +263,66 @@ def requestLivyFabricToken(request):
 def createLivySession(request):      
     try:
         # Get a Livy session ID
-        if(request.session.get('livy_session_id')):
-            livy_session_id = request.session.get('livy_session_id')
+        livy_session_id = livySessionId(request)
+        if(livy_session_id):
             sessionExists = "Already exists, "
-        else:            
-            sessionExists = ""
-                        
-            # Create a session
-            livy_token = getLivyToken(request)
-            livy = livyGetOrCreate(livy_token)
-             
-            api_result = livy.create_session(
-                data={
-                    # Ideally, use unique session name
-                    "name": livy_session_name_prefix + datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 
-                    "kind": "pyspark",
-                    "archives": [],
-                    # Adding dependencies to the driver and executors using pyFiles. Other possible options for Fabric is to use an EnvironmentID
-                    "pyFiles": livy_backend_spark_dependencies.split(',') if livy_backend_spark_dependencies else [],                    
-                    "conf": json.loads(livy_spark_conf) if livy_spark_conf else {},
-                    # Uncomment if you would like to enable minimum values on Fabric side
-                    # Driver memory-Fabric: 7g, 14g, 28g, 56g, 112g, 224g, 200g, 400g
-                    #"driverMemory": "7g",
-                    #"driverCores": 1,
-                    # Executor memory-Fabric: 7g, 14g, 28g, 56g, 112g, 224g, 200g, 400g
-                    #"executorMemory": "7g",
-                    #"executorCores": 1,
-                    #"numExecutors": 1,
-                    #"idleTimeout" : "10m", # Not working 
-                    #"ttl": "10m", # Not working 
-                    }
-                )if livy_token else "Not authenticated"
-           
-            api_result.raise_for_status()  # Check for HTTP errors
-           
-            if(api_result.json()['id']):                
-                livy_session_id = api_result.json()['id']
-                request.session['livy_session_id'] = livy_session_id
-            else:
+        else:
+            # One Livy session per browser session across the worker processes (session registry)
+            claim = livySessionClaim(request)
+            if(claim.session_id is not None):
+                # Started through another worker process
+                livy_session_id = claim.session_id
+                livySessionSet(request, livy_session_id)
+                sessionExists = "Already exists, "
+            elif(not claim.reserved):
                 return render(request, 'display.html', {
                     "title": "Result of Livy request session",
-                    "content": "Livy Session ID: " +  "\r\nResult:" + str(api_result),                       
+                    "content": "The Livy session is being started by another request, please reload in a moment",
                 })
-        
+            else:
+                try:
+                    livy_token = getLivyToken(request)
+                    # Hand out a warm session from the session pool (if enabled)
+                    livy_session_id = livySessionPoolAcquire(request, livy_token)
+                    if(livy_session_id is not None):
+                        livySessionSet(request, livy_session_id)
+                        sessionExists = "From the session pool, "
+                    else:
+                        sessionExists = ""
+
+                        # Create a session
+                        livy = livyGetOrCreate(request, livy_token)
+             
+                        api_result = livy.create_session(
+                            data=livySessionData()
+                            )if livy_token else "Not authenticated"
+           
+                        api_result.raise_for_status()  # Check for HTTP errors
+           
+                        livy_session = model(api_result)
+                        if(livy_session.id is not None):
+                            livy_session_id = livy_session.id
+                            livySessionSet(request, livy_session_id)
+                        else:
+                            return render(request, 'display.html', {
+                                "title": "Result of Livy request session",
+                                "content": "Livy Session ID: " +  "\r\nResult:" + str(api_result),                       
+                            })
+                finally:
+                    # Registered for the other worker processes, or the claim is given up (not created)
+                    livySessionClaimed(request, livy_session_id)
+
+        livySessionTouch(request, livy_session_id)
         return render(request, 'display.html', {
             "title": "Result of Livy request session",
             "content": sessionExists + "Livy Session ID: " + str(livy_session_id),
             "livy_session_id": livy_session_id           
         })        
+    except LivySessionLimitError as e:
+        return render(request, 'display.html', {
+            "title": "Result of Livy request session",
+            "content": str(e),
+        })
     except requests.exceptions.RequestException as e:
         return render(request, 'display.html', {
             "title": "Result of Livy request session",
@@ -175,14 +333,18 @@ def createLivySession(request):
 def checkLivySession(request):      
     try:
         # Check Livy Session ID        
-        if(request.session.get('livy_session_id')):            
-            livy_session_id = request.session.get('livy_session_id')
+        livy_session_id = livySessionId(request)
+        if(livy_session_id):
             
             livy_token = getLivyToken(request) 
-            livy = livyGetOrCreate(livy_token)           
+            livy = livyGetOrCreate(request, livy_token)           
+            # Long-poll mode (?wait=seconds): wait server-side until the session is idle or terminated
+            wait = livyWaitSeconds(request)
+            if wait:
+                livy.wait_for_session(livy_session_id, wait=wait)
             api_result = livy.get_session(livy_session_id)
             
-            livy_state_session = api_result.json()
+            livy_state_session = body(api_result)
             api_result.raise_for_status()  # Check for HTTP errors
             
             return render(request, 'display.html', {
@@ -206,24 +368,19 @@ def submitLivyStatement(request):
     livy_code = request.POST.get('livy_code', None)
     try:
         # Check Lvy Session ID        
-        if(request.session.get('livy_session_id')):
-            livy_session_id = request.session.get('livy_session_id')
+        livy_session_id = livySessionId(request)
+        if(livy_session_id):
             
             livy_token = getLivyToken(request) 
-            livy = livyGetOrCreate(livy_token)
+            livy = livyGetOrCreate(request, livy_token)
             api_result = livy.submit_statement(livy_session_id, livy_code)
             
-            if('id' in api_result.json()):
-                livy_statement_id = api_result.json()['id']
+            livy_statement = body(api_result)
+            if('id' in livy_statement):
+                livy_statement_id = livy_statement['id']
                 
-                #store statementIds in a session
-                if(request.session.get('livy_statement_ids')):
-                    ids = request.session.get('livy_statement_ids', [])    
-                else:
-                    ids = []
-                                    
-                ids.append(livy_statement_id)
-                request.session['livy_statement_ids'] = ids
+                #store statementIds in the Livy state (atomic append)
+                livyState().append(livyStateScope(request), 'livy_statement_ids', livy_statement_id)
                 
                 return render(request, 'display.html', {
                     "title": "Result of Livy remote code execution",
@@ -246,33 +403,85 @@ def submitLivyStatement(request):
             "content": JsonResponse({'status': 'error', 'message': str(e)}).content.decode('utf-8')
         })    
 
+@azure_auth_required
+def submitLivyCells(request):
+    # Notebook-style: an ordered list of cells (livy_cell fields, or livy_cells split on "# %%" lines)
+    livy_cells = request.POST.getlist('livy_cell') or splitLivyCells(request.POST.get('livy_cells', ''))
+    try:
+        # Check Lvy Session ID        
+        livy_session_id = livySessionId(request)
+        if(livy_session_id and livy_cells):
+            
+            livy_token = getLivyToken(request) 
+            livy = livyGetOrCreate(request, livy_token)
+            # The first cell now; the next ones from the background, each once the previous one ended ok,
+            # so no cell runs after a failed one
+            api_result = livy.submit_statement(livy_session_id, livy_cells[0])
+            
+            livy_statement = body(api_result)
+            if('id' in livy_statement):
+                livy_statement_id = livy_statement['id']
+                
+                #store statementIds in the Livy state (atomic append)
+                livyState().append(livyStateScope(request), 'livy_statement_ids', livy_statement_id)
+                
+                content = "Livy Session ID: " + str(livy_session_id) + "\r\nStatement ID:" + str(livy_statement_id)
+                if(len(livy_cells) > 1):
+                    livyRunCells(request, livy_session_id, livy_cells[1:], livy_statement_id)
+                    content += "\r\nThe next " + str(len(livy_cells) - 1) + " cell(s) are submitted one after the other, each once the previous one succeeded"
+            else:
+                content = "Livy Session ID: " + str(livy_session_id) + "\r\nCell 1 rejected, no cell submitted\r\nResult:" + str(api_result)
+            return render(request, 'display.html', {
+                "title": "Result of Livy remote cells execution",
+                "content": content,
+                "links": [{"label": "Live status of the statements", "url": "/livyStatementsLive"}],
+            })
+        else:
+            return render(request, 'display.html', {
+                "title": "Result of Livy remote cells execution",
+                "content": "No Livy Token and/or Livy session ID, or no cells. Please Start Livy Session first"             
+            })          
+        
+    except requests.exceptions.RequestException as e:
+        return render(request, 'display.html', {
+            "title": "Result of Livy remote cells execution",
+            "content": JsonResponse({'status': 'error', 'message': str(e)}).content.decode('utf-8')
+        })    
+
 @azure_auth_required
 def getLivyStatement(request):      
     try:
         # Check Livy Session ID        
-        if(request.session.get('livy_session_id')):
-            livy_session_id = request.session.get('livy_session_id')
+        livy_session_id = livySessionId(request)
+        if(livy_session_id):
 
             statement_id = request.GET.get('id', None)
+            results_key = livyResultsKey(request, livy_session_id)
             
-            livy_token = getLivyToken(request) 
-            livy = livyGetOrCreate(livy_token)
-            api_result = livy.get_statement(livy_session_id,statement_id)
-                    
-            livy_statement = api_result.json()
-            api_result.raise_for_status()  # Check for HTTP errors
-            
-            if(livy_statement["state"] != "available"):            
-               result =  json.dumps(livy_statement, indent=4)
-            else: 
-                try:
-                    result = livy_statement['output']['data']['text/plain']
-                except:
-                    result = json.dumps(livy_statement, indent=4)                
+            # Finished statements never change: served from the result cache without calling Livy
+            rendered = livyCachedResult(results_key, statement_id)
+            if rendered is not None:
+                livySessionTouch(request, livy_session_id)
+            else:
+                livy_token = getLivyToken(request) 
+                livy = livyGetOrCreate(request, livy_token)
+                # Long-poll mode (?wait=seconds): wait server-side until the result is ready
+                wait = livyWaitSeconds(request)
+                if wait:
+                    api_result = livy.wait_for_statement(livy_session_id, statement_id, wait=wait)
+                    api_result.raise_for_status()  # Check for HTTP errors
+                    livy_statement = body(api_result)
+                else:
+                    # Streamed: the body is spooled in chunks instead of being buffered whole
+                    livy_statement = livyReadStatement(livy, livy_session_id, statement_id)
+                rendered = livyResultPage(results_key, statement_id, livyStatementResult(results_key, statement_id, livy_statement))
+                del livy_statement
+            result, links = rendered
             
             return render(request, 'display.html', {
                     "title": "Result of Livy Statement:" + statement_id,
-                    "content": "Livy Session ID: " + str(livy_session_id) + "\r\nResult:\r\n" + result,                       
+                    "content": "Livy Session ID: " + str(livy_session_id) + "\r\nResult:\r\n" + result,
+                    "links": links,
                 })    
         else:
             return render(request, 'display.html', {
@@ -286,19 +495,205 @@ def getLivyStatement(request):
             "content": JsonResponse({'status': 'error', 'message': str(e)}).content.decode('utf-8')
         })
         
+@azure_auth_required
+def getLivyStatementOutput(request):
+    # Large output of a statement (?id=&mime=), by pages (?page=N) or as a download (?download=1, HTTP Range supported)
+    statement_id = request.GET.get('id', None)
+    mime = request.GET.get('mime', 'text/plain')
+    livy_session_id = livySessionId(request)
+    if(livy_session_id is None or statement_id is None):
+        return HttpResponse("No Livy session ID and/or statement ID. Please Start Livy Session first", status=400)
+    results_key = livyResultsKey(request, livy_session_id)
+    key = livyOutputKey(results_key, statement_id)
+    cached = livyResultCache().get(key)
+    try:
+        if(cached is not None and 'data' in cached and not isinstance(cached['data'].get(mime), tuple)):
+            # Inline (or missing) in the cached result of the statement
+            data = cached['data']
+        elif(not livyOutputStore().has(key, mime)):
+            # Not spilled yet (or evicted): fetch it again
+            livy_token = getLivyToken(request)
+            livy = livyGetOrCreate(request, livy_token)
+            livy_statement = livyReadStatement(livy, livy_session_id, statement_id)
+            data = livyOutputStore().put_output(key, (livy_statement.get('output') or {}).get('data') or {})
+        else:
+            data = {mime: (CONTENT_TYPES.get(mime, "application/json"), livyOutputStore().size(key, mime))}
+    except requests.exceptions.RequestException as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=502)
+
+    if(mime not in data):
+        return HttpResponse("No " + mime + " output for statement " + statement_id, status=404)
+    if(not isinstance(data[mime], tuple)):
+        # Small enough to be kept inline
+        value = data[mime]
+        if(isinstance(value, str)):
+            return HttpResponse(value, content_type=CONTENT_TYPES.get(mime, "text/plain; charset=utf-8"))
+        return JsonResponse(value, safe=False)
+
+    if(request.GET.get('download') or mime == 'image/png'):
+        return livyOutputFileResponse(request, key, mime, data[mime])
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
+    result, links = livyOutputPage(results_key, statement_id, data, mime, page)
+    return render(request, 'display.html', {
+        "title": "Result of Livy Statement:" + statement_id + " (" + mime + ", page " + str(page) + ")",
+        "content": result,
+        "links": links,
+    })
+
+@azure_auth_required
+def getLivyStatements(request):
+    # Bulk status and output of all the tracked statements, as one compact JSON payload
+    try:
+        livy_session_id = livySessionId(request)
+        livy_statement_ids = livyState().get_list(livyStateScope(request), 'livy_statement_ids')
+        if(livy_session_id is None):
+            return JsonResponse({'status': 'error', 'message': "No Livy Token and/or Livy session ID. Please Start Livy Session first"}, status=400)
+
+        livy_token = getLivyToken(request)
+        livy = livyGetOrCreate(request, livy_token)
+        livy_statements = livy.get_statements(livy_session_id, livy_statement_ids, max_workers=config.livy_bulk_max_workers)
+
+        return JsonResponse({
+            'session_id': livy_session_id,
+            'statements': [livyStatementSummary(livy_statements.get(int(id)), id) for id in livy_statement_ids],
+        })
+    except requests.exceptions.RequestException as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=502)
+
+@azure_auth_required
+def livyLog(request):
+    # Page following the driver log live (see tailLivyLog)
+    batch_id = request.GET.get('batch_id', None)
+    if(batch_id is not None and not livyBatchOwned(request, batch_id)):
+        return HttpResponse("Unknown batch", status=404)
+    return render(request, 'log.html', {
+        "title": "Livy Batch Log:" + batch_id if batch_id else "Livy Session Log",
+        "stream_url": "/tailLivyLog" + ("?" + urlencode({"batch_id": batch_id}) if batch_id else ""),
+    })
+
+@azure_auth_required
+def tailLivyLog(request):
+    # Server-sent events stream of the new log lines of the session (or of ?batch_id=), one event per line.
+    # The event ID is the line cursor, so a reconnecting EventSource resumes where it stopped (Last-Event-ID)
+    batch_id = request.GET.get('batch_id', None)
+    if(batch_id is not None and not livyBatchOwned(request, batch_id)):
+        # Only the batches of the user's jobs: all the users may share one Livy identity
+        return HttpResponse("Unknown batch", status=404)
+    livy_session_id = livySessionId(request)
+    if(batch_id is None and livy_session_id is None):
+        return HttpResponse("No Livy session ID. Please Start Livy Session first", status=400)
+    try:
+        from_line = int(request.headers.get('Last-Event-ID') or request.GET.get('from', 0))
+    except ValueError:
+        from_line = 0
+
+    livy_token = getLivyToken(request)
+    livy = livyGetOrCreate(request, livy_token)
+    if(batch_id is not None):
+        follower = livy.follow_batch_log(batch_id, from_line=from_line, wait=config.livy_log_tail_max_seconds)
+    else:
+        follower = livy.follow_session_log(livy_session_id, from_line=from_line, wait=config.livy_log_tail_max_seconds)
+
+    def events():
+        try:
+            for line in follower:
+                yield "id: " + str(follower.cursor) + "\ndata: " + line.replace("\n", "\ndata: ") + "\n\n"
+            yield "event: end\ndata: \n\n"
+        except requests.exceptions.RequestException as e:
+            yield "event: error\ndata: " + str(e) + "\n\n"
+
+    return livyEventStream(events())
+
+@azure_auth_required
+def livyStatementsLive(request):
+    # Page following the state and progress of the tracked statements live (see streamLivyStatements)
+    return render(request, 'statements.html', {
+        "title": "Livy Statements (live)",
+        "stream_url": ("/async" if request.GET.get('async') else "") + "/streamLivyStatements",
+    })
+
+@azure_auth_required
+def streamLivyStatements(request):
+    # Server-sent events of the state and progress changes of the tracked statements (or of ?id=...), one JSON event per change.
+    # The changes are pushed by the process-wide statement poller: one Livy call per session and check, whatever the number of pages
+    watch = livyStatementWatch(request)
+    if(watch is None):
+        return HttpResponse("No Livy session ID. Please Start Livy Session first", status=400)
+    subscription = livyStatementPoller().subscribe(*watch)
+
+    def events():
+        deadline = time.monotonic() + config.livy_statement_stream_max_seconds
+        try:
+            while subscription.pending and time.monotonic() < deadline:
+                event = subscription.get(timeout=min(15, max(0, deadline - time.monotonic())))
+                # Comment lines keep the connection open while nothing changes
+                yield "data: " + json.dumps(event) + "\n\n" if event is not None else ": keep-alive\n\n"
+            yield livyStatementStreamEnd(subscription)
+        finally:
+            subscription.close()
+
+    return livyEventStream(events())
+
+@azure_auth_required
+def submitLivyBatch(request):
+    # Queue a batch job: it runs without an interactive session, within the batch concurrency caps
+    livy_batch_file = request.POST.get('livy_batch_file', '').strip()
+    if(not livy_batch_file):
+        return render(request, 'display.html', {
+            "title": "Result of Livy batch submission",
+            "content": "No batch file. Please give the path of the job file (.py or .jar)"
+        })
+    livy_token = getLivyToken(request)
+    if(livy_token is None):
+        return render(request, 'display.html', {
+            "title": "Result of Livy batch submission",
+            "content": "No Livy Token. Please request a Livy Token first"
+        })
+    data = livyBatchData(livy_batch_file, request.POST.get('livy_batch_class_name', '').strip(),
+                         request.POST.get('livy_batch_args', '').splitlines())
+    job = livyBatchQueue().submit(livyBatchOwner(request), data, livyBackgroundClient(request))
+    return render(request, 'display.html', {
+        "title": "Result of Livy batch submission",
+        "content": "Batch job ID: " + job.id + " (" + job.state + ", " + str(len(livyBatchQueue())) + " job(s) queued or running)\r\nPayload:\r\n" + json.dumps(data, indent=4),
+    })
+
+@azure_auth_required
+def getLivyBatches(request):
+    # State of the batch jobs of the user, the latest first
+    jobs = livyBatchQueue().list(livyBatchOwner(request))
+    for job in jobs:
+        if(job['batch_id'] is not None):
+            job['log_url'] = "/livyLog?" + urlencode({"batch_id": job['batch_id']})
+    return JsonResponse({'batches': jobs})
+
+@azure_auth_required
+def cancelLivyBatch(request):
+    job = livyBatchQueue().cancel(request.GET.get('id', ''), livyBatchOwner(request))
+    return render(request, 'display.html', {
+        "title": "Result of Livy batch cancellation",
+        "content": json.dumps(job.to_dict(), indent=4) if job else "Unknown batch job",
+    })
+
 @azure_auth_required
 def stopLivySession(request):      
     try:
         # Check Livy Session ID        
-        if(request.session.get('livy_session_id')):
-            livy_session_id = request.session.get('livy_session_id')
+        livy_session_id = livySessionId(request)
+        if(livy_session_id):
             
             livy_token = getLivyToken(request) 
-            livy = livyGetOrCreate(livy_token)
+            livy = livyGetOrCreate(request, livy_token)
             api_result = livy.delete_session(livy_session_id)
             api_result.raise_for_status()  # Check for HTTP errors
             
             # Clean session  (if result 200)
+            livySessionReaper().forget(livy_session_id)
+            results_key = livyResultsKey(request, livy_session_id)
+            livyOutputStore().discard_session(results_key)
+            livyResultCache().discard_session(results_key)
             cleanLivySession(request)
             
             return render(request, 'display.html', {
@@ -317,6 +712,279 @@ def stopLivySession(request):
             "content": JsonResponse({'status': 'error', 'message': str(e)}).content.decode('utf-8')
         })
       
+############ ASYNC VIEWS (served through asgi.py) ###################
+# httpx and the async Livy client are imported by the async views (and their client factory) themselves: a WSGI worker never loads them
+def azure_auth_required_async(view):
+    # azure_auth_required only wraps sync views: run its check (MSAL calls) in a thread and await the view
+    check = sync_to_async(azure_auth_required(lambda request, *args, **kwargs: None))
+
+    @wraps(view)
+    async def _wrapper(request, *args, **kwargs):
+        response = await check(request, *args, **kwargs)
+        if response is not None:
+            # Not authenticated, redirected to the login page
+            return response
+        try:
+            return await view(request, *args, **kwargs)
+        finally:
+            await livyAsyncRelease(request)
+    return _wrapper
+
+@azure_auth_required_async
+async def createLivySessionAsync(request):
+    import httpx
+    try:
+        # Get a Livy session ID
+        livy_session_id = await livySessionAid(request)
+        if(livy_session_id):
+            sessionExists = "Already exists, "
+        else:
+            # One Livy session per browser session across the worker processes (session registry)
+            claim = await sync_to_async(livySessionClaim)(request)
+            if(claim.session_id is not None):
+                # Started through another worker process
+                livy_session_id = claim.session_id
+                await livySessionAset(request, livy_session_id)
+                sessionExists = "Already exists, "
+            elif(not claim.reserved):
+                return render(request, 'display.html', {
+                    "title": "Result of Livy request session",
+                    "content": "The Livy session is being started by another request, please reload in a moment",
+                })
+            else:
+                try:
+                    livy_token = await sync_to_async(getLivyToken)(request)
+                    # Hand out a warm session from the session pool (if enabled)
+                    livy_session_id = await sync_to_async(livySessionPoolAcquire)(request, livy_token)
+                    if(livy_session_id is not None):
+                        await livySessionAset(request, livy_session_id)
+                        sessionExists = "From the session pool, "
+                    else:
+                        sessionExists = ""
+
+                        # Create a session
+                        livy = await livyAsyncGetOrCreate(request, livy_token)
+
+                        api_result = await livy.create_session(data=livySessionData())
+                        api_result.raise_for_status()  # Check for HTTP errors
+
+                        livy_session = model(api_result)
+                        if(livy_session.id is not None):
+                            livy_session_id = livy_session.id
+                            await livySessionAset(request, livy_session_id)
+                        else:
+                            return render(request, 'display.html', {
+                                "title": "Result of Livy request session",
+                                "content": "Livy Session ID: " +  "\r\nResult:" + str(api_result),
+                            })
+                finally:
+                    # Registered for the other worker processes, or the claim is given up (not created)
+                    await sync_to_async(livySessionClaimed)(request, livy_session_id)
+
+        await sync_to_async(livySessionTouch)(request, livy_session_id)
+        return render(request, 'display.html', {
+            "title": "Result of Livy request session",
+            "content": sessionExists + "Livy Session ID: " + str(livy_session_id),
+            "livy_session_id": livy_session_id
+        })
+    except LivySessionLimitError as e:
+        return render(request, 'display.html', {
+            "title": "Result of Livy request session",
+            "content": str(e),
+        })
+    except httpx.HTTPError as e:
+        return render(request, 'display.html', {
+            "title": "Result of Livy request session",
+            "content": JsonResponse({'status': 'error', 'message': str(e)}).content.decode('utf-8')
+        })
+
+@azure_auth_required_async
+async def checkLivySessionAsync(request):
+    import httpx
+    try:
+        # Check Livy Session ID
+        livy_session_id = await livySessionAid(request)
+        if(livy_session_id):
+
+            livy_token = await sync_to_async(getLivyToken)(request)
+            livy = await livyAsyncGetOrCreate(request, livy_token)
+            # Long-poll mode (?wait=seconds): wait server-side until the session is idle or terminated
+            wait = livyWaitSeconds(request)
+            if wait:
+                await livy.wait_for_session(livy_session_id, wait=wait)
+            api_result = await livy.get_session(livy_session_id)
+
+            livy_state_session = body(api_result)
+            api_result.raise_for_status()  # Check for HTTP errors
+
+            return render(request, 'display.html', {
+                "title": "Result of Livy check session",
+                "content": "Livy Session ID: " + str(livy_session_id) + "\r\nState:" + json.dumps(livy_state_session, indent=4),
+            })
+        else:
+            return render(request, 'display.html', {
+                "title": "Result of Livy check session",
+                "content": "No Livy Token and/or Livy session ID. Please Start Livy Session first"
+            })
+
+    except httpx.HTTPError as e:
+        return render(request, 'display.html', {
+            "title": "Result of Livy check session",
+            "content": JsonResponse({'status': 'error', 'message': str(e)}).content.decode('utf-8')
+        })
+
+@azure_auth_required_async
+async def submitLivyStatementAsync(request):
+    import httpx
+    livy_code = request.POST.get('livy_code', None)
+    try:
+        # Check Lvy Session ID
+        livy_session_id = await livySessionAid(request)
+        if(livy_session_id):
+
+            livy_token = await sync_to_async(getLivyToken)(request)
+            livy = await livyAsyncGetOrCreate(request, livy_token)
+            api_result = await livy.submit_statement(livy_session_id, livy_code)
+
+            livy_statement = body(api_result)
+            if('id' in livy_statement):
+                livy_statement_id = livy_statement['id']
+
+                #store statementIds in the Livy state (atomic append)
+                await livyState().aappend(await livyStateAscope(request), 'livy_statement_ids', livy_statement_id)
+
+                return render(request, 'display.html', {
+                    "title": "Result of Livy remote code execution",
+                    "content": "Livy Session ID: " + str(livy_session_id) + "\r\nStatement ID:" + str(livy_statement_id),
+                })
+            else:
+                return render(request, 'display.html', {
+                    "title": "Result of Livy remote code execution",
+                    "content": "Livy Session ID: " + str(livy_session_id) + "\r\nResult:" + str(api_result),
+                })
+        else:
+            return render(request, 'display.html', {
+                "title": "Result of Livy remote code execution",
+                "content": "No Livy Token and/or Livy session ID. Please Start Livy Session first"
+            })
+
+    except httpx.HTTPError as e:
+        return render(request, 'display.html', {
+            "title": "Result of Livy remote code execution",
+            "content": JsonResponse({'status': 'error', 'message': str(e)}).content.decode('utf-8')
+        })
+
+@azure_auth_required_async
+async def getLivyStatementAsync(request):
+    import httpx
+    statement_id = request.GET.get('id', None)
+    try:
+        # Check Livy Session ID
+        livy_session_id = await livySessionAid(request)
+        if(livy_session_id):
+
+            results_key = await sync_to_async(livyResultsKey)(request, livy_session_id)
+            # Finished statements never change: served from the result cache without calling Livy
+            rendered = await sync_to_async(livyCachedResult)(results_key, statement_id)
+            if rendered is not None:
+                await sync_to_async(livySessionTouch)(request, livy_session_id)
+            else:
+                livy_token = await sync_to_async(getLivyToken)(request)
+                livy = await livyAsyncGetOrCreate(request, livy_token)
+                # Long-poll mode (?wait=seconds): wait server-side until the result is ready
+                wait = livyWaitSeconds(request)
+                if wait:
+                    api_result = await livy.wait_for_statement(livy_session_id, statement_id, wait=wait)
+                else:
+                    api_result = await livy.get_statement(livy_session_id, statement_id)
+
+                api_result.raise_for_status()  # Check for HTTP errors
+                # Spilling large outputs writes files: out of the event loop
+                livy_result = await sync_to_async(livyStatementResult)(results_key, statement_id, body(api_result))
+                rendered = await sync_to_async(livyResultPage)(results_key, statement_id, livy_result)
+            result, links = rendered
+
+            return render(request, 'display.html', {
+                "title": "Result of Livy Statement:" + str(statement_id),
+                "content": "Livy Session ID: " + str(livy_session_id) + "\r\nResult:\r\n" + result,
+                "links": links,
+            })
+        else:
+            return render(request, 'display.html', {
+                "title": "Result of Livy Statement:" + str(statement_id),
+                "content": "No Livy Token and/or Livy session ID. Please Start Livy Session first"
+            })
+
+    except httpx.HTTPError as e:
+        return render(request, 'display.html', {
+            "title": "Result of Livy check session",
+            "content": JsonResponse({'status': 'error', 'message': str(e)}).content.decode('utf-8')
+        })
+
+@azure_auth_required_async
+async def streamLivyStatementsAsync(request):
+    # Async variant of streamLivyStatements: the events are awaited, no worker thread is held per open page
+    watch = await sync_to_async(livyStatementWatch)(request)
+    if(watch is None):
+        return HttpResponse("No Livy session ID. Please Start Livy Session first", status=400)
+
+    async def events():
+        # Subscribed from the loop consuming the stream: under WSGI, it is not the loop which ran the view
+        subscription = livyStatementPoller().subscribe(*watch, loop=asyncio.get_running_loop())
+        deadline = time.monotonic() + config.livy_statement_stream_max_seconds
+        try:
+            while subscription.pending and time.monotonic() < deadline:
+                event = await subscription.aget(timeout=min(15, max(0, deadline - time.monotonic())))
+                yield "data: " + json.dumps(event) + "\n\n" if event is not None else ": keep-alive\n\n"
+            yield livyStatementStreamEnd(subscription)
+        finally:
+            subscription.close()
+
+    return livyEventStream(events())
+
+@azure_auth_required_async
+async def stopLivySessionAsync(request):
+    import httpx
+    try:
+        # Check Livy Session ID
+        livy_session_id = await livySessionAid(request)
+        if(livy_session_id):
+
+            livy_token = await sync_to_async(getLivyToken)(request)
+            livy = await livyAsyncGetOrCreate(request, livy_token)
+            api_result = await livy.delete_session(livy_session_id)
+            api_result.raise_for_status()  # Check for HTTP errors
+
+            # Clean session  (if result 200)
+            livySessionReaper().forget(livy_session_id)
+            results_key = await sync_to_async(livyResultsKey)(request, livy_session_id)
+            livyOutputStore().discard_session(results_key)
+            livyResultCache().discard_session(results_key)
+            await sync_to_async(cleanLivySession)(request)
+
+            return render(request, 'display.html', {
+                "title": "Result of Livy delete session",
+                "content": "Livy Session ID: " + str(livy_session_id) + "\r\nAPI result:\r\n" + str(api_result),
+            })
+        else:
+            return render(request, 'display.html', {
+                "title": "Result of Livy delete session",
+                "content": "No Livy Token and/or Livy session ID. Please Start Livy Session first"
+            })
+
+    except httpx.HTTPError as e:
+        return render(request, 'display.html', {
+            "title": "Result of Livy delete session",
+            "content": JsonResponse({'status': 'error', 'message': str(e)}).content.decode('utf-8')
+        })
+############ END ASYNC VIEWS ###################
+
+def livyMetrics(request):
+    # Prometheus scrape endpoint: no user login, protected by a bearer token when LIVY_METRICS_TOKEN is set
+    if(config.livy_metrics_token and request.headers.get('Authorization') != "Bearer " + config.livy_metrics_token):
+        return HttpResponse("Unauthorized", status=401)
+    return HttpResponse(livyCallMetrics().render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 @azure_auth_required
 def logout(request):    
     # Stop the Livy Session - stopLivySession
@@ -334,53 +1002,512 @@ def logout(request):
 
 def getLivyToken(request):
     try:
-        # Get a Livy Token
-        if(request.session.get('livy_token') and 
-           request.session.get('livy_token_expiration_time') and 
-           int((datetime.strptime(request.session.get('livy_token_expiration_time'), "%Y-%m-%d %H:%M:%S") - datetime.now()).total_seconds()) > 0):
-            
-            # Token is still valid
-            livy_token = request.session.get('livy_token')             
-        else: # Request new token
-            if livy_backend == "apache":
-                livy_token = "dummy_token"  # For Local Apache Livy, we can use a dummy token
-                token_expires_in = 9999
-            else: # Fabric livy_backend
-                # TODO: Handle the case when the livy_backend is not in ("apache", "fabric")
-                accounts = AuthHandler(request).msal_app.get_accounts()
-                fabric_result = AuthHandler(request).msal_app.acquire_token_silent(
-                        scopes=["https://api.fabric.microsoft.com/.default"], account=accounts[0]
-                    )
-                livy_token = fabric_result['access_token']
-                token_expires_in = fabric_result['expires_in']
-            
-            request.session['livy_token'] = livy_token
-            request.session['livy_token_expiration_time'] = (datetime.now() + timedelta(seconds=int(token_expires_in))).strftime("%Y-%m-%d %H:%M:%S")
-            
-            # delete the livy global variable to reinitialize it with the new token
-            if 'livy' in globals():
-                del globals()['livy']
-                      
+        # Get a Livy Token, from the in-process token cache (refreshed ahead of expiry)
+        livy_token, livy_token_expiration_time = livyTokens().get_token(
+            (config.livy_backend, livyIdentity(request)), livyTokenAcquirer(request)
+        )
+        # Keep a copy in the Livy state for display, only written when the token changed
+        if(livyStateGet(request, 'livy_token') != livy_token):
+            livyState().set_many(livyStateScope(request), {
+                'livy_token': livy_token, 'livy_token_expiration_time': livy_token_expiration_time,
+            })
+
         return livy_token
-    except requests.exceptions.RequestException as e:
-        # production - use logs
-        print("Error getting Livy/Fabric token:", str(e))
+    except (requests.exceptions.RequestException, LivyTokenError) as e:
+        logger.warning("Error getting Livy/Fabric token: %s", e)
         return None
-            
+
+def livyTokenAcquirer(request):
+    # Callable requesting a new Livy token, returning (token, expires_in). It may run in
+    # the background, after the request: it only relies on the MSAL app and account
+    if config.livy_backend == "apache":
+        return lambda: ("dummy_token", 9999)  # For Local Apache Livy, we can use a dummy token
+
+    # Fabric config.livy_backend
+    # TODO: Handle the case when the config.livy_backend is not in ("apache", "fabric")
+    auth = get_auth_context(request)
+    msal_app = auth.msal_app
+    save_token_cache = livyTokenCacheSaver(request, msal_app)
+    def acquire():
+        account = auth.account
+        if not account:
+            raise LivyTokenError("No MSAL account")
+        # From the MSAL cache while the cached token is valid, else redeemed with the refresh token
+        fabric_result = msal_app.acquire_token_silent(
+            scopes=["https://api.fabric.microsoft.com/.default"], account=account
+        )
+        save_token_cache()
+        if not fabric_result or 'access_token' not in fabric_result:
+            raise LivyTokenError(fabric_result.get('error_description') if fabric_result else "No token")
+        return fabric_result['access_token'], fabric_result['expires_in']
+    return acquire
+
+def livyTokenCacheSaver(request, msal_app):
+    # Callable writing the MSAL token cache back to the user's Django session when a token call changed it,
+    # so the other workers and the next requests start from the refreshed tokens: into request.session from
+    # the request's thread, into the stored session from a background refresh (the request may be over)
+    token_cache = getattr(msal_app, 'token_cache', None)
+    request_thread = threading.current_thread()
+    session_key = livySessionKey(request)
+    def save():
+        if token_cache is None or not token_cache.has_state_changed:
+            return
+        if threading.current_thread() is request_thread:
+            request.session['token_cache'] = token_cache.serialize()
+            return
+        try:
+            session = import_module(settings.SESSION_ENGINE).SessionStore(session_key=session_key)
+            session['token_cache'] = token_cache.serialize()
+            if session.session_key == session_key:
+                # Not when the session is gone (logged out): loading it gave up its key
+                session.save()
+        except Exception as e:
+            logger.warning("Error saving the MSAL token cache: %s", e)
+    return save
+
+def livyTokenExpiresIn(livy_token_expiration_time):
+    # Seconds before the Livy token expires (UNIX timestamp stored by getLivyToken)
+    if not isinstance(livy_token_expiration_time, (int, float)):
+        return None
+    return str(int(livy_token_expiration_time - time.time()))
+
 def cleanLivySession(request):
-    request.session['livy_session_id'] = None  
-    request.session['livy_statement_ids'] = None
+    livySessionRegistry().release(config.livy_backend, scope=livySessionKey(request))
+    livyState().delete(livyStateScope(request), 'livy_session_id', 'livy_session_started', 'livy_statement_ids')
     
 def cleanLivyToken(request):
-    request.session['livy_token'] = None
-    request.session['livy_token_expiration_time'] = None
+    livyTokens().discard((config.livy_backend, livyIdentity(request)))
+    livyState().delete(livyStateScope(request), 'livy_token', 'livy_token_expiration_time')
     
-def livyGetOrCreate(access_token):
-    global livy
-    # Check if livy is already initialized
-    if 'livy' in globals():
-        return livy
+def splitLivyCells(code):
+    # Split a notebook-style script on its "# %%" cell markers, dropping the empty cells
+    cells, cell = [], []
+    for line in code.splitlines():
+        if line.strip().startswith("# %%"):
+            cells.append("\n".join(cell))
+            cell = []
+        else:
+            cell.append(line)
+    cells.append("\n".join(cell))
+    return [cell for cell in cells if cell.strip()]
+
+def livyRunCells(request, livy_session_id, livy_cells, after):
+    # Run the next cells of a notebook from a background thread: each cell is submitted once the previous one
+    # (`after` first) ended ok, and its statement ID is added to the user's statements when submitted
+    client = livyBackgroundClient(request)
+    scope = livySessionKey(request)  # The request is over when the cells are submitted
+
+    @in_background
+    def run():
+        try:
+            failed = client().run_cells(livy_session_id, livy_cells, after=after,
+                                        on_submit=lambda statement_id: livyState().append(scope, 'livy_statement_ids', statement_id))
+        except requests.exceptions.RequestException as e:
+            logger.warning("Error submitting the cells of Livy session %s: %s", livy_session_id, e)
+            return
+        if failed is not None:
+            logger.info("Cells of Livy session %s stopped at statement %s", livy_session_id, failed)
+
+    threading.Thread(target=run, name="livy-cells", daemon=True).start()
+
+def livyStatementSummary(livy_statement, statement_id):
+    # Compact view of a statement: state, progress and (truncated) plain text output
+    if livy_statement is None:
+        return {'id': statement_id, 'state': None}
+    output = livy_statement.get('output') or {}
+    text = (output.get('data') or {}).get('text/plain')
+    if output.get('status') == 'error':
+        text = str(output.get('ename')) + ": " + str(output.get('evalue'))
+    summary = {
+        'id': livy_statement.get('id'),
+        'state': livy_statement.get('state'),
+        'progress': livy_statement.get('progress'),
+        'status': output.get('status'),
+    }
+    if text is not None:
+        summary['output'] = text[:config.livy_bulk_output_max_chars]
+        summary['truncated'] = len(text) > config.livy_bulk_output_max_chars
+    return summary
+
+def livyWaitSeconds(request):
+    # Long-poll duration requested with ?wait=seconds, capped by LIVY_WAIT_MAX_SECONDS
+    try:
+        wait = float(request.GET.get('wait', 0))
+    except ValueError:
+        return 0
+    return max(0, min(wait, config.livy_wait_max_seconds))
+
+def livyEventStream(events):
+    # Server-sent events response, not buffered by the proxies
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def livyStatementWatch(request):
+    # Arguments of livyStatementPoller().subscribe for the statements of the request (?id=..., else all the tracked ones),
+    # or None without a Livy session
+    livy_session_id = livySessionId(request)
+    if(livy_session_id is None):
+        return None
+    statement_ids = [id for id in request.GET.getlist('id') if id.isdigit()] or livyState().get_list(livyStateScope(request), 'livy_statement_ids')
+    livySessionTouch(request, livy_session_id)
+    return livyResultsKey(request, livy_session_id), livy_session_id, statement_ids, livyBackgroundClient(request)
+
+def livyStatementStreamEnd(subscription):
+    # Last event of a statements stream
+    if(subscription.pending):
+        return "event: end\ndata: Stream duration limit reached, reload the page to follow the statements again\n\n"
+    if(subscription.failed):
+        return ("event: end\ndata: All the statements finished, in error or cancelled: "
+                + ", ".join(str(statement_id) for statement_id in sorted(subscription.failed)) + "\n\n")
+    return "event: end\ndata: All the statements finished\n\n"
+
+def livyResultsKey(request, livy_session_id):
+    # Prefix of the keys of the cached results and spilled outputs of the user's Livy session. Livy reuses the
+    # session IDs after a restart: the key also holds the owner and the time the session was set for the user
+    return (config.livy_backend, livySessionOwner(request), livyStateGet(request, 'livy_session_started'), str(livy_session_id))
+
+def livyOutputKey(results_key, statement_id):
+    # Key of the cached result and spilled outputs of a statement
+    return results_key + (str(statement_id),)
+
+def livyReadStatement(livy, livy_session_id, statement_id):
+    # GET a statement with its body read in chunks (spooled to disk when large) rather than buffered whole
+    api_result = livy.get_statement(livy_session_id, statement_id, stream=True)
+    with api_result:
+        api_result.raise_for_status()  # Check for HTTP errors
+        return read_json(api_result)
+
+def livyStatementResult(results_key, statement_id, livy_statement):
+    # What the result page of a statement is made of: {'data': output data, large values spilled to disk}
+    # for an available statement with an output, else {'statement': statement}. Cached once the statement finished
+    output_data = (livy_statement.get('output') or {}).get('data')
+    if(livy_statement.get('state') == "available" and output_data is not None):
+        # Large outputs are spilled to disk: only the inline values and the spill references are kept
+        livy_result = {'data': livyOutputStore().put_output(livyOutputKey(results_key, statement_id), output_data)}
+    else:
+        livy_result = {'statement': livy_statement}
+    if(livy_statement.get('state') in STATEMENT_TERMINAL_STATES):
+        livyResultCache().put(livyOutputKey(results_key, statement_id), livy_result)
+    return livy_result
+
+def livyCachedResult(results_key, statement_id):
+    # (result, links) of a cached finished statement, or None (not cached, or its spilled outputs were evicted)
+    key = livyOutputKey(results_key, statement_id)
+    livy_result = livyResultCache().get(key)
+    if(livy_result is None):
+        return None
+    if('data' in livy_result and not all(livyOutputStore().has(key, mime) for mime, value in livy_result['data'].items() if isinstance(value, tuple))):
+        return None
+    return livyResultPage(results_key, statement_id, livy_result)
+
+def livyResultPage(results_key, statement_id, livy_result):
+    # (result, links) of the result page of a statement: first page of its plain text output
+    if('data' in livy_result):
+        return livyOutputPage(results_key, statement_id, livy_result['data'], 'text/plain', 1)
+    return json.dumps(livy_result['statement'], indent=4), []
+
+def livyOutputPage(results_key, statement_id, data, mime, page):
+    # Page `page` (LIVY_OUTPUT_PAGE_SIZE bytes) of the `mime` output, and the links to the other pages and outputs
+    links = []
+    value = data.get(mime)
+    if isinstance(value, tuple):
+        size = value[1]
+        pages = max(1, -(-size // config.livy_output_page_size))
+        page = min(page, pages)
+        chunk = livyOutputStore().read(livyOutputKey(results_key, statement_id), mime, (page - 1) * config.livy_output_page_size, config.livy_output_page_size)
+        # Pages are cut by bytes: drop the partial characters at the edges
+        content = (chunk or b"").decode("utf-8", errors="ignore")
+        if page > 1:
+            links.append({"label": "Previous page", "url": livyOutputUrl(statement_id, mime, page=page - 1)})
+        if page < pages:
+            links.append({"label": "Next page (" + str(page + 1) + "/" + str(pages) + ")", "url": livyOutputUrl(statement_id, mime, page=page + 1)})
+    elif isinstance(value, str):
+        content = value
     else:
-        # Initialize livy with the provided parameters
-        livy = ApacheLivy(base_url=livy_base_url, access_token=access_token, timeout=int(livy_requests_timeout))
-        return livy
+        content = json.dumps(value if value is not None else {m: v for m, v in data.items() if not isinstance(v, tuple)}, indent=4)
+    for other_mime, other_value in data.items():
+        if isinstance(other_value, tuple):
+            links.append({"label": "Download " + other_mime + " (" + str(other_value[1]) + " bytes)", "url": livyOutputUrl(statement_id, other_mime, download=1)})
+    return content, links
+
+def livyOutputUrl(statement_id, mime, **params):
+    return "/getLivyStatementOutput?" + urlencode({"id": statement_id, "mime": mime, **params})
+
+def livyOutputFileResponse(request, key, mime, entry):
+    # Stream a spilled output, whole or the single byte range asked with a Range header
+    content_type, size = entry
+    f = livyOutputStore().open(key, mime)
+    if f is None:
+        return HttpResponse("Output expired, please reload the statement", status=404)
+    range_match = re.match(r"bytes=(\d*)-(\d*)$", request.headers.get('Range', ''))
+    if range_match and any(range_match.groups()):
+        start, end = range_match.groups()
+        if start:
+            start, end = int(start), min(int(end), size - 1) if end else size - 1
+        else:
+            start, end = max(0, size - int(end)), size - 1
+        if start > end:
+            f.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = "bytes */" + str(size)
+            return response
+        f.seek(start)
+        response = StreamingHttpResponse(livyFileChunks(f, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = "bytes %d-%d/%d" % (start, end, size)
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        filename = "livy-statement-" + key[-1] + (mimetypes.guess_extension(content_type.split(";")[0]) or "")
+        response = FileResponse(f, content_type=content_type, as_attachment=True, filename=filename)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+def livyFileChunks(f, length, chunk_size=64 * 1024):
+    # Read `length` bytes of `f` by chunks, closing it at the end
+    with f:
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+def livySessionData():
+    # Payload used to create a Livy session
+    return {
+        # Ideally, use unique session name
+        "name": config.livy_session_name_prefix + datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "kind": "pyspark",
+        "archives": [],
+        # Adding dependencies to the driver and executors using pyFiles. Other possible options for Fabric is to use an EnvironmentID
+        "pyFiles": config.livy_backend_spark_dependencies.split(',') if config.livy_backend_spark_dependencies else [],
+        "conf": dict(config.livy_spark_conf),
+        # Uncomment if you would like to enable minimum values on Fabric side
+        # Driver memory-Fabric: 7g, 14g, 28g, 56g, 112g, 224g, 200g, 400g
+        #"driverMemory": "7g",
+        #"driverCores": 1,
+        # Executor memory-Fabric: 7g, 14g, 28g, 56g, 112g, 224g, 200g, 400g
+        #"executorMemory": "7g",
+        #"executorCores": 1,
+        #"numExecutors": 1,
+        #"idleTimeout" : "10m", # Not working
+        #"ttl": "10m", # Not working
+    }
+
+def livyBatchData(file, class_name, args):
+    # Payload used to create a Livy batch
+    data = {
+        "name": config.livy_session_name_prefix + "batch-" + datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "file": file,
+        "args": [arg for arg in args if arg.strip()],
+        "pyFiles": config.livy_backend_spark_dependencies.split(',') if config.livy_backend_spark_dependencies else [],
+        "conf": dict(config.livy_spark_conf),
+    }
+    if class_name:
+        data["className"] = class_name  # Main class of a .jar
+    return data
+
+def livyBatchOwner(request):
+    # Owner of the batch jobs, for the per-user cap and listing
+    return request.user.get_username()
+
+def livyBatchOwned(request, batch_id):
+    # Whether the Livy batch `batch_id` is the batch of one of the user's jobs
+    return any(str(job['batch_id']) == str(batch_id) for job in livyBatchQueue().list(livyBatchOwner(request))
+               if job['batch_id'] is not None)
+
+def livyBackgroundClient(request):
+    # Client of the background work of the user (batch jobs, session reaper): it outlives the request
+    # (and the token), so the token is taken from the token manager at each call, refreshed with the user's MSAL account
+    key = (config.livy_backend, livyIdentity(request))
+    acquire = livyTokenAcquirer(request)
+    return lambda: livyClients().get(key, livyTokens().get_token(key, acquire)[0])
+
+def livySessionTouch(request, livy_session_id):
+    # Record an activity on the Livy session, for the session registry (heartbeat) and the idle session reaper
+    if livy_session_id is None:
+        return
+    livySessionRegistry().heartbeat(config.livy_backend, livy_session_id)
+    if config.livy_session_idle_ttl <= 0:
+        return
+    livySessionReaper().touch((config.livy_backend, livyIdentity(request)), livy_session_id,
+                              livyBackgroundClient(request),
+                              on_reap=livySessionReaped(livySessionKey(request), livyResultsKey(request, livy_session_id)))
+
+def livySessionReaped(scope, results_key):
+    # Callback of the reaper: forget the reaped Livy session in the user's Livy state (and its spilled outputs)
+    def on_reap(livy_session_id):
+        livyOutputStore().discard_session(results_key)
+        livyResultCache().discard_session(results_key)
+        if str(livyState().get(scope, 'livy_session_id')) == str(livy_session_id):
+            livyState().delete(scope, 'livy_session_id', 'livy_session_started', 'livy_statement_ids')
+    return on_reap
+
+def livySessionOwner(request):
+    # Owner of the Livy sessions, for the per-user cap of the session registry
+    return request.user.get_username()
+
+def livySessionClaim(request):
+    # Livy session of the browser session registered by any worker process, or a reservation to create it
+    return livySessionRegistry().claim(config.livy_backend, livySessionKey(request), livySessionOwner(request))
+
+def livySessionClaimed(request, livy_session_id):
+    # Register the session created for the reservation of livySessionClaim, or give the reservation up
+    if livy_session_id is None:
+        livySessionRegistry().release(config.livy_backend, scope=livySessionKey(request))
+    else:
+        livySessionRegistry().activate(config.livy_backend, livySessionKey(request), livy_session_id)
+
+def livySessionPooled(livy_session_id):
+    # Warm sessions of the session pools are idle by design, and expired by the pools themselves
+    with livy_session_pools_lock:
+        pools = list(livy_session_pools.values())
+    return any(livy_session_id in pool for pool in pools)
+
+def livySessionKey(request):
+    # Key of the Django session (created if needed): scope of the session registry, and of the Livy state
+    # in background work, which outlives the request
+    if request.session.session_key is None:
+        request.session.save()
+    return request.session.session_key
+
+def livyStateScope(request):
+    # Scope of the user's values in the Livy state from a view: the Django session itself (saved with the
+    # response) with the session store, else the Django session key
+    if config.livy_state_store == "session":
+        return request.session
+    return livySessionKey(request)
+
+async def livyStateAscope(request):
+    if config.livy_state_store == "session":
+        return request.session
+    if request.session.session_key is None:
+        await request.session.asave()
+    return request.session.session_key
+
+def livySessionSet(request, livy_session_id):
+    # Livy session of the user, with the time it was set for the user (see livyResultsKey)
+    livyState().set_many(livyStateScope(request), {'livy_session_id': livy_session_id, 'livy_session_started': time.time()})
+
+async def livySessionAset(request, livy_session_id):
+    await livyState().aset_many(await livyStateAscope(request), {'livy_session_id': livy_session_id, 'livy_session_started': time.time()})
+
+def livySessionId(request):
+    # Livy session of the user: in the Livy state, else the one registered for the browser session
+    # (started through another worker process with LIVY_STATE_STORE=memory), which is adopted
+    livy_session_id = livyStateGet(request, 'livy_session_id')
+    if livy_session_id is None and request.session.session_key is not None:
+        livy_session_id = livySessionRegistry().session(config.livy_backend, request.session.session_key)
+        if livy_session_id is not None:
+            livySessionSet(request, livy_session_id)
+    return livy_session_id
+
+async def livySessionAid(request):
+    livy_session_id = await livyStateAget(request, 'livy_session_id')
+    if livy_session_id is None and request.session.session_key is not None:
+        livy_session_id = await sync_to_async(livySessionRegistry().session)(config.livy_backend, request.session.session_key)
+        if livy_session_id is not None:
+            await livySessionAset(request, livy_session_id)
+    return livy_session_id
+
+def livyStateGet(request, name):
+    return livyState().get(livyStateScope(request), name)
+
+def livyStateSet(request, name, value):
+    livyState().set(livyStateScope(request), name, value)
+
+async def livyStateAget(request, name):
+    return await livyState().aget(await livyStateAscope(request), name)
+
+async def livyStateAset(request, name, value):
+    await livyState().aset(await livyStateAscope(request), name, value)
+
+def graphUserKey(request):
+    # Key of the user in the Graph cache
+    account = get_auth_context(request).account
+    return account["home_account_id"] if account else get_auth_context(request).claims.get("oid")
+
+def livyIdentity(request):
+    # Identity the Livy calls are made with: Livy sessions must not be shared across identities
+    if config.livy_backend == "apache":
+        return "apache"
+    account = get_auth_context(request).account
+    return account["home_account_id"] if account else None
+
+def livySessionPoolGetOrCreate(request, access_token):
+    # One pool of warm sessions per identity, started with the current token
+    if config.livy_session_pool_size <= 0 or not access_token:
+        return None
+    # Pooled sessions are out of the per-user cap (LIVY_MAX_SESSIONS_PER_USER): the pools are bounded
+    # instead, at most LIVY_SESSION_POOL_SIZE x LIVY_SESSION_POOL_MAX_POOLS warm sessions per worker process
+    identity = livyIdentity(request)
+    evicted = None
+    with livy_session_pools_lock:
+        pool = livy_session_pools.get(identity)
+        if pool is None:
+            # The pool outlives the request: its client takes a fresh token at each call (expiry, deletion)
+            pool = LivySessionPool(
+                livyBackgroundClient(request),
+                livySessionData, size=config.livy_session_pool_size, idle_ttl=config.livy_session_pool_idle_ttl
+            )
+            livy_session_pools[identity] = pool
+            if len(livy_session_pools) > config.livy_session_pool_max_pools:
+                _, evicted = livy_session_pools.popitem(last=False)
+        else:
+            livy_session_pools.move_to_end(identity)
+    if evicted is not None:
+        # Its warm sessions are deleted in the background
+        threading.Thread(target=evicted.close, name="livy-session-pool-close", daemon=True).start()
+    pool.replenish()
+    return pool
+
+def livySessionPoolAcquire(request, access_token):
+    # ID of a warm session from the pool, or None if the pool is disabled or empty
+    pool = livySessionPoolGetOrCreate(request, access_token)
+    return pool.acquire() if pool else None
+
+def livyClientFactory(access_token):
+    return ApacheLivy(base_url=config.livy_base_url, access_token=access_token, timeout=config.livy_requests_timeout,
+                      pool_connections=config.livy_pool_connections, pool_maxsize=config.livy_pool_maxsize,
+                      max_retries=config.livy_max_retries, scheduler=livyScheduler(), metrics=livyCallMetrics(),
+                      hedger=livyHedger(), breaker=livyBreaker(), compress_min_bytes=config.livy_compress_min_bytes)
+
+@service
+def livyClients():
+    return LivyClientRegistry(livyClientFactory, max_size=config.livy_client_registry_size)
+
+def livyAsyncClientFactory(access_token):
+    from myapp.api.async_apache_livy import AsyncApacheLivy
+    return AsyncApacheLivy(base_url=config.livy_base_url, access_token=access_token, timeout=config.livy_requests_timeout,
+                           max_connections=config.livy_async_max_connections, max_retries=config.livy_max_retries, metrics=livyCallMetrics(),
+                           compress_min_bytes=config.livy_compress_min_bytes)
+
+async def livyAsyncGetOrCreate(request, access_token):
+    # An httpx.AsyncClient is bound to its event loop: keep one async registry per running loop
+    # (a single one under an ASGI server, one per request when async views run under WSGI, closed by livyAsyncRelease)
+    loop = asyncio.get_running_loop()
+    registry = livy_async_clients.get(loop)
+    if registry is None:
+        registry = LivyClientRegistry(livyAsyncClientFactory, max_size=config.livy_client_registry_size,
+                                      on_evict=lambda client: loop.create_task(client.aclose()))
+        livy_async_clients[loop] = registry
+    identity = await sync_to_async(livyIdentity)(request)
+    await sync_to_async(livySessionTouch)(request, await livySessionAid(request))
+    return registry.get((config.livy_backend, identity), access_token)
+
+async def livyAsyncRelease(request):
+    # Under WSGI each async view runs on an event loop of its own, which ends with the view: close the clients of the
+    # loop (and their connections) now. Under an ASGI server the loop, and its clients, serve the next requests
+    if isinstance(request, ASGIRequest):
+        return
+    registry = livy_async_clients.pop(asyncio.get_running_loop(), None)
+    if registry is not None:
+        await registry.aclose()
+
+def livyGetOrCreate(request, access_token):
+    # One client (and connection pool) per backend and identity, with its token rotated in place.
+    # Getting the client is using the current Livy session (resolved through the session registry when the Livy state
+    # has none): record the activity for the registry and the reaper
+    livySessionTouch(request, livySessionId(request))
+    return livyClients().get((config.livy_backend, livyIdentity(request)), access_token)
@@ -0,0 +1,95 @@
+"""
+Fixtures of the tests of the Livy layer (myapp/api), run against the fake Livy server.
+
+The views are tested through the Django test client against one fake Livy server and
+the fake token provider, configured once for the whole run like benchmark.py does
+(`app_server`); each `client` is a new user, logged in.
+
+Usage (from the folder of manage.py):
+    python -m pytest tests
+"""
+import argparse
+import itertools
+import time
+
+import pytest
+
+import benchmark
+from myapp.api.apache_livy import ApacheLivy
+from myapp.fakes.fake_livy_server import FakeLivyServer
+
+_users = itertools.count()
+
+
+@pytest.fixture
+def server():
+    with FakeLivyServer(session_start_time=0.1, statement_time=0.05, batch_time=0.3, seed=0) as server:
+        yield server
+
+
+@pytest.fixture
+def livy(server):
+    client = ApacheLivy(server.url, access_token="fake-token", timeout=5, max_retries=0)
+    yield client
+    client.close()
+
+
+@pytest.fixture(scope="session")
+def app_server():
+    with FakeLivyServer(session_start_time=0.1, statement_time=0.05, batch_time=0.3, seed=0) as server:
+        benchmark.configure(argparse.Namespace(backend="apache", state_store="session", state_cache_url=None), server)
+        from myapp.fakes.fake_msal import FakeMsalApp, install
+        uninstall = install(FakeMsalApp(seed=0))
+        yield server
+        uninstall()
+
+
+@pytest.fixture
+def msal_app(app_server):
+    """FakeMsalApp, to create fake MSAL applications (their module needs the Django settings)."""
+    from myapp.fakes.fake_msal import FakeMsalApp
+    return FakeMsalApp
+
+
+@pytest.fixture
+def client(app_server):
+    app_server.error_rate = 0
+    return benchmark.login("-test-" + str(next(_users)))
+
+
+def wait_until(predicate, timeout=5, interval=0.02):
+    """Wait for `predicate()` to be true, failing the test after `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            pytest.fail("Condition not met within " + str(timeout) + "s")
+        time.sleep(interval)
+
+
+def idle_session(livy, data=None):
+    """ID of a new Livy session, once idle."""
+    session_id = livy.create_session(data or {"kind": "pyspark"}).json()["id"]
+    wait_until(lambda: livy.get_session_state(session_id).json()["state"] == "idle")
+    return session_id
+
+
+def started_session(client):
+    """ID of the Livy session of a new logged in user, once idle."""
+    assert client.get("/createLivySession").status_code == 200
+    assert b"idle" in client.get("/checkLivySession", {"wait": 5}).content
+    from myapp.views import livyState
+    return livyState().get(client.session.session_key, "livy_session_id")
+
+
+def stream_events(response, count):
+    """The first `count` events of a server-sent events response, as {"id", "event", "data"} dicts."""
+    content = benchmark.read_stream(response, count).decode()
+    events = []
+    for block in content.split("\n\n")[:count]:
+        fields = {}
+        for line in block.splitlines():
+            name, _, value = line.partition(": ")
+            fields[name] = fields[name] + "\n" + value if name in fields else value
+        if fields and set(fields) != {""}:
+            events.append(fields)
+    return events
@@ -0,0 +1,292 @@
+import json
+import time
+
+import pytest
+import requests
+
+from myapp.api.apache_livy import ApacheLivy
+from myapp.api.livy_circuit_breaker import LivyCircuitBreaker, LivyCircuitOpenError
+from myapp.api.livy_hedging import LivyHedger
+from myapp.api.livy_metrics import LivyMetrics
+from myapp.api.livy_models import Session
+from myapp.api.livy_output_store import read_json
+from myapp.api.livy_scheduler import LivyRequestScheduler
+
+from conftest import idle_session, wait_until
+
+
+def test_run_cells_stops_at_the_failing_cell(server, livy):
+    session_id = idle_session(livy)
+    submitted = []
+
+    stopped_at = livy.run_cells(session_id, ["1 + 1", "raise ValueError()", "2 + 2"], on_submit=submitted.append,
+                                poll_interval=0.01, max_poll_interval=0.05)
+
+    assert stopped_at == 1
+    assert submitted == [0, 1]
+    assert len(server.sessions[session_id]["statements"]) == 2
+
+
+def test_run_cells_all_ok(livy):
+    session_id = idle_session(livy)
+
+    assert livy.run_cells(session_id, ["1", "2"], poll_interval=0.01, max_poll_interval=0.05) is None
+
+
+def test_run_cells_raises_on_rejected_submission(server, livy):
+    session_id = idle_session(livy)
+    server.error_rate, server.error_status = 1, 400
+
+    with pytest.raises(requests.HTTPError):
+        livy.run_cells(session_id, ["1"])
+
+
+def test_typed_client_returns_models_and_raises_on_errors(server):
+    livy = ApacheLivy(server.url, access_token="fake-token", max_retries=0, typed=True)
+    session = livy.create_session({"kind": "pyspark"})
+
+    assert isinstance(session, Session)
+    with pytest.raises(requests.HTTPError):
+        livy.get_session(999)
+    assert isinstance(livy.get_statement(session.id, 0, stream=True), requests.Response)
+
+
+def test_read_json_streams_large_bodies(server, livy):
+    server.output_size = 200000
+    session_id = idle_session(livy)
+    livy.submit_statement(session_id, "spark.range(10).show()")
+    livy.wait_for_statement(session_id, 0, poll_interval=0.01)
+
+    expected = livy.get_statement(session_id, 0).json()
+    # Parsed as it arrives (above max_memory), cut in small chunks
+    statement = read_json(livy.get_statement(session_id, 0, stream=True), chunk_size=7, max_memory=1024)
+
+    assert statement == expected
+    assert len(statement["output"]["data"]["text/plain"]) == 200000
+
+
+@pytest.mark.parametrize("text", ['{"a": [1, 2.5, -3e2, true, false, null], "b": "x\\"y\\\\", "c": {}}', '[]', '"\\u00e9t\\u00e9"'])
+def test_read_json_chunk_boundaries(text):
+    class Response:
+        encoding = None
+
+        def iter_content(self, chunk_size):
+            data = text.encode()
+            return (data[i:i + chunk_size] for i in range(0, len(data), chunk_size))
+
+    for chunk_size in (1, 2, 3, 5):
+        assert read_json(Response(), chunk_size=chunk_size, max_memory=0) == json.loads(text)
+
+
+def test_read_json_rejects_truncated_bodies():
+    class Response:
+        encoding = None
+
+        def iter_content(self, chunk_size):
+            return iter([b'{"a": [1, 2', b''])
+
+    with pytest.raises(ValueError):
+        read_json(Response(), chunk_size=4, max_memory=0)
+
+
+def test_circuit_breaker_opens_on_get_server_errors_only(server):
+    breaker = LivyCircuitBreaker(failure_threshold=2, reset_timeout=60)
+    livy = ApacheLivy(server.url, access_token="fake-token", max_retries=0, breaker=breaker)
+    server.error_rate, server.error_status = 1, 503
+
+    # Failing writes are not counted
+    for _ in range(3):
+        assert livy.create_session({"kind": "pyspark"}).status_code == 503
+    assert breaker.states() == {}
+
+    for _ in range(2):
+        assert livy.list_sessions().status_code == 503
+    requests_before = server.requests
+    with pytest.raises(LivyCircuitOpenError):
+        livy.list_sessions()
+    assert server.requests == requests_before
+
+
+def test_circuit_breaker_ignores_client_errors_and_throttling(server):
+    breaker = LivyCircuitBreaker(failure_threshold=1, reset_timeout=60)
+    livy = ApacheLivy(server.url, access_token="fake-token", max_retries=0, breaker=breaker)
+
+    assert livy.get_session(999).status_code == 404
+    server.error_rate, server.error_status, server.retry_after = 1, 429, 0
+    assert livy.list_sessions().status_code == 429
+
+    assert breaker.states() == {}
+
+
+def test_circuit_breaker_counts_connection_errors():
+    breaker = LivyCircuitBreaker(failure_threshold=1, reset_timeout=60)
+    # Nothing listens on the discard port
+    livy = ApacheLivy("http://127.0.0.1:9", access_token="fake-token", timeout=1, max_retries=0, breaker=breaker)
+
+    with pytest.raises(requests.ConnectionError):
+        livy.list_sessions()
+    with pytest.raises(LivyCircuitOpenError):
+        livy.list_sessions()
+
+
+def test_scheduler_retries_throttled_calls(server):
+    scheduler = LivyRequestScheduler(rate=0, max_retries=2)
+    livy = ApacheLivy(server.url, access_token="fake-token", max_retries=0, scheduler=scheduler)
+    server.error_rate, server.error_status, server.retry_after = 1, 429, 0
+
+    # Retried twice, then the last throttled response is returned
+    assert livy.list_sessions().status_code == 429
+    assert server.requests == 3
+
+    server.error_rate = 0
+    assert livy.list_sessions().ok
+
+
+def test_log_follower_resumes_in_the_middle_of_a_page(livy):
+    session_id = idle_session(livy)
+    time.sleep(0.2)  # The fake session logs a line per 100 ms
+    follower = livy.follow_session_log(session_id, size=4, wait=0)
+
+    lines = iter(follower)
+    assert [next(lines), next(lines)] == ["stdout: line 0", "stdout: line 1"]
+    assert follower.cursor == 2
+
+    # Reconnecting from the cursor (Last-Event-ID) goes on with the next line of the page
+    assert next(iter(livy.follow_session_log(session_id, from_line=follower.cursor, size=4, wait=0))) == "stdout: line 2"
+
+
+class Response:
+    def __init__(self, name):
+        self.name, self.closed = name, False
+
+    def close(self):
+        self.closed = True
+
+
+def test_hedger_returns_the_first_answer_and_closes_the_other():
+    hedger = LivyHedger(percentile=50, min_delay=0.01, min_samples=3)
+    key = ("http://livy", "GET /sessions/{id}")
+    for _ in range(3):
+        hedger.call(key, lambda: Response("warm-up"))
+    assert hedger.delay(key) == 0.01
+
+    sent, hedges = [], []
+
+    def send():
+        response = Response("hedge" if sent else "slow")
+        sent.append(response)
+        if response.name == "slow":
+            time.sleep(0.3)
+        return response
+
+    started = time.monotonic()
+    resp = hedger.call(key, send, on_hedge=lambda: hedges.append(True))
+
+    assert resp.name == "hedge" and time.monotonic() - started < 0.25
+    assert hedges == [True]
+    # The slow response is closed when it arrives
+    assert not sent[0].closed
+    wait_until(lambda: sent[0].closed)
+
+
+def test_hedger_does_not_hedge_without_enough_samples_or_threads():
+    hedger = LivyHedger(min_delay=0.01, min_samples=3, max_workers=2)
+    key = ("http://livy", "GET /sessions")
+    assert hedger.delay(key) is None
+    for _ in range(3):
+        hedger.call(key, lambda: Response("warm-up"))
+
+    # Both threads taken: called directly, once
+    assert hedger._reserve(2)
+    calls = []
+    hedger.call(key, lambda: calls.append(time.sleep(0.05)) or Response("direct"))
+    hedger._release(2)
+    assert len(calls) == 1
+
+
+def test_client_hedges_slow_reads_only(server):
+    hedger = LivyHedger(percentile=50, min_delay=0.01, min_samples=3)
+    livy = ApacheLivy(server.url, access_token="fake-token", max_retries=0, hedger=hedger)
+    for _ in range(3):
+        livy.list_sessions()
+
+    server.latency = 0.2
+    requests_before = server.requests
+    assert livy.list_sessions().ok
+    wait_until(lambda: server.requests - requests_before == 2)
+
+    requests_before = server.requests
+    assert livy.create_session({"kind": "pyspark"}).ok
+    time.sleep(0.25)
+    assert server.requests - requests_before == 1
+
+
+def test_metrics_are_recorded_by_route_template(server):
+    metrics = LivyMetrics(latency_buckets=(60,), size_buckets=(1024,))
+    livy = ApacheLivy(server.url, access_token="fake-token", max_retries=0, metrics=metrics)
+    session_id = livy.create_session({"kind": "pyspark"}).json()["id"]
+    livy.get_session(session_id)
+    livy.get_session(999)
+
+    text = metrics.render()
+
+    assert 'livy_requests_total{method="POST",route="/sessions",status="201"} 1' in text
+    assert 'livy_requests_total{method="GET",route="/sessions/{id}",status="200"} 1' in text
+    assert 'livy_requests_total{method="GET",route="/sessions/{id}",status="404"} 1' in text
+    assert 'livy_request_duration_seconds_bucket{method="GET",route="/sessions/{id}",le="60"} 2' in text
+    assert 'livy_response_size_bytes_count{method="POST",route="/sessions"} 1' in text
+
+
+def test_metrics_count_the_calls_without_response():
+    metrics = LivyMetrics()
+    breaker = LivyCircuitBreaker(failure_threshold=1, reset_timeout=60)
+    livy = ApacheLivy("http://127.0.0.1:9", access_token="fake-token", timeout=1, max_retries=0, metrics=metrics, breaker=breaker)
+
+    with pytest.raises(requests.ConnectionError):
+        livy.list_sessions()
+    with pytest.raises(LivyCircuitOpenError):
+        livy.list_sessions()
+
+    text = metrics.render()
+    assert 'livy_requests_total{method="GET",route="/sessions",status="error"} 1' in text
+    assert 'livy_request_errors_total{method="GET",route="/sessions",error="ConnectionError"} 1' in text
+    assert 'livy_circuit_rejections_total{method="GET",route="/sessions"} 1' in text
+
+
+def test_large_request_bodies_are_sent_compressed(server):
+    livy = ApacheLivy(server.url, access_token="fake-token", max_retries=0, compress_min_bytes=1024)
+    session_id = idle_session(livy)
+    code = "x = 1\n" * 1000
+
+    requests_before = server.requests
+    assert livy.submit_statement(session_id, code).ok
+    assert livy.submit_statement(session_id, "small").ok
+
+    assert [statement["code"] for statement in server.sessions[session_id]["statements"]] == [code, "small"]
+    assert server.requests - requests_before == 2
+
+
+def test_compression_stops_when_the_backend_refuses_it(server):
+    server.gzip_requests = False
+    livy = ApacheLivy(server.url, access_token="fake-token", max_retries=0, compress_min_bytes=1024)
+    session_id = idle_session(livy)
+    code = "x = 1\n" * 1000
+
+    # Refused with 415, sent again uncompressed
+    requests_before = server.requests
+    assert livy.submit_statement(session_id, code).ok
+    assert server.requests - requests_before == 2
+    assert livy.compress_min_bytes == 0
+    assert server.sessions[session_id]["statements"][0]["code"] == code
+
+
+def test_large_responses_are_received_compressed(server, livy):
+    server.output_size = 20000
+    session_id = idle_session(livy)
+    livy.submit_statement(session_id, "spark.range(10).show()")
+    livy.wait_for_statement(session_id, 0, poll_interval=0.01)
+
+    resp = livy.get_statement(session_id, 0, stream=True)
+
+    assert resp.headers["Content-Encoding"] == "gzip" and int(resp.headers["Content-Length"]) < 20000
+    assert len(read_json(resp, max_memory=0)["output"]["data"]["text/plain"]) == 20000
@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from myapp.api.async_apache_livy import AsyncApacheLivy
+from myapp.api.livy_metrics import LivyMetrics
+from myapp.api.livy_models import body
+
+
+def run(server, test, **kwargs):
+    # A client per event loop, closed with it
+    async def main():
+        async with AsyncApacheLivy(server.url if server else "http://127.0.0.1:9", access_token="fake-token", timeout=5,
+                                   max_retries=0, **kwargs) as livy:
+            return await test(livy)
+    return asyncio.run(main())
+
+
+def test_statements_run_and_are_waited_for(server):
+    async def test(livy):
+        session_id = body(await livy.create_session({"kind": "pyspark"}))["id"]
+        assert body(await livy.wait_for_session(session_id, poll_interval=0.01))["state"] == "idle"
+        await livy.submit_statement(session_id, "1 + 1")
+        return await livy.wait_for_statement(session_id, 0, poll_interval=0.01)
+
+    statement = body(run(server, test))
+
+    assert statement["state"] == "available" and statement["output"]["status"] == "ok"
+
+
+def test_concurrent_calls_share_the_event_loop(server):
+    server.latency = 0.2
+
+    async def test(livy):
+        started = time.monotonic()
+        responses = await asyncio.gather(*(livy.list_sessions() for _ in range(10)))
+        return responses, time.monotonic() - started
+
+    responses, elapsed = run(server, test, max_connections=10)
+
+    assert all(resp.is_success for resp in responses)
+    assert elapsed < 1
+
+
+def test_large_request_bodies_are_sent_compressed_until_refused(server):
+    server.gzip_requests = False
+    code = "x = 1\n" * 1000
+
+    async def test(livy):
+        session_id = body(await livy.create_session({"kind": "pyspark"}))["id"]
+        await livy.wait_for_session(session_id, poll_interval=0.01)
+        requests_before = server.requests
+        assert (await livy.submit_statement(session_id, code)).is_success
+        return session_id, server.requests - requests_before, livy.compress_min_bytes
+
+    session_id, requests, compress_min_bytes = run(server, test, compress_min_bytes=1024)
+
+    # Refused with 415, sent again uncompressed, and not compressed any more
+    assert requests == 2 and compress_min_bytes == 0
+    assert server.sessions[session_id]["statements"][0]["code"] == code
+
+
+def test_metrics_record_the_calls_and_their_errors(server):
+    metrics = LivyMetrics()
+
+    async def test(livy):
+        await livy.get_session(999)
+
+    async def unreachable(livy):
+        with pytest.raises(httpx.ConnectError):
+            await livy.list_sessions()
+
+    run(server, test, metrics=metrics)
+    run(None, unreachable, metrics=metrics)
+
+    text = metrics.render()
+    assert 'livy_requests_total{method="GET",route="/sessions/{id}",status="404"} 1' in text
+    assert 'livy_request_errors_total{method="GET",route="/sessions",error="ConnectError"} 1' in text
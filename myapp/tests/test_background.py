@@ -0,0 +1,200 @@
+import time
+
+from myapp.api.livy_batch_queue import LivyBatchQueue
+from myapp.api.livy_session_pool import LivySessionPool
+from myapp.api.livy_session_reaper import LivySessionReaper
+from myapp.api.livy_statement_poller import LivyStatementPoller
+
+from conftest import idle_session, wait_until
+
+
+def events(subscription):
+    return [event for event in subscription]
+
+
+def test_poller_pushes_the_states_until_finished(livy):
+    session_id = idle_session(livy)
+    for code in ("1", "raise ValueError()"):
+        livy.submit_statement(session_id, code)
+    finished = []
+    poller = LivyStatementPoller(interval=0.01, max_interval=0.05, on_finished=lambda key, statement: finished.append(statement["id"]))
+
+    subscription = poller.subscribe("key", session_id, [0, 1], lambda: livy)
+    received = events(subscription)
+    subscription.close()
+
+    assert {event["id"] for event in received if event["state"] == "available"} == {0, 1}
+    assert sorted(finished) == [0, 1]
+    assert poller.watched() == (0, 0)
+    poller.stop()
+
+
+def test_poller_retries_transient_errors(server, livy):
+    session_id = idle_session(livy)
+    livy.submit_statement(session_id, "1")
+    server.error_rate, server.error_status = 1, 503
+    poller = LivyStatementPoller(interval=0.01, max_interval=0.05, retries=100)
+
+    subscription = poller.subscribe("key", session_id, [0], lambda: livy)
+    wait_until(lambda: server.requests >= 8)
+    server.error_rate = 0
+    received = events(subscription)
+    subscription.close()
+
+    assert received[-1] == {"id": 0, "state": "available", "progress": 1.0}
+    assert not subscription.failed
+    poller.stop()
+
+
+def test_poller_ends_in_error_past_the_retries(server, livy):
+    session_id = idle_session(livy)
+    livy.submit_statement(session_id, "1")
+    server.error_rate, server.error_status = 1, 503
+    poller = LivyStatementPoller(interval=0.01, max_interval=0.05, retries=2)
+
+    requests_before = server.requests
+    subscription = poller.subscribe("key", session_id, [0], lambda: livy)
+    received = events(subscription)
+    subscription.close()
+
+    assert [event["id"] for event in received] == [0] and "503" in received[0]["error"]
+    assert server.requests - requests_before == 3
+    assert subscription.failed == {0}
+    poller.stop()
+
+
+def test_poller_ends_unknown_sessions_and_statements_at_once(livy):
+    session_id = idle_session(livy)
+    poller = LivyStatementPoller(interval=0.01, max_interval=0.05)
+
+    unknown_session = poller.subscribe("gone", 999, [0], lambda: livy)
+    unknown_statement = poller.subscribe("key", session_id, [5], lambda: livy)
+
+    assert "404" in events(unknown_session)[0]["error"]
+    assert events(unknown_statement) == [{"id": 5, "error": "Statement 5 not found"}]
+    poller.stop()
+
+
+def test_poller_survives_failing_callbacks(livy):
+    session_id = idle_session(livy)
+    livy.submit_statement(session_id, "1")
+    livy.submit_statement(session_id, "2")
+
+    def on_finished(key, statement):
+        raise RuntimeError("cache down")
+
+    poller = LivyStatementPoller(interval=0.01, max_interval=0.05, on_finished=on_finished)
+    first = poller.subscribe("key", session_id, [0], lambda: livy)
+    assert events(first)[-1]["state"] == "available"
+    first.close()
+
+    second = poller.subscribe("key", session_id, [1], lambda: livy)
+    assert events(second)[-1]["state"] == "available"
+    assert poller._worker.is_alive()
+    poller.stop()
+
+
+def test_reaper_deletes_idle_sessions(server, livy):
+    session_id = idle_session(livy, {"kind": "pyspark", "name": "Test-1"})
+    other_id = idle_session(livy, {"kind": "pyspark", "name": "Other-1"})
+    reaped, released = [], []
+    reaper = LivySessionReaper(name_prefix="Test-", idle_ttl=0.1, interval=60, on_reap=released.append)
+    reaper.touch("owner", session_id, lambda: livy, on_reap=reaped.append)
+
+    time.sleep(0.15)
+    assert reaper.reap() == [session_id]
+    assert reaped == released == [session_id]
+    assert server.sessions[session_id]["deleted"]
+    assert not server.sessions[other_id].get("deleted")
+    reaper.stop()
+
+
+def test_reaper_keeps_sessions_active_in_other_processes(server, livy):
+    active_id = idle_session(livy, {"kind": "pyspark", "name": "Test-active"})
+    abandoned_id = idle_session(livy, {"kind": "pyspark", "name": "Test-abandoned"})
+    heartbeats = {active_id: time.time(), abandoned_id: time.time() - 60}
+    released = []
+    reaper = LivySessionReaper(name_prefix="Test-", idle_ttl=30, interval=60, last_activity=heartbeats.get, on_reap=released.append)
+    reaper.touch("owner", active_id, lambda: livy)
+
+    # Found without being touched here: idle since its last heartbeat, reaped and released
+    assert reaper.reap() == [abandoned_id]
+    assert released == [abandoned_id]
+    assert not server.sessions[active_id].get("deleted")
+    reaper.stop()
+
+
+def test_reaper_waits_for_livy_to_answer(server, livy, caplog):
+    session_id = idle_session(livy, {"kind": "pyspark", "name": "Test-1"})
+    reaper = LivySessionReaper(name_prefix="Test-", idle_ttl=0, interval=60)
+    reaper.touch("owner", session_id, lambda: livy)
+
+    server.error_rate, server.error_status = 1, 503
+    assert reaper.reap() == []
+    assert [record.getMessage() for record in caplog.records] == ["Error reaping the idle Livy sessions of owner"]
+    assert caplog.records[0].levelname == "WARNING" and caplog.records[0].exc_info
+    server.error_rate = 0
+    assert reaper.reap() == [session_id]
+    reaper.stop()
+
+
+def test_pool_hands_out_idle_sessions_only(server, livy):
+    pool = LivySessionPool(lambda: livy, lambda: {"kind": "pyspark", "name": "Pool"}, size=1, idle_ttl=60, start_wait=5)
+    pool.replenish()
+    wait_until(lambda: len(pool) == 1)
+    session_id = next(iter(pool._ready))[0]
+
+    # Deleted behind the pool's back: not handed out
+    livy.delete_session(session_id)
+    assert pool.acquire() is None
+
+    wait_until(lambda: len(pool) == 1)
+    assert pool.acquire() not in (None, session_id)
+    pool.close()
+
+
+def test_pool_deletes_expired_sessions_once_livy_answers(server, livy):
+    pool = LivySessionPool(lambda: livy, lambda: {"kind": "pyspark", "name": "Pool"}, size=1, idle_ttl=0.1, start_wait=5)
+    pool.replenish()
+    wait_until(lambda: len(pool) == 1)
+    session_id = next(iter(pool._ready))[0]
+    time.sleep(0.1)
+
+    server.error_rate, server.error_status = 1, 503
+    pool.expire()
+    assert session_id in pool
+
+    server.error_rate = 0
+    pool.expire()
+    assert session_id not in pool and server.sessions[session_id]["deleted"]
+    pool.close()
+
+
+def test_batch_queue_caps_running_jobs_per_owner(livy):
+    queue = LivyBatchQueue(max_running=4, max_running_per_owner=1, poll_interval=0.02, max_poll_interval=0.05)
+
+    first = queue.submit("alice", {"file": "job.py"}, lambda: livy)
+    second = queue.submit("alice", {"file": "job.py"}, lambda: livy)
+    other = queue.submit("bob", {"file": "job.py"}, lambda: livy)
+    wait_until(lambda: first.batch_id is not None and other.batch_id is not None)
+    assert second.batch_id is None
+
+    wait_until(lambda: second.ended)
+    assert [job.state for job in (first, second, other)] == ["success"] * 3
+    queue.close()
+
+
+def test_batch_queue_fails_lost_jobs(server, livy):
+    queue = LivyBatchQueue(poll_interval=0.01, max_poll_interval=0.02, max_poll_failures=3)
+
+    job = queue.submit("alice", {"file": "job.py"}, lambda: livy)
+    wait_until(lambda: job.batch_id is not None)
+    server.error_rate, server.error_status = 1, 503
+    # Failed, then its batch deletion fails too
+    wait_until(lambda: job.ended and "delete failed" in job.error)
+
+    assert job.state == "failed"
+    assert job.error.startswith("Lost, state unknown after 3 failed checks: HTTP 503")
+    assert job.error.endswith("; delete failed: 503 Server Error: Service Unavailable for url: " + server.url + "/batches/" + str(job.batch_id))
+    assert len(queue) == 0
+    queue.close()
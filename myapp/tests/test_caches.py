@@ -0,0 +1,228 @@
+import threading
+import time
+
+import pytest
+
+from myapp.api.apache_livy import ApacheLivy
+from myapp.api.graph_client import GraphClient
+from myapp.api.livy_client_registry import LivyClientRegistry
+from myapp.api.livy_output_store import LivyOutputStore
+from myapp.api.livy_session_registry import LivySessionRegistry, LivySessionLimitError
+from myapp.api.livy_statement_cache import LivyStatementCache
+from myapp.api.livy_token_manager import LivyTokenManager, LivyTokenError
+
+from conftest import wait_until
+
+SESSION = ("apache", "alice", 1700000000.0, "1")
+
+
+def test_statement_cache_is_scoped_by_session_start():
+    cache = LivyStatementCache(max_bytes=1024, max_entry_bytes=512)
+    cache.put(SESSION + ("0",), {"state": "available"})
+
+    # Same Livy IDs, session started again (Livy restarted): not served
+    assert cache.get(("apache", "alice", 1700000100.0, "1", "0")) is None
+    assert cache.get(("apache", "bob") + SESSION[2:] + ("0",)) is None
+    assert cache.get(SESSION + ("0",)) == {"state": "available"}
+
+    cache.discard_session(SESSION)
+    assert cache.get(SESSION + ("0",)) is None
+
+
+def test_statement_cache_bounds():
+    cache = LivyStatementCache(max_bytes=100, max_entry_bytes=60)
+
+    assert not cache.put(SESSION + ("0",), "x" * 100)
+    for statement_id in range(3):
+        assert cache.put(SESSION + (str(statement_id),), "x" * 40)
+    assert cache.get(SESSION + ("0",)) is None
+    assert len(cache) == 2
+    assert not LivyStatementCache(max_bytes=0).put(SESSION + ("0",), "x")
+
+
+def test_client_registry_rotates_tokens_and_evicts():
+    closed = []
+    registry = LivyClientRegistry(lambda token: ApacheLivy("http://livy", access_token=token), max_size=2, on_evict=closed.append)
+
+    first = registry.get("alice", "token-1")
+    assert registry.get("alice", "token-2") is first and first.access_token == "token-2"
+    registry.get("bob", "token")
+    registry.get("carol", "token")
+
+    assert closed == [first]
+    assert registry.peek("alice") is None and len(registry) == 2
+
+
+def test_session_registry_claims(tmp_path):
+    registry = LivySessionRegistry(str(tmp_path / "sessions.sqlite3"), max_per_owner=1, heartbeat_interval=0)
+
+    assert registry.claim("apache", "scope-1", "alice") == (None, True)
+    # Being created by the first request
+    assert registry.claim("apache", "scope-1", "alice") == (None, False)
+    assert registry.session("apache", "scope-1") is None
+    with pytest.raises(LivySessionLimitError):
+        registry.claim("apache", "scope-2", "alice")
+
+    registry.activate("apache", "scope-1", 7)
+    assert registry.claim("apache", "scope-1", "alice") == (7, False)
+    assert registry.session("apache", "scope-1") == 7
+    assert registry.owner("apache", 7) == "alice"
+    assert registry.last_activity("apache", 7) is not None
+
+    registry.release("apache", session_id=7)
+    assert registry.sessions() == []
+    assert registry.last_activity("apache", 7) is None
+    assert registry.claim("apache", "scope-2", "alice") == (None, True)
+
+
+def test_session_registry_is_shared_by_processes(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    worker, other_worker = LivySessionRegistry(path), LivySessionRegistry(path)
+
+    worker.claim("apache", "scope", "alice")
+    worker.activate("apache", "scope", 3)
+
+    assert other_worker.session("apache", "scope") == 3
+    assert other_worker.sessions("alice") == [("scope", 3)]
+
+
+def test_session_registry_drops_stale_sessions(tmp_path):
+    registry = LivySessionRegistry(str(tmp_path / "sessions.sqlite3"), stale_after=0, claim_timeout=0)
+
+    registry.claim("apache", "scope", "alice")
+    registry.activate("apache", "scope", 3)
+
+    assert registry.session("apache", "scope") is None
+    assert registry.sessions() == []
+
+
+def test_output_store_spills_large_values_only(tmp_path):
+    store = LivyOutputStore(threshold=1000, directory=str(tmp_path))
+    key = SESSION + ("0",)
+
+    output = store.put_output(key, {"text/plain": "small", "application/json": {"values": list(range(1000))}})
+
+    assert output["text/plain"] == "small"
+    content_type, size = output["application/json"]
+    assert content_type == "application/json" and size >= 1000
+    assert not store.has(key, "text/plain")
+    assert store.read(key, "application/json", offset=0, length=11) == b'{"values": '
+
+    store.discard_session(SESSION)
+    assert store.read(key, "application/json") is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_output_store_stores_tables_as_csv(tmp_path):
+    store = LivyOutputStore(threshold=10, directory=str(tmp_path))
+    table = {"headers": [{"name": "id"}, {"name": "name"}], "data": [[1, "a,b"], [2, "c"]]}
+
+    output = store.put_output(SESSION + ("0",), {"application/vnd.livy.table.v1+json": table})
+
+    assert output["application/vnd.livy.table.v1+json"][0].startswith("text/csv")
+    assert store.read(SESSION + ("0",), "application/vnd.livy.table.v1+json").splitlines() == [b"id,name", b'1,"a,b"', b"2,c"]
+
+
+def acquirer(app):
+    # Livy token of the fake MSAL application, as acquired by the views
+    def acquire():
+        result = app.acquire_token_silent(["https://api.fabric.microsoft.com/.default"], account=None)
+        if "access_token" not in result:
+            raise LivyTokenError(result["error_description"])
+        return result["access_token"], result["expires_in"]
+    return acquire
+
+
+def test_token_manager_collapses_concurrent_refreshes(msal_app):
+    app = msal_app(latency=0.1)
+    tokens = LivyTokenManager(refresh_margin=300)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(tokens.get_token("alice", acquirer(app)))) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert app.calls == 1
+    assert len(set(results)) == 1
+
+
+def test_token_manager_refreshes_ahead_of_expiry(msal_app):
+    # Valid for less than the refresh margin: served from the cache, refreshed in the background
+    app = msal_app(expires_in=200, latency=0.2)
+    tokens = LivyTokenManager(refresh_margin=300, min_validity=30)
+    token, expires_at = tokens.get_token("alice", acquirer(app))
+
+    started = time.monotonic()
+    assert tokens.get_token("alice", acquirer(app)) == (token, expires_at)
+    assert time.monotonic() - started < 0.1
+    wait_until(lambda: app.calls == 2)
+    wait_until(lambda: tokens.get_token("alice", acquirer(app))[0] != token)
+
+
+def test_token_manager_refreshes_expired_tokens_at_once(msal_app):
+    app = msal_app(expires_in=10)
+    tokens = LivyTokenManager(refresh_margin=300, min_validity=30)
+    token, _ = tokens.get_token("alice", acquirer(app))
+
+    assert tokens.get_token("alice", acquirer(app))[0] != token
+    assert app.calls == 2
+
+
+def test_token_manager_reports_failures_and_recovers(msal_app):
+    app = msal_app(error_rate=1)
+    tokens = LivyTokenManager()
+
+    with pytest.raises(LivyTokenError, match="Injected error"):
+        tokens.get_token("alice", acquirer(app))
+    app.error_rate = 0
+    token, _ = tokens.get_token("alice", acquirer(app))
+
+    tokens.discard("alice")
+    assert tokens.get_token("alice", acquirer(app))[0] == token  # The fake MSAL cache still has it
+    assert app.calls == 2
+
+
+def test_graph_client_follows_all_the_pages_once(server):
+    server.groups = 25
+    graph = GraphClient(ttl=60, page_size=10)
+    url = server.url + "/v1.0/me/memberOf"
+
+    groups = graph.get_all_pages(url, "token", "alice")["value"]
+
+    assert [group["displayName"] for group in groups] == ["Group " + str(i) for i in range(25)]
+    assert server.requests == 3
+    assert graph.get_all_pages(url, "token", "alice")["value"] == groups
+    assert server.requests == 3
+    # Cached per user
+    graph.get_all_pages(url, "token", "bob")
+    assert server.requests == 6
+
+
+def test_graph_client_revalidates_expired_results(server):
+    graph = GraphClient(ttl=0.1)
+    url = server.url + "/v1.0/me"
+    statuses = []
+    graph.http_session.hooks["response"].append(lambda resp, **kwargs: statuses.append(resp.status_code))
+
+    me = graph.get(url, "token", "alice")
+    assert graph.get(url, "token", "alice") == me
+    time.sleep(0.15)
+    assert graph.get(url, "token", "alice") == me
+
+    # Fresh from the cache, then revalidated with its ETag
+    assert statuses == [200, 304]
+
+
+def test_graph_client_does_not_cache_errors(server):
+    graph = GraphClient(ttl=60, page_size=10)
+    url = server.url + "/v1.0/me/memberOf"
+    server.error_rate, server.error_status = 1, 503
+
+    assert graph.get_all_pages(url, "token", "alice") == {"msg": "Injected error"}
+    server.error_rate = 0
+    assert len(graph.get_all_pages(url, "token", "alice")["value"]) == 10
+
+    graph.invalidate("alice")
+    graph.get_all_pages(url, "token", "alice")
+    assert server.requests == 3
@@ -0,0 +1,20 @@
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+
+from myapp.config import Config
+
+REQUIRED = {
+    "GRAPH_USER_ENDPOINT": "http://graph/me", "GRAPH_MEMBER_ENDPOINT": "http://graph/memberOf", "LIVY_BACKEND": "apache",
+    "LIVY_BASE_ENDPOINT": "http://livy", "LIVY_REQUESTS_TIMEOUT": "30", "LIVY_SESSION_NAME_PREFIX": "MyApp-",
+}
+
+
+def test_roles_default_to_no_mapping():
+    assert Config(REQUIRED).roles == {}
+    assert Config(dict(REQUIRED, ROLES='{"group-id": "Editors"}')).roles == {"group-id": "Editors"}
+
+
+@pytest.mark.parametrize("roles", ['["Editors"]', '{"group-id": 1}', "{'group-id': 'Editors'}"])
+def test_invalid_roles_are_reported(roles):
+    with pytest.raises(ImproperlyConfigured, match="ROLES must be"):
+        Config(dict(REQUIRED, ROLES=roles))
@@ -0,0 +1,71 @@
+import threading
+from importlib import import_module
+
+import pytest
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+
+from myapp.api.livy_state_store import SessionLivyStateStore, MemoryLivyStateStore, CacheLivyStateStore
+
+
+@pytest.fixture(params=["session", "memory", "cache"])
+def store(request, app_server):
+    if request.param == "session":
+        return SessionLivyStateStore(import_module(settings.SESSION_ENGINE).SessionStore)
+    if request.param == "memory":
+        return MemoryLivyStateStore(ttl=60)
+    return CacheLivyStateStore(LocMemCache("livy-state-test-" + request.node.name, {}), ttl=60)
+
+
+@pytest.fixture
+def scope(store):
+    # A stored session (its key), like the scope of the background work
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    session.create()
+    return session.session_key
+
+
+def test_get_many_returns_the_values_set(store, scope):
+    store.set_many(scope, {"livy_token": "token", "livy_session_id": 3})
+
+    assert store.get_many(scope, ["livy_token", "livy_session_id", "missing"]) == {"livy_token": "token", "livy_session_id": 3}
+    assert store.get(scope, "missing", "default") == "default"
+    assert store.get_many("other-scope", ["livy_token"]) == {}
+
+
+def test_delete_then_append_starts_a_new_list(store, scope):
+    store.set(scope, "livy_session_id", 3)
+    assert store.append(scope, "livy_statement_ids", 0, 1) == 2
+
+    store.delete(scope, "livy_session_id", "livy_statement_ids")
+    assert store.get_many(scope, ["livy_session_id", "livy_statement_ids"]) == {}
+    assert store.get_list(scope, "livy_statement_ids") == []
+
+    assert store.append(scope, "livy_statement_ids", 5) == 1
+    assert store.get_list(scope, "livy_statement_ids") == [5]
+
+
+@pytest.mark.parametrize("store", ["memory", "cache"], indirect=True)
+def test_concurrent_appends_are_all_kept(store, scope):
+    lengths = []
+    threads = [threading.Thread(target=lambda i=i: lengths.append(store.append(scope, "livy_statement_ids", i))) for i in range(50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(lengths) == list(range(1, 51))
+    assert sorted(store.get_list(scope, "livy_statement_ids")) == list(range(50))
+
+
+@pytest.mark.parametrize("store", ["session"], indirect=True)
+def test_session_store_appends_are_not_atomic(store, scope):
+    # Two requests of one browser session, each with its copy of the session: the last save wins
+    first, second = (import_module(settings.SESSION_ENGINE).SessionStore(session_key=scope) for _ in range(2))
+
+    store.append(first, "livy_statement_ids", 0)
+    store.append(second, "livy_statement_ids", 1)
+    first.save()
+    second.save()
+
+    assert store.get_list(scope, "livy_statement_ids") == [1]
@@ -0,0 +1,210 @@
+import gzip
+import json
+import time
+
+import benchmark
+from myapp.api.async_apache_livy import AsyncApacheLivy
+
+from conftest import started_session, stream_events, wait_until
+
+
+def test_tail_log_event_ids_are_line_cursors(app_server, client):
+    started_session(client)
+
+    events = stream_events(client.get("/tailLivyLog"), 3)
+
+    assert [(event["id"], event["data"]) for event in events] == [("1", "stdout: line 0"), ("2", "stdout: line 1"), ("3", "stdout: line 2")]
+
+
+def test_tail_log_reconnects_in_the_middle_of_a_page(app_server, client):
+    started_session(client)
+    stream_events(client.get("/tailLivyLog"), 2)
+
+    # EventSource reconnecting after the second line
+    events = stream_events(client.get("/tailLivyLog", HTTP_LAST_EVENT_ID="2"), 2)
+
+    assert [(event["id"], event["data"]) for event in events] == [("3", "stdout: line 2"), ("4", "stdout: line 3")]
+
+
+def test_batch_logs_are_scoped_to_their_owner(app_server, client):
+    other = benchmark.login("-test-other")
+    client.post("/submitLivyBatch", {"livy_batch_file": "abfss://jobs/job.py"})
+    wait_until(lambda: client.get("/getLivyBatches").json()["batches"][0]["batch_id"] is not None)
+    batch_id = client.get("/getLivyBatches").json()["batches"][0]["batch_id"]
+
+    assert other.get("/tailLivyLog", {"batch_id": batch_id}).status_code == 404
+    assert other.get("/livyLog", {"batch_id": batch_id}).status_code == 404
+    assert client.get("/livyLog", {"batch_id": batch_id}).status_code == 200
+    events = stream_events(client.get("/tailLivyLog", {"batch_id": batch_id}), 1)
+    assert events[0]["data"].startswith("stdout: line")
+
+
+def test_async_views_close_their_clients_under_wsgi(app_server, client, monkeypatch):
+    closed = []
+    aclose = AsyncApacheLivy.aclose
+
+    async def spy(livy):
+        closed.append(livy)
+        await aclose(livy)
+
+    monkeypatch.setattr(AsyncApacheLivy, "aclose", spy)
+    from myapp.views import livy_async_clients
+
+    assert client.get("/async/createLivySession").status_code == 200
+    response = client.get("/async/checkLivySession", {"wait": 5})
+
+    assert b"idle" in response.content
+    # One event loop, and one client, per request
+    assert len(closed) == 2 and all(livy.http_client.is_closed for livy in closed)
+    assert len(livy_async_clients) == 0
+
+
+def test_metrics_view_exports_the_livy_calls(app_server, client, monkeypatch):
+    started_session(client)
+    from django.test import Client
+    from myapp.views import config
+
+    response = Client().get("/metrics")
+
+    assert response.status_code == 200 and response["Content-Type"].startswith("text/plain; version=0.0.4")
+    assert 'livy_requests_total{method="POST",route="/sessions",status="201"}' in response.content.decode()
+
+    monkeypatch.setattr(config, "livy_metrics_token", "secret")
+    assert Client().get("/metrics").status_code == 401
+    assert Client().get("/metrics", HTTP_AUTHORIZATION="Bearer secret").status_code == 200
+
+
+def test_result_pages_and_downloads_are_compressed(app_server, client, monkeypatch):
+    monkeypatch.setattr(app_server, "output_size", 300000)
+    started_session(client)
+    assert client.post("/submitLivyStatement", {"livy_code": "spark.range(10).show()"}).status_code == 200
+
+    page = client.get("/getLivyStatement", {"id": 0, "wait": 5}, HTTP_ACCEPT_ENCODING="gzip")
+    assert page["Content-Encoding"] == "gzip"
+    assert b"x" * 79 in gzip.decompress(page.content)
+
+    download = client.get("/getLivyStatementOutput", {"id": 0, "download": 1}, HTTP_ACCEPT_ENCODING="gzip")
+    assert download["Content-Encoding"] == "gzip" and not download.has_header("Accept-Ranges")
+    assert len(gzip.decompress(b"".join(download.streaming_content))) == 300000
+
+    # Byte ranges are of the uncompressed output
+    part = client.get("/getLivyStatementOutput", {"id": 0, "download": 1}, HTTP_ACCEPT_ENCODING="gzip", HTTP_RANGE="bytes=0-9")
+    assert part.status_code == 206 and not part.has_header("Content-Encoding")
+    assert b"".join(part.streaming_content) == b"x" * 10
+
+
+def test_event_streams_are_not_compressed(app_server, client):
+    started_session(client)
+    client.post("/submitLivyStatement", {"livy_code": "1"})
+
+    response = client.get("/streamLivyStatements", HTTP_ACCEPT_ENCODING="gzip")
+
+    assert not response.has_header("Content-Encoding")
+    assert stream_events(response, 1)
+
+
+def test_livy_views_require_a_login(app_server):
+    from django.test import Client
+    anonymous = Client()
+
+    for path in ("/createLivySession", "/getLivyStatements", "/submitLivyBatch", "/async/createLivySession"):
+        response = anonymous.get(path)
+        assert response.status_code == 302 and response["Location"] == "/azure_auth/login?next=" + path
+
+
+def test_member_of_lists_all_the_groups(app_server, client, monkeypatch):
+    from myapp.views import graphClient
+    client.get("/memberOf")
+    # More groups than a Graph page (999), once the cached result of the user (account of the fake MSAL application) is dropped
+    monkeypatch.setattr(app_server, "groups", 1500)
+    assert "Group 1499" not in client.get("/memberOf").content.decode()
+    graphClient().invalidate("fake-uid.fake-tid")
+
+    content = client.get("/memberOf").content.decode()
+
+    assert "Group 0" in content and "Group 1499" in content
+
+
+def test_index_and_me(app_server, client):
+    assert b"<h1>" in client.get("/").content
+    assert b"Result of Me" in client.get("/me").content
+
+
+def test_session_lifecycle(app_server, client):
+    from myapp.views import livyState
+    session_id = started_session(client)
+
+    response = client.post("/submitLivyStatement", {"livy_code": "1 + 1"})
+    assert b"Statement ID:0" in response.content
+    assert b"Result:" in client.get("/getLivyStatement", {"id": 0, "wait": 5}).content
+    statements = client.get("/getLivyStatements").json()
+    assert statements["session_id"] == session_id
+    assert [(statement["id"], statement["status"]) for statement in statements["statements"]] == [(0, "ok")]
+
+    assert b"API result" in client.get("/stopLivySession").content
+    assert app_server.sessions[session_id]["deleted"]
+    assert livyState().get(client.session.session_key, "livy_session_id") is None
+
+
+def test_cells_stop_at_the_failing_cell(app_server, client):
+    started_session(client)
+
+    response = client.post("/submitLivyCells", {"livy_cells": "1\n# %%\nraise ValueError()\n# %%\n3"})
+    assert b"The next 2 cell(s) are submitted one after the other" in response.content
+
+    def statuses():
+        return [statement["status"] for statement in client.get("/getLivyStatements").json()["statements"]]
+    wait_until(lambda: statuses() == ["ok", "error"])
+    time.sleep(0.2)
+    assert statuses() == ["ok", "error"]
+
+
+def test_statement_stream_ends_with_the_statements(app_server, client):
+    started_session(client)
+    for code in ("1", "2"):
+        client.post("/submitLivyStatement", {"livy_code": code})
+
+    events = stream_events(client.get("/streamLivyStatements"), 10)
+
+    finished = [json.loads(event["data"]) for event in events if "event" not in event and json.loads(event["data"])["state"] == "available"]
+    assert sorted(statement["id"] for statement in finished) == [0, 1]
+    assert events[-1] == {"event": "end", "data": "All the statements finished"}
+
+
+def test_livy_errors_are_reported(app_server, client, monkeypatch):
+    started_session(client)
+    monkeypatch.setattr(app_server, "error_rate", 1)
+    monkeypatch.setattr(app_server, "error_status", 400)
+
+    response = client.post("/submitLivyStatement", {"livy_code": "1"})
+
+    assert response.status_code == 200 and b"Response [400]" in response.content
+    monkeypatch.setattr(app_server, "error_rate", 0)
+    assert client.get("/getLivyStatements").json()["statements"] == []
+
+
+def test_batches_are_queued_and_cancelled_by_their_owner(app_server, client):
+    other = benchmark.login("-test-other")
+    client.post("/submitLivyBatch", {"livy_batch_file": "abfss://jobs/job.py"})
+    job_id = client.get("/getLivyBatches").json()["batches"][0]["id"]
+
+    assert other.get("/getLivyBatches").json()["batches"] == []
+    assert b"Unknown batch job" in other.get("/cancelLivyBatch", {"id": job_id}).content
+
+    client.get("/cancelLivyBatch", {"id": job_id})
+    wait_until(lambda: client.get("/getLivyBatches").json()["batches"][0]["state"] in ("cancelled", "dead"))
+
+
+def test_async_session_lifecycle(app_server, client):
+    assert b"Livy Session ID" in client.get("/async/createLivySession").content
+    assert b"idle" in client.get("/async/checkLivySession", {"wait": 5}).content
+    from myapp.views import livyState
+    session_id = livyState().get(client.session.session_key, "livy_session_id")
+
+    assert b"Statement ID:0" in client.post("/async/submitLivyStatement", {"livy_code": "1 + 1"}).content
+    assert b"Result:" in client.get("/async/getLivyStatement", {"id": 0, "wait": 5}).content
+    events = stream_events(client.get("/async/streamLivyStatements"), 10)
+    assert events[-1] == {"event": "end", "data": "All the statements finished"}
+
+    client.get("/async/stopLivySession")
+    assert app_server.sessions[session_id]["deleted"]